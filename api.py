@@ -0,0 +1,318 @@
+#! usr/bin/env Python3
+
+# Read-only HTTP/JSON API over the CardDB search and lookup operations.
+#
+#     python api.py --host 127.0.0.1 --port 8080
+#
+#     GET /cards?last=smith&year=1985..1990&sort=year&limit=25 search, same terms as 'main.py search'
+#     GET /cards?...&after_id=812&after_value=1987             the page after a previous response's 'next'
+#     GET /cards/42                                            one card by ID
+#     GET /find?q=ripken+orioles&limit=25&offset=25            free-text search, best matches first
+#     GET /reports/sport?year=gt1985                           one of the reports in queries.reports
+#
+# Requests are parsed on an asyncio event loop and their queries run on a thread pool the size of
+# the database connection pool (maxconn in carddb.ini, or CARDDB_MAXCONN), so a slow query only
+# holds up its own request. Everything runs against the database configured for db.py.
+
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import json
+import urllib.parse
+
+import psycopg2
+
+import cards
+import db
+import main
+import queries
+import query_builder
+
+
+max_limit = 100
+
+# Worker threads that run the queries, created by serve()
+executor = None
+
+status_text = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+#---QUERIES----------------------------------------------------------------------------------------------------
+
+
+def card_json(card):
+    # One card as a JSON-ready dict keyed by column name
+    return card._asdict()
+
+
+def read_only(conn):
+    # The API never writes, so its pooled connections run read-only transactions
+    if not conn.readonly:
+        conn.readonly = True
+
+
+def search_cards(conn, s_where, s_params, sort_key, after, limit):
+    # Count the matches and fetch one page of them, see main.page_sql()
+    read_only(conn)
+    with conn.cursor() as cur:
+        queries.execute(cur, queries.count_query(s_where), s_params, kind='count')
+        total_rows = cur.fetchone()[0]
+        queries.execute(cur, *main.page_sql(s_where, s_params, sort_key, after, 'next', limit), kind='page')
+        return total_rows, cur.fetchall()
+
+
+def lookup_card(conn, id_choice):
+    # One card by ID, or None
+    read_only(conn)
+    with conn.cursor() as cur:
+        queries.run(cur, 'card_by_id', (id_choice,))
+        return cur.fetchone()
+
+
+def find_cards(conn, ts_query, limit, offset):
+    # Count the free-text matches and fetch one page of them, see queries.find_query()
+    read_only(conn)
+    with conn.cursor() as cur:
+        queries.execute(cur, queries.find_count_query(), (ts_query,), kind='find_count')
+        total_rows = cur.fetchone()[0]
+        queries.execute(cur, queries.find_query(), (ts_query, limit, offset), kind='find_page')
+        return total_rows, cur.fetchall()
+
+
+def report_rows(conn, name, s_where, s_params):
+    # One aggregated report, see queries.report_query()
+    read_only(conn)
+    with conn.cursor() as cur:
+        queries.execute(cur, queries.report_query(name, s_where), s_params, kind='report_' + name)
+        return [col.name for col in cur.description], cur.fetchall()
+
+
+async def run_read(fn, *args):
+    # Run a read on the worker threads, with db.read() retrying it if its connection drops
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(db.read, fn, *args))
+
+
+#---ROUTES-----------------------------------------------------------------------------------------------------
+
+
+def seek_value(sort_key, value):
+    # The sort column's value in a seek row, checked and converted like a search term's value
+    # 'null' is the value of a row whose sort column is empty, as returned in a page's 'next'
+    if value is None:
+        raise ValueError('after_value is required with after_id unless sorting by id')
+    if value.strip().lower() == 'null':
+        if sort_key not in main.nullable_keys:
+            raise ValueError('after_value: {} is never empty'.format(main.columns_actual[sort_key]))
+        return None
+    if sort_key in query_builder.text_keys:
+        return value
+    try:
+        return query_builder.parse_value(sort_key, value)
+    except ValueError as e:
+        raise ValueError('after_value: {}'.format(e))
+
+
+def search_params(params, with_paging=True):
+    # Build the WHERE clause, sort key, seek row and limit for GET /cards from its query parameters
+    # Invalid parameters raise ValueError, whose message is returned to the client
+    # Without 'with_paging' only the WHERE clause and its parameters are returned
+    terms = [(col, params[flag]) for col, flag in main.columns_flags.items() if flag in params]
+    s_where, s_params = query_builder.build_where(terms)
+    if not with_paging:
+        return s_where, s_params
+
+    sort_keys = {flag: col for col, flag in main.columns_flags.items()}
+    sort_key = sort_keys.get(params.get('sort', 'id'))
+    if sort_key is None:
+        raise ValueError('sort must be one of ' + ', '.join(sort_keys))
+
+    try:
+        limit = int(params.get('limit', main.page_size))
+    except ValueError:
+        raise ValueError('limit must be a number')
+    if limit < 1 or limit > max_limit:
+        raise ValueError('limit must be between 1 and {}'.format(max_limit))
+
+    # The seek row only needs the ID and the sort column's value
+    after = None
+    if 'after_id' in params:
+        if main.validate_id_int(params['after_id']) != True:
+            raise ValueError('invalid after_id')
+        values = dict.fromkeys(cards.Card._fields)
+        values['ID'] = int(params['after_id'])
+        if sort_key != 'i':
+            values[main.columns_actual[sort_key]] = seek_value(sort_key, params.get('after_value'))
+        after = cards.Card(**values)
+
+    return s_where, s_params, sort_key, after, limit
+
+
+async def get_cards(params):
+    # GET /cards
+    s_where, s_params, sort_key, after, limit = search_params(params)
+    total_rows, rows = await run_read(search_cards, s_where, s_params, sort_key, after, limit)
+
+    page = {'total': total_rows, 'cards': [card_json(row) for row in rows], 'next': None}
+    if len(rows) == limit:
+        last = rows[-1]
+        page['next'] = {'after_id': last.ID}
+        if sort_key != 'i':
+            value = getattr(last, main.columns_actual[sort_key])
+            page['next']['after_value'] = 'null' if value is None else value
+    return 200, page
+
+
+async def get_card(id_choice):
+    # GET /cards/<id>
+    if main.validate_id_int(id_choice) != True:
+        raise ValueError('invalid ID')
+    row = await run_read(lookup_card, int(id_choice))
+    if row is None:
+        return 404, {'error': 'no card with ID ' + id_choice}
+    return 200, card_json(row)
+
+
+async def get_find(params):
+    # GET /find
+    ts_query = query_builder.prefix_tsquery(params.get('q', ''))
+    if ts_query is None:
+        raise ValueError('q must contain at least one letter or number')
+
+    try:
+        limit = int(params.get('limit', main.page_size))
+        offset = int(params.get('offset', 0))
+    except ValueError:
+        raise ValueError('limit and offset must be numbers')
+    if limit < 1 or limit > max_limit:
+        raise ValueError('limit must be between 1 and {}'.format(max_limit))
+    if offset < 0:
+        raise ValueError('offset must not be negative')
+
+    total_rows, rows = await run_read(find_cards, ts_query, limit, offset)
+
+    found = [dict(card_json(cards.Card._make(row[:-1])), rank=row[-1]) for row in rows]
+    page = {'total': total_rows, 'cards': found, 'next': None}
+    if offset + len(rows) < total_rows:
+        page['next'] = {'offset': offset + len(rows)}
+    return 200, page
+
+
+async def get_report(name, params):
+    # GET /reports/<name>
+    if name not in queries.reports:
+        return 404, {'error': 'reports are ' + ', '.join(queries.reports)}
+    s_where, s_params = search_params(params, with_paging=False)
+    columns, rows = await run_read(report_rows, name, s_where, s_params)
+    return 200, {'report': name, 'title': queries.reports[name][0], 'rows': [dict(zip(columns, row)) for row in rows]}
+
+
+async def route(method, target):
+    # Dispatch one request, return (status, JSON-ready body)
+    if method != 'GET':
+        return 405, {'error': 'only GET is supported'}
+
+    url = urllib.parse.urlsplit(target)
+    params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+    parts = [part for part in url.path.split('/') if part != '']
+
+    try:
+        if parts == ['cards']:
+            return await get_cards(params)
+        elif len(parts) == 2 and parts[0] == 'cards':
+            return await get_card(parts[1])
+        elif parts == ['find']:
+            return await get_find(params)
+        elif len(parts) == 2 and parts[0] == 'reports':
+            return await get_report(parts[1], params)
+        return 404, {'error': 'not found'}
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    except psycopg2.OperationalError:
+        return 503, {'error': 'database unavailable'}
+    except psycopg2.Error:
+        return 500, {'error': 'query failed'}
+
+
+#---HTTP-------------------------------------------------------------------------------------------------------
+
+
+async def respond(writer, status, body, keep_alive):
+    # Write a JSON response; dates and Decimal amounts are sent as strings
+    payload = json.dumps(body, default=str).encode('utf-8')
+    head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'\
+           .format(status, status_text[status], len(payload), 'keep-alive' if keep_alive else 'close')
+    writer.write(head.encode('latin-1') + payload)
+    await writer.drain()
+
+
+async def handle_client(reader, writer):
+    # Serve requests on one client connection until it closes, keeping HTTP/1.1 connections alive
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                method, target, version = request_line.decode('latin-1').split()
+                body_length = int(headers.get('content-length') or 0)
+            except ValueError:
+                await respond(writer, 400, {'error': 'malformed request'}, False)
+                break
+
+            # Bodies are not used by any route, but must be read to keep the connection in step
+            if body_length > 0:
+                await reader.readexactly(body_length)
+
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            status, body = await route(method, target)
+            await respond(writer, status, body, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    # Listen until interrupted
+    global executor
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=db.config['maxconn'])
+    server = await asyncio.start_server(handle_client, host, port)
+    print('CardDB API listening on http://{}:{}/cards ({} database connections)'.format(host, port, db.config['maxconn']))
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=True)
+        db.closeall()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read-only HTTP/JSON API for CardDB.', parents=[main.profile_parser()])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    if main.store.name != 'postgres':
+        parser.exit(1, 'The API needs the PostgreSQL backend, CardDB is using {}.\n'.format(main.store.name))
+    main.start_profile(args)
+
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    main.end_profile(args)
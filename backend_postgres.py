@@ -0,0 +1,79 @@
+#! usr/bin/env Python3
+
+# The PostgreSQL storage backend, CardDB's default, which supports every feature.
+#
+# A backend module gives main.py the same few names whichever database holds the cards:
+#
+#     connect(), release(), close_all()   check out, hand back and finally close the session connection
+#     is_alive(), is_disconnect()         whether the connection still works, or an error broke it
+#     execute(), run()                    run a statement from queries.py, or one of its named hot statements
+#     stream()                            the rows of a large SELECT, fetched a batch at a time
+#     insert_many()                       add a list of new Cards with one statement
+#     Error, disconnect_errors            the errors those raise, and the ones that mean the connection was lost
+#
+# The backend is chosen with 'backend' in carddb.ini or CARDDB_BACKEND, see backend_sqlite.py for the other one.
+
+import psycopg2
+import psycopg2.extras
+
+import cards
+import db
+import profiling
+import queries
+
+
+name = 'postgres'
+
+Error = psycopg2.Error
+disconnect_errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+def connect():
+    # Check a live connection out of the pool, see db.getconn()
+    return db.getconn()
+
+
+def release(conn, close=False):
+    # Hand the connection back to the pool, or discard it if 'close'
+    db.putconn(conn, close=close)
+
+
+def close_all():
+    # Close every pooled connection when the program exits
+    db.closeall()
+
+
+def is_alive(conn):
+    return db.is_alive(conn)
+
+
+def is_disconnect(conn):
+    return db.is_disconnect(conn)
+
+
+def execute(cur, sql, params=(), kind=None):
+    # Statements are PREPAREd once per connection, see queries.execute()
+    return queries.execute(cur, sql, params, kind)
+
+
+def run(cur, key, params=()):
+    return queries.run(cur, key, params)
+
+
+def stream(conn, sql, params=(), itersize=2000):
+    # Yield the rows of a SELECT through a named (server-side) cursor, holding 'itersize' rows at a time
+    s_cur = conn.cursor(name='carddb_stream')
+    s_cur.itersize = itersize
+    try:
+        s_cur.execute(sql, params)
+        yield from s_cur
+    finally:
+        s_cur.close()
+
+
+def insert_many(cur, card_list):
+    # Add every card with one multi-row INSERT ... VALUES, a single round trip however many there are
+    with profiling.measure('insert_many') as timing:
+        psycopg2.extras.execute_values(cur, queries.insert_many_query(), [cards.insert_values(card) for card in card_list],
+                                       page_size=len(card_list))
+        timing['rows'] = len(card_list)
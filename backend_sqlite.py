@@ -0,0 +1,210 @@
+#! usr/bin/env Python3
+
+# An embedded SQLite storage backend, for using CardDB on one machine without a PostgreSQL server.
+#
+#     CARDDB_BACKEND=sqlite python main.py
+#     CARDDB_BACKEND=sqlite CARDDB_SQLITE_PATH=/tmp/cards.sqlite python main.py search --last smith
+#
+# The cards live in one file (sqlite_path in carddb.ini, default carddb.sqlite next to main.py), which
+# is created with the table and indexes below on first use. WAL journaling lets a search read while
+# a change is being written, and synchronous=NORMAL makes each commit an append to the log rather
+# than a full sync of the database file. Each statement's compiled form is kept by sqlite3's own
+# statement cache, the counterpart of the PREPAREd statements on PostgreSQL.
+#
+# Prices are stored as whole cents, so they stay exact and compare and sort as numbers; they go in and
+# come out as Decimal like on PostgreSQL. The conversions are done by this module's statements and row
+# factory rather than registered with sqlite3, so other sqlite3 users in the process are unaffected.
+#
+# Adding, searching, editing, vending and deleting cards work the same as on PostgreSQL. Features
+# built on PostgreSQL-only SQL (free-text find, other collections, batch vend, bulk delete, COPY
+# import and export, the change log, reports, and api.py) are refused. The statements in queries.py are written for
+# PostgreSQL; translate() rewrites the few things SQLite spells differently. SQLite's LIKE ignores
+# case for ASCII letters only, so accented names are matched case-sensitively.
+
+import datetime
+import decimal
+import re
+import sqlite3
+import time
+
+import cards
+import db
+import profiling
+import queries
+
+
+name = 'sqlite'
+
+Error = sqlite3.Error
+
+# A file database has no connection to lose
+disconnect_errors = ()
+
+# The same columns as the PostgreSQL table, and the same (column, "ID") indexes for keyset paging
+# and range searches. Prices are cents and dates yyyy-mm-dd text, see the conversions below.
+# AUTOINCREMENT keeps deleted IDs from being reused, like a sequence
+create_table = '''
+CREATE TABLE IF NOT EXISTS cardinfo
+(
+  "ID" INTEGER PRIMARY KEY AUTOINCREMENT,
+  sport TEXT NOT NULL,
+  "lastName" TEXT NOT NULL,
+  "firstName" TEXT NOT NULL,
+  year INTEGER NOT NULL,
+  team TEXT NOT NULL,
+  company TEXT NOT NULL,
+  "valueEst" INTEGER,
+  "saleDate" TEXT,
+  "salePrice" INTEGER
+);
+CREATE INDEX IF NOT EXISTS cardinfo_sport_id_idx ON cardinfo (sport, "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_lastname_id_idx ON cardinfo ("lastName", "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_firstname_id_idx ON cardinfo ("firstName", "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_year_id_idx ON cardinfo (year, "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_team_id_idx ON cardinfo (team, "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_company_id_idx ON cardinfo (company, "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_valueest_id_idx ON cardinfo ("valueEst", "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_saledate_id_idx ON cardinfo ("saleDate", "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_saleprice_id_idx ON cardinfo ("salePrice", "ID");
+'''
+
+# SQLite text of each queries.py statement already translated
+translated = {}
+
+
+#---TYPES------------------------------------------------------------------------------------------------------
+
+
+def sqlite_value(val):
+    # A statement parameter as stored: Decimal prices as whole cents, dates as yyyy-mm-dd
+    # Prices are the only Decimal parameters CardDB sends
+    if isinstance(val, decimal.Decimal):
+        return int(val.quantize(cards.cents) * 100)
+    if isinstance(val, datetime.date):
+        return val.isoformat()
+    return val
+
+
+def sqlite_params(params):
+    return [sqlite_value(val) for val in params]
+
+
+def card_row(cur, row):
+    # sqlite3's row factory: a Card for results with exactly the card columns, the plain tuple otherwise
+    # Stored cents become Decimal prices and stored dates datetime.date
+    make = cards.row_maker(cur)
+    if make is None:
+        return row
+    card = make(row)
+    return card._replace(valueEst=None if card.valueEst is None else decimal.Decimal(card.valueEst).scaleb(-2),
+                         saleDate=None if card.saleDate is None else datetime.date.fromisoformat(card.saleDate),
+                         salePrice=None if card.salePrice is None else decimal.Decimal(card.salePrice).scaleb(-2))
+
+
+#---CONNECTION-------------------------------------------------------------------------------------------------
+
+
+def connect():
+    # Open the database file, creating the table and indexes if they do not exist yet
+    conn = sqlite3.connect(db.config['sqlite_path'])
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(create_table)
+    conn.row_factory = card_row
+    return conn
+
+
+def release(conn, close=False):
+    # Close the file; anything not committed is rolled back
+    conn.close()
+
+
+def close_all():
+    pass
+
+
+def is_alive(conn):
+    return True
+
+
+def is_disconnect(conn):
+    return False
+
+
+#---STATEMENTS-------------------------------------------------------------------------------------------------
+
+
+def translate(sql):
+    # A queries.py statement in SQLite's spelling: the table without its schema, LIKE with an explicit
+    # escape character in place of ILIKE, IN in place of = ANY, and ? placeholders in place of %s
+    sql = sql.replace(queries.card_table, 'cardinfo')
+    sql = sql.replace(' ILIKE %s', ' LIKE %s ESCAPE \'\\\'')
+    sql = sql.replace(' = ANY(', ' IN (')
+    return re.sub('%%|%s', lambda match: '%' if match.group(0) == '%%' else '?', sql)
+
+
+def expand_lists(sql, params):
+    # SQLite has no arrays: each list parameter (= ANY(%s)) becomes one %s per item, with the items as parameters
+    if not any(isinstance(param, list) for param in params):
+        return sql, params
+    values = iter(params)
+    flat = []
+
+    def placeholder(match):
+        if match.group(0) == '%%':
+            return '%%'
+        value = next(values)
+        if not isinstance(value, list):
+            flat.append(value)
+            return '%s'
+        flat.extend(value)
+        return ', '.join(['%s'] * len(value))
+
+    return re.sub('%%|%s', placeholder, sql), flat
+
+
+def sqlite_text(sql):
+    # translate(), done once per statement
+    sqlite_sql = translated.get(sql)
+    if sqlite_sql is None:
+        sqlite_sql = translated.setdefault(sql, translate(sql))
+    return sqlite_sql
+
+
+def execute(cur, sql, params=(), kind=None):
+    # Run a queries.py statement on 'cur', recording its time when profiling is on
+    # SQLite does most of a SELECT's work as rows are fetched, so only the time to the first row is recorded
+    sql, params = expand_lists(sql, params)
+    sqlite_sql = sqlite_text(sql)
+    params = sqlite_params(params)
+
+    if not profiling.enabled:
+        cur.execute(sqlite_sql, params)
+        return cur
+
+    kind = kind or sql.split(None, 1)[0].lower()
+    begin = time.perf_counter()
+    try:
+        cur.execute(sqlite_sql, params)
+    except:
+        profiling.record(kind, time.perf_counter() - begin, error=True)
+        raise
+    profiling.record(kind, time.perf_counter() - begin, max(cur.rowcount, 0))
+    return cur
+
+
+def run(cur, key, params=()):
+    return execute(cur, queries.statements[key], params, kind=key)
+
+
+def stream(conn, sql, params=(), itersize=2000):
+    # Yield the rows of a SELECT; sqlite3 cursors already step through a result one row at a time
+    sql, params = expand_lists(sql, params)
+    yield from conn.cursor().execute(sqlite_text(sql), sqlite_params(params))
+
+
+def insert_many(cur, card_list):
+    # sqlite3 runs the one compiled INSERT for each card; there is no server round trip to save
+    with profiling.measure('insert_many') as timing:
+        cur.executemany(sqlite_text(queries.statements['insert_card']), [sqlite_params(cards.insert_values(card)) for card in card_list])
+        timing['rows'] = len(card_list)
@@ -0,0 +1,234 @@
+#! usr/bin/env Python3
+
+# Fills a card table with synthetic but realistically skewed cards, for benchmarks and load tests.
+#
+#     python benchmarks/generate_data.py --rows 1000000 --schema testing --clone --truncate
+#     python benchmarks/generate_data.py --rows 50000 --seed 7
+#
+# Like a real collection, most cards are baseball, a few teams, names and companies dominate, years
+# bunch up in the late 80s and early 90s, and values follow a long-tailed (log-normal) curve with a
+# few expensive cards. About a quarter of the cards are sold. The same --seed always produces the
+# same cards, so benchmark runs on different days compare like with like.
+#
+# --clone creates the schema and an empty copy of public.cardinfo if they do not exist yet: the same
+# columns, defaults and indexes, the same year partitions, and its own cardinfo_changes log filled by
+# the same triggers, so benchmarks see the layout the app runs on. It needs CREATE rights: pass --dsn
+# for a role that has them. The copy shares public.cardinfo's ID sequence, so IDs never collide
+# between the two tables.
+# Point CardDB at the clone with CARDDB_SCHEMA=testing.
+
+import argparse
+import csv
+import datetime
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+import db
+import queries
+
+
+# Sports with their share of the collection, and their teams, most common first
+sports = {'Baseball': (60, ['Yankees', 'Dodgers', 'Red Sox', 'Cardinals', 'Giants', 'Cubs', 'Twins', 'Tigers', 'Reds',
+                            'Orioles', 'Braves', 'Mets', 'Phillies', 'Pirates', 'Athletics', 'Royals', 'Brewers',
+                            'Astros', 'Padres', 'Mariners', 'Rangers', 'Blue Jays', 'Expos', 'Angels', 'Indians',
+                            'White Sox']),
+          'Football': (15, ['Cowboys', 'Steelers', 'Packers', '49ers', 'Bears', 'Giants', 'Raiders', 'Dolphins',
+                            'Broncos', 'Vikings', 'Patriots', 'Chiefs', 'Eagles', 'Bills', 'Rams', 'Lions']),
+          'Basketball': (12, ['Lakers', 'Celtics', 'Bulls', 'Knicks', 'Pistons', '76ers', 'Spurs', 'Rockets',
+                              'Jazz', 'Suns', 'Warriors', 'Trail Blazers']),
+          'Hockey': (10, ['Canadiens', 'Maple Leafs', 'Red Wings', 'Bruins', 'Blackhawks', 'Rangers', 'Oilers',
+                          'Penguins', 'Flyers', 'Kings']),
+          'Soccer': (3, ['Galaxy', 'Sounders', 'Timbers', 'Fire', 'Union'])}
+
+last_names = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Miller', 'Davis', 'Garcia', 'Rodriguez', 'Wilson',
+              'Martinez', 'Anderson', 'Taylor', 'Thomas', 'Hernandez', 'Moore', 'Martin', 'Jackson', 'Thompson',
+              'White', 'Lopez', 'Lee', 'Gonzalez', 'Harris', 'Clark', 'Lewis', 'Robinson', 'Walker', 'Perez', 'Hall',
+              'Young', 'Allen', 'Sanchez', 'Wright', 'King', 'Scott', 'Green', 'Baker', 'Adams', 'Nelson', 'Hill',
+              'Ramirez', 'Campbell', 'Mitchell', 'Roberts', 'Carter', 'Phillips', 'Evans', 'Turner', 'Torres',
+              'Ripken', 'Griffey', 'Mantle', 'Puckett', 'Gwynn', 'Boggs', 'Henderson', 'Bonds', 'McGwire', 'Sosa']
+
+first_names = ['Mike', 'John', 'Dave', 'Jim', 'Bob', 'Tom', 'Steve', 'Mark', 'Bill', 'Joe', 'Chris', 'Kevin', 'Paul',
+               'Greg', 'Tony', 'Rick', 'Jose', 'Ken', 'Dan', 'Frank', 'Cal', 'Kirby', 'Wade', 'Ozzie', 'Reggie',
+               'Nolan', 'Barry', 'Ryne', 'Don', 'Eddie']
+
+# Companies and the first year they made cards, most common first
+companies = [('Topps', 1951), ('Fleer', 1959), ('Donruss', 1981), ('Upper Deck', 1989), ('Score', 1988),
+             ('Bowman', 1948), ('Leaf', 1985), ('Panini', 2009), ('Pinnacle', 1992)]
+
+sale_start = datetime.date(2010, 1, 1)
+sale_days = (datetime.date(2025, 12, 31) - sale_start).days
+
+
+def zipf_weights(count, exponent=1.1):
+    # Weights for 'count' choices where the first is most common and each later one rarer
+    return [1.0 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def card_year(rng):
+    # Most cards come from the late 80s and early 90s, the rest are spread back to 1950
+    if rng.random() < 0.6:
+        return int(min(1995, max(1984, rng.gauss(1989, 2.5))))
+    return rng.randint(1950, 2024)
+
+
+def price_text(amount):
+    # Dollar amount as the two-decimal text COPY loads into a numeric(10,2) column
+    return '{:.2f}'.format(min(amount, 99999.99))
+
+
+def card_rows(count, rng):
+    # Yield 'count' synthetic cards as lists in queries.insert_columns order
+    sport_names = list(sports)
+    sport_weights = [sports[name][0] for name in sport_names]
+    team_weights = {name: zipf_weights(len(sports[name][1])) for name in sport_names}
+    last_weights = zipf_weights(len(last_names), 0.9)
+    first_weights = zipf_weights(len(first_names), 0.8)
+    company_weights = zipf_weights(len(companies), 1.3)
+
+    for num in range(count):
+        sport = rng.choices(sport_names, sport_weights)[0]
+        team = rng.choices(sports[sport][1], team_weights[sport])[0]
+        year = card_year(rng)
+
+        # Only companies already making cards that year, keeping their relative popularity
+        made = [(name, weight) for (name, first), weight in zip(companies, company_weights) if first <= year]
+        company = rng.choices([name for name, weight in made], [weight for name, weight in made])[0]
+
+        # Long-tailed values: most cards are worth a dollar or two, a few are worth thousands
+        value = rng.lognormvariate(0.4, 1.4) if rng.random() < 0.85 else None
+        if rng.random() < 0.25:
+            sale_date = (sale_start + datetime.timedelta(days=rng.randrange(sale_days))).isoformat()
+            sale_price = price_text((value or 1.0) * rng.lognormvariate(0, 0.35))
+        else:
+            sale_date = sale_price = None
+
+        yield [sport, rng.choices(last_names, last_weights)[0], rng.choices(first_names, first_weights)[0], year, team,
+               company, None if value is None else price_text(value), sale_date, sale_price]
+
+
+# The year partitions of public.cardinfo, as (name, bound)
+partitions_query = ('SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits AS i '
+                    'JOIN pg_class AS c ON c.oid = i.inhrelid WHERE i.inhparent = \'public.cardinfo\'::regclass')
+
+# public.cardinfo_log_changes() for the clone's schema: the log table is left unqualified and found
+# through the function's search_path
+log_function = '''CREATE FUNCTION {0}.cardinfo_log_changes() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = {0}, pg_temp AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    INSERT INTO cardinfo_changes (op, "ID", card)
+      SELECT 'D', o."ID", NULL FROM old_cards AS o ORDER BY o."ID";
+  ELSE
+    INSERT INTO cardinfo_changes (op, "ID", card)
+      SELECT left(TG_OP, 1), n."ID", to_jsonb(n) - 'search_doc' FROM new_cards AS n ORDER BY n."ID";
+  END IF;
+  RETURN NULL;
+END;
+$$'''
+
+log_triggers = [('cardinfo_log_inserts', 'INSERT', 'NEW TABLE AS new_cards'),
+                ('cardinfo_log_updates', 'UPDATE', 'NEW TABLE AS new_cards'),
+                ('cardinfo_log_deletes', 'DELETE', 'OLD TABLE AS old_cards')]
+
+
+def clone_table(cur, schema):
+    # Create the schema and an empty copy of public.cardinfo in it, see --clone above
+    # Nothing is changed if the schema already has a cardinfo table
+    table = queries.collection_table(schema)
+    quoted = '"{}"'.format(schema.replace('"', '""'))
+    cur.execute('CREATE SCHEMA IF NOT EXISTS ' + quoted)
+    cur.execute('SELECT to_regclass(%s)', (table,))
+    if cur.fetchone()[0] is not None:
+        return
+
+    cur.execute('CREATE TABLE {} (LIKE public.cardinfo INCLUDING ALL) PARTITION BY RANGE (year)'.format(table))
+    cur.execute(partitions_query)
+    for name, bound in cur.fetchall():
+        cur.execute('CREATE TABLE {} PARTITION OF {} {}'.format(queries.collection_table(schema, name), table, bound))
+
+    cur.execute('CREATE TABLE {} (LIKE public.cardinfo_changes INCLUDING ALL)'.format(queries.collection_table(schema, 'cardinfo_changes')))
+    cur.execute(log_function.format(quoted))
+    for name, event, transition in log_triggers:
+        cur.execute('CREATE TRIGGER {} AFTER {} ON {} REFERENCING {} FOR EACH STATEMENT EXECUTE PROCEDURE {}.cardinfo_log_changes()'
+                    .format(name, event, table, transition, quoted))
+
+
+def copy_rows(cur, table, rows, chunk_size):
+    # Load rows with COPY in chunks, return the number loaded
+    copy_query = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table, queries.insert_names)
+    buf = io.StringIO()
+    buf_writer = csv.writer(buf)
+    buffered = 0
+    loaded = 0
+
+    for row in rows:
+        buf_writer.writerow(row)
+        buffered += 1
+        if buffered == chunk_size:
+            buf.seek(0)
+            cur.copy_expert(copy_query, buf)
+            buf.seek(0)
+            buf.truncate(0)
+            loaded += buffered
+            buffered = 0
+            print('  {} rows loaded'.format(loaded), end='\r', flush=True)
+
+    if buffered > 0:
+        buf.seek(0)
+        cur.copy_expert(copy_query, buf)
+        loaded += buffered
+    return loaded
+
+
+def main_generate():
+    parser = argparse.ArgumentParser(description='Fill a CardDB table with synthetic cards.')
+    parser.add_argument('--rows', type=int, default=100000, help='cards to add')
+    parser.add_argument('--schema', default=db.config['schema'], help='schema of the cardinfo table to fill')
+    parser.add_argument('--clone', action='store_true', help='create the schema and a copy of public.cardinfo first')
+    parser.add_argument('--truncate', action='store_true', help='empty the table before loading')
+    parser.add_argument('--seed', type=int, default=1, help='random seed, the same seed gives the same cards')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='rows sent per COPY')
+    parser.add_argument('--dsn', default=db.config['dsn'], help='connection string, default from carddb.ini')
+    args = parser.parse_args()
+
+    table = queries.collection_table(args.schema)
+    rng = random.Random(args.seed)
+
+    try:
+        conn = psycopg2.connect(args.dsn)
+    except psycopg2.Error as e:
+        sys.exit('Unable to establish database connection: ' + str(e).strip())
+
+    start = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            if args.clone:
+                clone_table(cur, args.schema)
+            if args.truncate:
+                cur.execute('TRUNCATE {}'.format(table))
+
+            loaded = copy_rows(cur, table, card_rows(args.rows, rng), args.chunk_size)
+            conn.commit()
+
+            # Fresh statistics, so the first benchmark run gets the same plans as later ones
+            cur.execute('ANALYZE {}'.format(table))
+            conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        sys.exit('Load failed, nothing was added: ' + str(e).strip())
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    print('{} cards added to {} in {:.1f} s ({:.0f} rows/s).'.format(loaded, table, elapsed, loaded / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main_generate()
@@ -0,0 +1,125 @@
+#! usr/bin/env Python3
+
+# Load test for api.py: many concurrent keep-alive clients sending a mix of searches and ID lookups.
+#
+#     python api.py --port 8080 &
+#     python benchmarks/loadtest.py --url http://127.0.0.1:8080 --concurrency 50 --requests 10000
+#     python benchmarks/loadtest.py --concurrency 200 --duration 30
+#
+# Prints throughput, latency percentiles and the count of failed requests. Exits with status 1 if
+# more than --max-errors requests fail.
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+import urllib.parse
+
+
+# Searches sent by the clients, chosen at random along with lookups of random IDs
+search_targets = ['/cards?sort=year&limit=25',
+                  '/cards?last=smith',
+                  '/cards?year=gt1985&sort=value',
+                  '/cards?sport=baseball&team=twins&sort=last',
+                  '/cards?company=topps&year=lt1990&sort=date',
+                  '/cards?value=gt5&sort=value&limit=50']
+
+
+def percentile(latencies, pct):
+    # Nearest-rank percentile of a sorted list
+    if len(latencies) == 0:
+        return 0.0
+    rank = max(0, min(len(latencies) - 1, int(round(pct / 100.0 * len(latencies))) - 1))
+    return latencies[rank]
+
+
+async def send(reader, writer, host, target):
+    # Send one GET on an open connection and read the whole response, return the status code
+    writer.write('GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(target, host).encode('latin-1'))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    body_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            body_length = int(value)
+    await reader.readexactly(body_length)
+    return status
+
+
+async def client(host, port, args, state):
+    # One keep-alive connection sending requests until the request count or time limit is reached
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while state['sent'] < args.requests and time.monotonic() < state['deadline']:
+            state['sent'] += 1
+            if random.random() < args.lookup_share:
+                target = '/cards/{}'.format(random.randint(1, args.max_id))
+            else:
+                target = random.choice(search_targets)
+
+            start = time.perf_counter()
+            try:
+                status = await send(reader, writer, host, target)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                state['errors'] += 1
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+            state['latencies'].append(time.perf_counter() - start)
+
+            # A missing card is a normal answer for a random ID, anything else 4xx/5xx is a failure
+            if status != 200 and not (status == 404 and target.count('/') == 2):
+                state['errors'] += 1
+    finally:
+        writer.close()
+
+
+async def run_load(args):
+    url = urllib.parse.urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    state = {'sent': 0, 'errors': 0, 'latencies': [],
+             'deadline': time.monotonic() + args.duration if args.duration else float('inf')}
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, args, state) for i in range(args.concurrency)])
+    return state, time.perf_counter() - start
+
+
+def main_load():
+    parser = argparse.ArgumentParser(description='Load test for the CardDB HTTP/JSON API.')
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help='base URL of a running api.py')
+    parser.add_argument('--concurrency', type=int, default=20, help='simultaneous client connections')
+    parser.add_argument('--requests', type=int, default=2000, help='total requests to send')
+    parser.add_argument('--duration', type=float, default=0, help='stop after this many seconds instead')
+    parser.add_argument('--lookup-share', type=float, default=0.7, help='fraction of requests that are ID lookups')
+    parser.add_argument('--max-id', type=int, default=1000, help='highest card ID to look up')
+    parser.add_argument('--max-errors', type=int, default=0, help='allowed failed requests')
+    args = parser.parse_args()
+
+    if args.duration:
+        args.requests = sys.maxsize
+
+    state, elapsed = asyncio.run(run_load(args))
+    latencies = sorted(state['latencies'])
+
+    print('Requests:     {} in {:.2f} s with {} connections'.format(len(latencies), elapsed, args.concurrency))
+    print('Throughput:   {:.1f} requests/s'.format(len(latencies) / elapsed))
+    print('Latency (ms): p50 {:.1f}  p90 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 90) * 1000,
+        percentile(latencies, 99) * 1000, (latencies[-1] if latencies else 0) * 1000))
+    print('Errors:       {}'.format(state['errors']))
+
+    if state['errors'] > args.max_errors:
+        print('FAILED')
+        sys.exit(1)
+    print('PASSED')
+
+
+if __name__ == '__main__':
+    main_load()
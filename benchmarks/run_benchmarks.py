@@ -0,0 +1,257 @@
+#! usr/bin/env Python3
+
+# Repeatable timings for CardDB's core operations against a local Postgres, written as JSON.
+#
+#     python benchmarks/generate_data.py --rows 1000000 --schema testing --clone --truncate
+#     CARDDB_SCHEMA=testing python benchmarks/run_benchmarks.py --out results/before.json
+#     CARDDB_SCHEMA=testing python benchmarks/run_benchmarks.py --compare results/before.json
+#
+# Each benchmark calls the same functions the menu and command line use (searches, paging, streamed
+# command line searches, lookups, reports, add, edit, vend, batch vend, delete) on the session
+# connection in main.py. Writes are rolled back after every benchmark, so the table is unchanged and
+# runs can be repeated. The random choices are seeded, so every run sends the same statements.
+#
+# --compare prints the change in median time against an earlier results file and exits with
+# status 1 if any benchmark got slower by more than --threshold percent.
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import queries
+import query_builder
+
+
+# Terms the search benchmarks pick from, matching the data generate_data.py writes
+last_terms = ['smith', 'john', 'ripk', 'griff', 'mart', 'son']
+team_terms = ['yankees', 'twins', 'cubs', 'lakers', 'bruins']
+
+
+def table_info():
+    # Row count and ID range of the card table, used to pick IDs that exist
+    main.cur.execute('SELECT count(*), min("ID"), max("ID") FROM {}'.format(queries.card_table))
+    count, low, high = main.cur.fetchone()
+    main.conn.rollback()
+    return count, low, high
+
+
+def search_op(terms, sort_key):
+    # One search as the menu runs it: count the matches, then fetch the first page
+    s_where, s_params = query_builder.build_where(terms)
+
+    def op(rng, info):
+        main.search_count(s_where, s_params)
+        main.search_page(s_where, s_params, sort_key)
+    return op
+
+
+def random_search_op(col, choices, sort_key):
+    # A search on one column with a term picked at random each time
+    def op(rng, info):
+        s_where, s_params = query_builder.build_where([(col, rng.choice(choices))])
+        main.search_count(s_where, s_params)
+        main.search_page(s_where, s_params, sort_key)
+    return op
+
+
+def page_walk_op(pages):
+    # Page forward 'pages' times through the whole table sorted by last name, as the [N]ext key does
+    def op(rng, info):
+        results = main.search_page('TRUE', [], 'l')
+        for num in range(pages - 1):
+            if len(results) == 0:
+                break
+            results = main.search_page('TRUE', [], 'l', results[-1], 'next')
+    return op
+
+
+def stream_op(limit):
+    # Stream the first 'limit' cards sorted by last name as a table, as the search command does
+    # The table is written to the null device, so only fetching and formatting are timed
+    def op(rng, info):
+        with open(os.devnull, 'w') as devnull:
+            main.stream_search('TRUE', [], 'l', limit, devnull)
+    return op
+
+
+def lookup_op(rng, info):
+    main.card_by_id(rng.randint(info['min_id'], info['max_id']))
+
+
+def report_op(name):
+    def op(rng, info):
+        main.run_report(name, 'TRUE', [])
+    return op
+
+
+def add_op(rng, info):
+    args = argparse.Namespace(sport='Baseball', last='Bench', first='Mark', year='1988', team='Twins',
+                              company='Topps', value='2.50', date=None, price=None)
+    main.cmd_add(args)
+
+
+def edit_op(rng, info):
+    queries.run(main.cur, 'update_lastName', ('Bench', rng.randint(info['min_id'], info['max_id'])))
+
+
+def vend_op(rng, info):
+    queries.run(main.cur, 'vend_card', ('2015-07-17', '12.50', rng.randint(info['min_id'], info['max_id'])))
+
+
+def vend_batch_op(rng, info):
+    entries = [(rng.randint(info['min_id'], info['max_id']), '2015-07-17', '12.50') for num in range(100)]
+    main.vend_batch(entries)
+
+
+def delete_op(rng, info):
+    queries.run(main.cur, 'delete_card', (rng.randint(info['min_id'], info['max_id']),))
+
+
+# Name, operation, and the share of --iterations it runs (slow whole-table operations run fewer times)
+benchmarks = [
+    ('lookup_by_id', lookup_op, 1.0),
+    ('search_last_name', random_search_op('l', last_terms, 'i'), 0.5),
+    ('search_team_sorted_by_value', random_search_op('t', team_terms, 'v'), 0.5),
+    ('search_year_range_value', search_op([('y', '1986..1990'), ('v', 'gt50')], 'v'), 0.5),
+    ('search_unsold_by_sport', search_op([('d', 'null'), ('s', 'hockey')], 'l'), 0.5),
+    ('page_walk_10_pages', page_walk_op(10), 0.2),
+    ('search_stream_5000', stream_op(5000), 0.05),
+    ('report_sport', report_op('sport'), 0.05),
+    ('report_monthly', report_op('monthly'), 0.05),
+    ('add_card', add_op, 1.0),
+    ('edit_card', edit_op, 1.0),
+    ('vend_card', vend_op, 1.0),
+    ('vend_batch_100', vend_batch_op, 0.2),
+    ('delete_card', delete_op, 1.0),
+]
+
+
+def run_one(name, op, runs, warmup, info, seed):
+    # Time 'runs' calls of one operation after 'warmup' untimed calls, then roll back any writes
+    rng = random.Random('{}-{}'.format(seed, name))
+    times = []
+
+    for num in range(warmup + runs):
+        start = time.perf_counter()
+        op(rng, info)
+        elapsed = time.perf_counter() - start
+        if num >= warmup:
+            times.append(elapsed * 1000)
+    main.conn.rollback()
+
+    times.sort()
+    return {'runs': runs,
+            'min_ms': round(times[0], 3),
+            'median_ms': round(statistics.median(times), 3),
+            'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+            'max_ms': round(times[-1], 3),
+            'mean_ms': round(statistics.mean(times), 3),
+            'ops_per_sec': round(1000 * len(times) / sum(times), 1)}
+
+
+def git_commit():
+    # Commit the benchmarked code was at, or None outside a git checkout
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, base_path, threshold):
+    # Print the median change per benchmark against an earlier results file, return True if none regressed
+    with open(base_path, encoding='utf-8') as base_file:
+        base = json.load(base_file)
+
+    ok = True
+    print('\n{:<30}{:>12}{:>12}{:>9}'.format('benchmark', 'base ms', 'now ms', 'change'))
+    for name, now in results['benchmarks'].items():
+        before = base.get('benchmarks', {}).get(name)
+        if before is None:
+            print('{:<30}{:>12}{:>12.3f}{:>9}'.format(name, '-', now['median_ms'], 'new'))
+            continue
+        change = 100.0 * (now['median_ms'] - before['median_ms']) / max(before['median_ms'], 1e-9)
+        flag = ''
+        if change > threshold:
+            flag = '  SLOWER'
+            ok = False
+        print('{:<30}{:>12.3f}{:>12.3f}{:>8.1f}%{}'.format(name, before['median_ms'], now['median_ms'], change, flag))
+    return ok
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description='Benchmark CardDB operations and write the timings as JSON.')
+    parser.add_argument('--iterations', type=int, default=200, help='timed runs of the fastest benchmarks')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed runs before each benchmark')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the IDs and terms used')
+    parser.add_argument('--only', help='comma-separated benchmark names to run')
+    parser.add_argument('--out', help='file to write the results to, default benchmarks/results/<time>.json')
+    parser.add_argument('--compare', metavar='FILE', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed median slowdown in percent')
+    args = parser.parse_args()
+
+    selected = benchmarks
+    if args.only:
+        names = args.only.split(',')
+        selected = [bench for bench in benchmarks if bench[0] in names]
+        if len(selected) == 0:
+            sys.exit('No benchmarks named ' + args.only)
+
+    if main.connect_db() == False:
+        sys.exit('Unable to establish database connection.')
+
+    try:
+        count, low, high = table_info()
+        if count == 0:
+            sys.exit('{} is empty, fill it with benchmarks/generate_data.py first.'.format(queries.card_table))
+        info = {'min_id': low, 'max_id': high}
+
+        results = {'started': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'commit': git_commit(),
+                   'table': queries.card_table,
+                   'rows': count,
+                   'server_version': main.conn.server_version,
+                   'python': platform.python_version(),
+                   'iterations': args.iterations,
+                   'seed': args.seed,
+                   'benchmarks': {}}
+
+        # The command line functions print their errors, which would only clutter the timings
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            for name, op, share in selected:
+                runs = max(3, int(args.iterations * share))
+                print('  {} ({} runs)'.format(name, runs), flush=True)
+                results['benchmarks'][name] = run_one(name, op, runs, args.warmup, info, args.seed)
+    finally:
+        main.disconnect_db()
+
+    print('\n{:<30}{:>8}{:>12}{:>10}{:>10}{:>12}'.format('benchmark', 'runs', 'median ms', 'p95 ms', 'max ms', 'ops/s'))
+    for name, res in results['benchmarks'].items():
+        print('{:<30}{:>8}{:>12.3f}{:>10.3f}{:>10.3f}{:>12.1f}'.format(name, res['runs'], res['median_ms'], res['p95_ms'],
+                                                                    res['max_ms'], res['ops_per_sec']))
+
+    out_path = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                        datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, 'w', encoding='utf-8') as out_file:
+        json.dump(results, out_file, indent=2)
+        out_file.write('\n')
+    print('\nResults written to ' + out_path)
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,172 @@
+#! usr/bin/env Python3
+
+# Soak test for the interactive menu: drives main_menu() through thousands of operations with
+# scripted input and checks that neither the Python stack nor traced memory grows with them.
+#
+#     python benchmarks/soak_menu.py --cycles 5000
+#     python benchmarks/soak_menu.py --cycles 5000 --db     (also runs searches and paging)
+#
+# Exits with status 1 if memory grows by more than --max-growth bytes after the warm-up cycles,
+# or if any prompt is reached deeper than --max-depth frames. It also fails at once if the scripted
+# answers fall out of step with the prompts, rather than answering forever. With --db, an empty
+# table gets one card first, which is left in place.
+
+import argparse
+import builtins
+import contextlib
+import os
+import sys
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cards
+import main
+import queries
+
+
+# One cycle of menu input that never touches the database: every cancel and invalid-input path
+offline_cycle = ['z',
+                 'a', 'q',
+                 'm', 'q', 'q',
+                 's', 'q',
+                 'f', 'q',
+                 'f', '%%',
+                 'c', 'q',
+                 'e', 'abc',
+                 'v', 'q',
+                 'b', 'q',
+                 'd', 'q',
+                 'k', 'q',
+                 'i', 'q',
+                 'x', 'q',
+                 'r', 'q',
+                 'q', 'n']
+
+# Extra input that searches for every card, sorted by last name, pages forward and quits the pages
+# Needs at least one card in the table, or the answers drift out of step with the prompts
+db_cycle = ['s', 'i', 'gt0', 'l', 'n', 'q']
+
+# The card added to an empty table so db_cycle has something to find
+seed_card = cards.new_card('Baseball', 'Soak', 'Sam', 1987, 'Twins', 'Topps')
+
+
+def stack_depth():
+    # Count the frames on the current Python stack
+    depth = 0
+    frame = sys._getframe()
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+def seed_table():
+    # Add seed_card if the table is empty, return True if it was added
+    if main.store.execute(main.cur, queries.count_query('TRUE')).fetchone()[0] > 0:
+        main.conn.rollback()
+        return False
+    main.store.run(main.cur, 'insert_card', cards.insert_values(seed_card))
+    main.conn.commit()
+    return True
+
+
+def run_soak(cycles, use_db, warmup):
+    # Feed 'cycles' rounds of scripted input to main_menu(), sampling memory and stack depth
+    cycle = offline_cycle + db_cycle if use_db else offline_cycle
+    samples = {'depths': set(), 'start': None, 'end': None, 'seeded': False, 'error': None}
+    state = {'cycle': 0, 'pos': 0}
+
+    def scripted_input(prompt=''):
+        if state['pos'] == len(cycle):
+            state['pos'] = 0
+            state['cycle'] += 1
+            if state['cycle'] == warmup:
+                samples['start'] = tracemalloc.take_snapshot()
+        samples['depths'].add(stack_depth())
+
+        # Every cycle starts at the main menu; any other prompt means an answer went to the wrong question
+        if state['pos'] == 0 and not prompt.startswith(' [A]dd'):
+            raise EOFError('cycle {} started at the prompt {!r}'.format(state['cycle'], prompt.strip()))
+
+        if state['cycle'] == cycles:
+            # Quit for real once every cycle has run: 'q' at the main menu, then 'y' to confirm
+            state['pos'] += 1
+            if state['pos'] > 2:
+                raise EOFError('the menu was still asking for input after quitting: {!r}'.format(prompt.strip()))
+            return 'q' if state['pos'] == 1 else 'y'
+        answer = cycle[state['pos']]
+        state['pos'] += 1
+        return answer
+
+    if use_db:
+        if main.connect_db() == False:
+            sys.exit('Unable to establish database connection.')
+        samples['seeded'] = seed_table()
+    else:
+        # No statement runs offline, so the session only needs to look alive and ignore rollbacks
+        placeholder = types.SimpleNamespace(rollback=lambda: None, commit=lambda: None)
+        main.conn = placeholder
+        main.cur = placeholder
+        main.store.is_alive = lambda conn: True
+        main.disconnect_db = lambda: None
+
+    main.clear_screen = lambda: None
+    real_input = builtins.input
+    builtins.input = scripted_input
+    tracemalloc.start()
+
+    main_menu_ended = False
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            main.main_menu()
+            main_menu_ended = True
+    except EOFError as e:
+        # The scripted input ends the session like a closed terminal when its answers are out of step
+        samples['error'] = str(e)
+        main.disconnect_db()
+    finally:
+        builtins.input = real_input
+        samples['end'] = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    return main_menu_ended, samples
+
+
+def main_soak():
+    parser = argparse.ArgumentParser(description='Soak test for the CardDB interactive menu.')
+    parser.add_argument('--cycles', type=int, default=2000, help='rounds of scripted menu input')
+    parser.add_argument('--warmup', type=int, default=100, help='rounds run before the first memory sample')
+    parser.add_argument('--max-growth', type=int, default=64 * 1024, help='allowed memory growth in bytes')
+    parser.add_argument('--max-depth', type=int, default=50, help='allowed stack depth at any prompt')
+    parser.add_argument('--db', action='store_true', help='also run searches against the database')
+    args = parser.parse_args()
+
+    if args.cycles <= args.warmup:
+        sys.exit('--cycles must be larger than --warmup')
+
+    ended, samples = run_soak(args.cycles, args.db, args.warmup)
+    if samples['seeded']:
+        print('Seeded the empty table with one card')
+    if samples['error']:
+        print('Scripted input out of step: ' + samples['error'])
+        print('FAILED')
+        sys.exit(1)
+
+    growth = sum(stat.size_diff for stat in samples['end'].compare_to(samples['start'], 'filename'))
+    depths = sorted(samples['depths'])
+
+    print('Cycles run:             {}'.format(args.cycles))
+    print('Menu returned cleanly:  {}'.format(ended))
+    print('Stack depth at prompts: {} to {} frames'.format(depths[0], depths[-1]))
+    print('Memory growth:          {} bytes after {} warm-up cycles'.format(growth, args.warmup))
+
+    if not ended or growth > args.max_growth or depths[-1] > args.max_depth:
+        print('FAILED')
+        sys.exit(1)
+    print('PASSED')
+
+
+if __name__ == '__main__':
+    main_soak()
@@ -0,0 +1,37 @@
+/* Shows the plan change for a substring search once the trigram index exists */
+/* Builds a throwaway 1,000,000 row copy of cardinfo in the 'testing' schema, e.g.: */
+/*     psql -d cards -f benchmarks/trgm_plan.sql */
+
+/* Expected: the first EXPLAIN is a Seq Scan over every row, the second a Bitmap Index Scan */
+/* on trgm_bench_lastname_trgm_idx that only visits the matching heap pages */
+
+\timing on
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+DROP TABLE IF EXISTS testing.trgm_bench;
+CREATE TABLE testing.trgm_bench (LIKE public.cardinfo INCLUDING DEFAULTS);
+
+/* Skewed, repetitive names like a real collection, with a rare name to search for */
+INSERT INTO testing.trgm_bench ("ID", sport, "lastName", "firstName", year, team, company)
+SELECT g,
+       (ARRAY['Baseball', 'Baseball', 'Baseball', 'Football', 'Basketball', 'Hockey'])[1 + g % 6],
+       CASE WHEN g % 5000 = 0 THEN 'Ripken' ELSE 'Player' || (g % 20000) END,
+       'First' || (g % 700),
+       1950 + g % 70,
+       'Team' || (g % 120),
+       (ARRAY['Topps', 'Fleer', 'Donruss', 'Upper Deck', 'Score'])[1 + g % 5]
+FROM generate_series(1, 1000000) AS g;
+
+ANALYZE testing.trgm_bench;
+
+/* Before: no index can serve a leading wildcard */
+EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM testing.trgm_bench WHERE "lastName" ILIKE '%ripk%';
+
+CREATE INDEX trgm_bench_lastname_trgm_idx ON testing.trgm_bench USING gin ("lastName" gin_trgm_ops);
+ANALYZE testing.trgm_bench;
+
+/* After: the same predicate, as search() generates it, uses the trigram index */
+EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM testing.trgm_bench WHERE "lastName" ILIKE '%ripk%';
+
+DROP TABLE testing.trgm_bench;
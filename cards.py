@@ -0,0 +1,81 @@
+#! usr/bin/env Python3
+
+# The Card record: one typed shape for a card row, shared by the menu, the command line, imports and the API.
+#
+# Card is a namedtuple, so a row costs no more memory than the plain tuple psycopg2 returns, and its
+# values can be read by column name (card.lastName) as well as by position. CardCursor is the row
+# factory: pooled connections use it for every cursor, and it builds Cards as rows are fetched
+# whenever a result's columns are exactly the card columns. Other results, such as counts, reports
+# and exports, come back as plain tuples.
+#
+# Prices are numeric(10,2) columns, which psycopg2 returns as Decimal and Decimal parameters are
+# sent as, so amounts stay exact in both directions.
+
+import collections
+import decimal
+
+import psycopg2
+import psycopg2.extensions
+
+
+Card = collections.namedtuple('Card', ['ID', 'sport', 'lastName', 'firstName', 'year', 'team', 'company',
+                                       'valueEst', 'saleDate', 'salePrice'])
+
+cents = decimal.Decimal('0.01')
+
+
+def price(value):
+    # A price as typed or stored, e.g. '12.5', as a Decimal rounded to cents; None stays None
+    # Half a cent rounds up, as numeric(10,2) rounds it in PostgreSQL, not to the even cent
+    if value is None:
+        return None
+    return decimal.Decimal(value).quantize(cents, rounding=decimal.ROUND_HALF_UP)
+
+
+def new_card(sport, lastName, firstName, year, team, company, valueEst=None, saleDate=None, salePrice=None):
+    # A card that has not been added yet, so it has no ID; prices are rounded to cents
+    return Card(None, sport, lastName, firstName, int(year), team, company, price(valueEst), saleDate, price(salePrice))
+
+
+def insert_values(card):
+    # The card's values in queries.insert_columns order, for INSERT or COPY
+    return list(card[1:])
+
+
+#---ROW_FACTORY------------------------------------------------------------------------------------------------
+
+
+def row_maker(cur):
+    # Card._make if the cursor's result has exactly the card columns, otherwise None
+    if cur.description is None or len(cur.description) != len(Card._fields):
+        return None
+    if tuple(col[0] for col in cur.description) != Card._fields:
+        return None
+    return Card._make
+
+
+# psycopg2 only lets a cursor subclass change the rows it returns, so this is CardDB's one class
+class CardCursor(psycopg2.extensions.cursor):
+
+    def fetchone(self):
+        row = super().fetchone()
+        make = row_maker(self)
+        return row if row is None or make is None else make(row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        make = row_maker(self)
+        return rows if make is None else [make(row) for row in rows]
+
+    def fetchall(self):
+        rows = super().fetchall()
+        make = row_maker(self)
+        return rows if make is None else [make(row) for row in rows]
+
+    # A cursor is its own iterator, so iteration is changed through __next__: overriding __iter__ to
+    # loop over super().__iter__() would get this same cursor back and call itself until RecursionError
+    # Named cursors only have a description once the first rows have arrived, so it is read per row
+    def __next__(self):
+        row = super().__next__()
+        make = row_maker(self)
+        return row if make is None else make(row)
@@ -7,24 +7,48 @@
 /* This enables me to clone the 'public' table(s) into 'testing' to test commands etc. */
 /* You can ignore or delete the 'public.' prefixes if you don't want to have multiple schemas */
 
+/* The table is partitioned by card year, so a search filtered on year only reads the partitions */
+/* that can match, and each partition's indexes stay small as the collection grows. */
+/* Declarative partitioning with a primary key needs PostgreSQL 11 or later, the generated */
+/* search_doc column needs 12. search_doc is kept up to date by the server for the free-text */
+/* search; the 'simple' configuration indexes whole words as typed, without English stemming, */
+/* which suits names. Names outrank the team, and the team outranks sport, company and year. */
+/* "ID" is a bigserial, unique on its own because every partition draws from one sequence. */
+/* The primary key has to include the partition key, so it is ("ID", year). */
+/* Prices are numeric(10,2), exact and independent of the server's locale, unlike money. */
 CREATE TABLE public.cardinfo
 (
-  "ID" serial PRIMARY KEY,
+  "ID" bigserial NOT NULL,
   sport character varying(50) NOT NULL,
   "lastName" character varying NOT NULL,
   "firstName" character varying(50) NOT NULL,
   year smallint NOT NULL,
   team character varying(50) NOT NULL,
   company character varying(50) NOT NULL,
-  "valueEst" money,
+  "valueEst" numeric(10,2),
   "saleDate" date,
-  "salePrice" money
+  "salePrice" numeric(10,2),
+  search_doc tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', "lastName" || ' ' || "firstName"), 'A') ||
+    setweight(to_tsvector('simple', team), 'B') ||
+    setweight(to_tsvector('simple', sport || ' ' || company || ' ' || year::text), 'C')
+  ) STORED,
+  PRIMARY KEY ("ID", year)
 )
+PARTITION BY RANGE (year);
 
-/* No need for OIDS since we are using a serial column as the PK */
-WITH (
-  OIDS=FALSE
-);
+/* One partition per era, with a default partition catching anything outside them */
+/* To split a busy era later, detach it, create the smaller partitions, and re-insert its rows */
+CREATE TABLE public.cardinfo_pre1950 PARTITION OF public.cardinfo FOR VALUES FROM (MINVALUE) TO (1950);
+CREATE TABLE public.cardinfo_1950s PARTITION OF public.cardinfo FOR VALUES FROM (1950) TO (1960);
+CREATE TABLE public.cardinfo_1960s PARTITION OF public.cardinfo FOR VALUES FROM (1960) TO (1970);
+CREATE TABLE public.cardinfo_1970s PARTITION OF public.cardinfo FOR VALUES FROM (1970) TO (1980);
+CREATE TABLE public.cardinfo_1980s PARTITION OF public.cardinfo FOR VALUES FROM (1980) TO (1990);
+CREATE TABLE public.cardinfo_1990s PARTITION OF public.cardinfo FOR VALUES FROM (1990) TO (2000);
+CREATE TABLE public.cardinfo_2000s PARTITION OF public.cardinfo FOR VALUES FROM (2000) TO (2010);
+CREATE TABLE public.cardinfo_2010s PARTITION OF public.cardinfo FOR VALUES FROM (2010) TO (2020);
+CREATE TABLE public.cardinfo_2020s PARTITION OF public.cardinfo FOR VALUES FROM (2020) TO (2030);
+CREATE TABLE public.cardinfo_default PARTITION OF public.cardinfo DEFAULT;
 
 /* Ensures postgres is the table owner (shouldn't really be necessary) */
 ALTER TABLE public.cardinfo
@@ -35,6 +59,82 @@ GRANT ALL ON TABLE public.cardinfo TO postgres;
 /* -------------------------------------------------------------------- */
 
 
+/* Search results are paged by (sort column, "ID") instead of OFFSET, so each sortable column */
+/* gets a composite index matching that order. The primary key already covers sorting by "ID" */
+/* The same indexes serve range searches on their first column, e.g. "valueEst" BETWEEN 10 AND 50 */
+/* Indexes created on the partitioned table are created on every partition automatically */
+CREATE INDEX cardinfo_sport_id_idx ON public.cardinfo (sport, "ID");
+CREATE INDEX cardinfo_lastname_id_idx ON public.cardinfo ("lastName", "ID");
+CREATE INDEX cardinfo_firstname_id_idx ON public.cardinfo ("firstName", "ID");
+CREATE INDEX cardinfo_year_id_idx ON public.cardinfo (year, "ID");
+CREATE INDEX cardinfo_team_id_idx ON public.cardinfo (team, "ID");
+CREATE INDEX cardinfo_company_id_idx ON public.cardinfo (company, "ID");
+CREATE INDEX cardinfo_valueest_id_idx ON public.cardinfo ("valueEst", "ID");
+CREATE INDEX cardinfo_saledate_id_idx ON public.cardinfo ("saleDate", "ID");
+CREATE INDEX cardinfo_saleprice_id_idx ON public.cardinfo ("salePrice", "ID");
+
+
+/* Text searches are substring matches ("col" ILIKE '%term%'), which a b-tree index cannot serve */
+/* The pg_trgm extension provides trigram GIN indexes that can. Creating it requires a superuser */
+/* Terms shorter than three characters have no trigrams and still fall back to a sequential scan */
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX cardinfo_sport_trgm_idx ON public.cardinfo USING gin (sport gin_trgm_ops);
+CREATE INDEX cardinfo_lastname_trgm_idx ON public.cardinfo USING gin ("lastName" gin_trgm_ops);
+CREATE INDEX cardinfo_firstname_trgm_idx ON public.cardinfo USING gin ("firstName" gin_trgm_ops);
+CREATE INDEX cardinfo_team_trgm_idx ON public.cardinfo USING gin (team gin_trgm_ops);
+CREATE INDEX cardinfo_company_trgm_idx ON public.cardinfo USING gin (company gin_trgm_ops);
+
+/* The free-text search matches search_doc against a tsquery, which this index serves */
+CREATE INDEX cardinfo_search_doc_idx ON public.cardinfo USING gin (search_doc);
+
+
+/* -------------------------------------------------------------------- */
+
+
+/* Every insert, update and delete is logged in public.cardinfo_changes by the triggers below, so */
+/* backups and copies can be brought up to date with 'python main.py changes --since POSITION', */
+/* reading only what changed instead of the whole table. 'card' is the card after the change, NULL */
+/* for a delete, and 'xid' the writing transaction, which the export's positions are made of */
+CREATE TABLE public.cardinfo_changes
+(
+  version bigserial PRIMARY KEY,
+  xid bigint NOT NULL DEFAULT txid_current(),
+  changed_at timestamp with time zone NOT NULL DEFAULT now(),
+  op character(1) NOT NULL,
+  "ID" bigint NOT NULL,
+  card jsonb
+);
+
+CREATE INDEX cardinfo_changes_xid_idx ON public.cardinfo_changes (xid);
+CREATE INDEX cardinfo_changes_changed_at_idx ON public.cardinfo_changes (changed_at);
+
+/* Statement-level triggers log all the rows of an import or bulk delete with one INSERT */
+/* SECURITY DEFINER lets the app's role write the log only through the triggers */
+CREATE FUNCTION public.cardinfo_log_changes() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    INSERT INTO public.cardinfo_changes (op, "ID", card)
+      SELECT 'D', o."ID", NULL FROM old_cards AS o ORDER BY o."ID";
+  ELSE
+    INSERT INTO public.cardinfo_changes (op, "ID", card)
+      SELECT left(TG_OP, 1), n."ID", to_jsonb(n) - 'search_doc' FROM new_cards AS n ORDER BY n."ID";
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER cardinfo_log_inserts AFTER INSERT ON public.cardinfo
+  REFERENCING NEW TABLE AS new_cards FOR EACH STATEMENT EXECUTE PROCEDURE public.cardinfo_log_changes();
+CREATE TRIGGER cardinfo_log_updates AFTER UPDATE ON public.cardinfo
+  REFERENCING NEW TABLE AS new_cards FOR EACH STATEMENT EXECUTE PROCEDURE public.cardinfo_log_changes();
+CREATE TRIGGER cardinfo_log_deletes AFTER DELETE ON public.cardinfo
+  REFERENCING OLD TABLE AS old_cards FOR EACH STATEMENT EXECUTE PROCEDURE public.cardinfo_log_changes();
+
+
+/* -------------------------------------------------------------------- */
+
+
 /* Creating roles is like creating users in older versions of Postgre */
 /* My Python script roles start with 'py_' so I can track them */
 
@@ -47,6 +147,8 @@ GRANT USAGE ON SCHEMA public TO py_carddb;
 GRANT SELECT, UPDATE, INSERT, DELETE ON TABLE public.cardinfo TO py_carddb;
 /* You must ALSO explicitly grant the script permission to 'use' the serial sequence (PK) */
 GRANT USAGE, SELECT ON SEQUENCE "cardinfo_ID_seq" TO py_carddb;
+/* The change log is only read by the app, the triggers write it */
+GRANT SELECT ON TABLE public.cardinfo_changes TO py_carddb;
 
 
 /* -------------------------------------------------------------------- */
@@ -0,0 +1,270 @@
+#! usr/bin/env Python3
+
+# Pooled PostgreSQL connections for CardDB.
+#
+# Settings are read from the [database] section of carddb.ini (next to this file, or wherever
+# CARDDB_CONFIG points), and any of them can be overridden by an environment variable:
+#
+#     CARDDB_DSN         libpq connection string
+#     CARDDB_SCHEMA      schema holding the cardinfo table, e.g. 'testing' for a cloned test table
+#     CARDDB_MINCONN     connections opened up front
+#     CARDDB_MAXCONN     most connections open at once; getconn() waits when all are in use
+#     CARDDB_RETRIES     extra attempts for a read whose connection dropped
+#     CARDDB_CHECK_IDLE  seconds a pooled connection may sit idle before it is pinged on checkout
+#     CARDDB_BACKEND     'postgres' (the default) or 'sqlite', see backend_postgres.py and backend_sqlite.py
+#     CARDDB_SQLITE_PATH file the sqlite backend keeps the cards in
+#
+# The [collections] section lists the card collections 'search all collections' reads, one per line as
+# 'label = schema' for a schema in the database above or 'label = schema | dsn' for another database.
+# CARDDB_COLLECTIONS, a comma-separated list of schemas in the database above, overrides it.
+#
+# Every connection's cursors return card rows as cards.Card records, see cards.py.
+
+import configparser
+import contextlib
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+import cards
+
+default_dsn = "dbname='cards' user='py_carddb' host='localhost' port='5432' password='password'"
+
+config_path = os.environ.get('CARDDB_CONFIG',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'carddb.ini'))
+
+default_sqlite_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'carddb.sqlite')
+
+
+def load_config():
+    # Read the pool settings, environment variables win over the config file
+    settings = {'dsn': default_dsn, 'schema': 'public', 'minconn': '1', 'maxconn': '5', 'retries': '2', 'check_idle': '30',
+                'backend': 'postgres', 'sqlite_path': default_sqlite_path}
+
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(config_path)
+    if parser.has_section('database'):
+        for key in settings:
+            settings[key] = parser.get('database', key, fallback=settings[key])
+
+    for key in settings:
+        env = os.environ.get('CARDDB_' + key.upper())
+        if env:
+            settings[key] = env
+
+    return {'dsn': settings['dsn'],
+            'schema': settings['schema'],
+            'minconn': int(settings['minconn']),
+            'maxconn': int(settings['maxconn']),
+            'retries': int(settings['retries']),
+            'check_idle': float(settings['check_idle']),
+            'backend': settings['backend'].lower(),
+            'sqlite_path': settings['sqlite_path']}
+
+
+def load_collections():
+    # Read the collections searched together, return {label: (schema, dsn)}
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(config_path)
+
+    collections = {}
+    env = os.environ.get('CARDDB_COLLECTIONS')
+    if env:
+        for schema in env.split(','):
+            if schema.strip():
+                collections[schema.strip()] = (schema.strip(), config['dsn'])
+    elif parser.has_section('collections'):
+        for label, value in parser.items('collections'):
+            schema, _, dsn = value.partition('|')
+            collections[label] = (schema.strip(), dsn.strip() or config['dsn'])
+
+    return collections or {'public': ('public', config['dsn'])}
+
+
+config = load_config()
+collections = load_collections()
+
+pool = None
+pool_lock = threading.Lock()
+pool_slots = None
+
+# When each pooled connection was last handed back, used to skip pinging busy connections
+last_used = {}
+
+# One open connection per collection, kept between searches
+source_conns = {}
+source_lock = threading.Lock()
+
+
+#---POOL-------------------------------------------------------------------------------------------------------
+
+
+def get_pool():
+    # Create the pool on first use
+    global pool
+    global pool_slots
+
+    with pool_lock:
+        if pool is None:
+            pool = psycopg2.pool.ThreadedConnectionPool(config['minconn'], config['maxconn'], config['dsn'],
+                                                        cursor_factory=cards.CardCursor)
+            pool_slots = threading.BoundedSemaphore(config['maxconn'])
+    return pool
+
+
+def is_alive(conn, max_idle=0):
+    # Check a connection can still talk to the server; connections used within 'max_idle' seconds are trusted
+    if conn.closed != 0:
+        return False
+
+    status = conn.get_transaction_status()
+    if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        # Only ping connections with no work in progress
+        return True
+    if time.monotonic() - last_used.get(id(conn), 0) < max_idle:
+        return True
+
+    try:
+        with conn.cursor() as ping:
+            ping.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def getconn():
+    # Check a live connection out of the pool, waiting for a free slot when all are in use
+    conn_pool = get_pool()
+    pool_slots.acquire()
+
+    try:
+        for attempt in range(config['retries'] + 1):
+            conn = conn_pool.getconn()
+            if is_alive(conn, config['check_idle']):
+                return conn
+            # Dead connections are closed and dropped, the next getconn() opens a fresh one
+            last_used.pop(id(conn), None)
+            conn_pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError('no live database connection after {} attempts'.format(config['retries'] + 1))
+    except:
+        pool_slots.release()
+        raise
+
+
+def putconn(conn, close=False):
+    # Return a connection to the pool, rolling back anything left open; 'close' discards it instead
+    if conn.closed == 0 and not close:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            close = True
+
+    if close or conn.closed != 0:
+        last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    else:
+        last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn)
+    pool_slots.release()
+
+
+def closeall():
+    # Close every pooled connection, e.g. when the program exits
+    global pool
+
+    with pool_lock:
+        if pool is not None and not pool.closed:
+            pool.closeall()
+        pool = None
+        last_used.clear()
+
+    close_sources()
+
+
+def is_disconnect(conn):
+    # True when an error left the connection unusable, as after a server restart or idle timeout
+    return conn is None or conn.closed != 0
+
+
+@contextlib.contextmanager
+def connection():
+    # Borrow a pooled connection for the length of a 'with' block
+    conn = getconn()
+    try:
+        yield conn
+    except:
+        putconn(conn, close=is_disconnect(conn))
+        raise
+    else:
+        putconn(conn)
+
+
+def read(fn, *args):
+    # Run a read-only fn(conn, *args) on a pooled connection, retrying on a fresh one if it drops
+    # Only use for idempotent reads: a retried call runs the whole function again
+    # Only a lost connection is retried: OperationalError also covers statement and lock timeouts,
+    # which would just run the same slow query again. connection() has already discarded a lost one
+    for attempt in range(config['retries'] + 1):
+        conn = None
+        try:
+            with connection() as conn:
+                return fn(conn, *args)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if not is_disconnect(conn) or attempt == config['retries']:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+
+
+#---COLLECTIONS------------------------------------------------------------------------------------------------
+
+
+def source_conn(label):
+    # The open connection to one collection's database, replaced if it has dropped
+    # Each collection is read by one worker at a time, so its connection is never shared between threads
+    with source_lock:
+        conn = source_conns.get(label)
+    if conn is not None and is_alive(conn, config['check_idle']):
+        return conn
+
+    if conn is not None:
+        conn.close()
+    conn = psycopg2.connect(collections[label][1], cursor_factory=cards.CardCursor)
+    with source_lock:
+        source_conns[label] = conn
+    return conn
+
+
+def close_sources():
+    # Close every collection connection
+    with source_lock:
+        for conn in source_conns.values():
+            if conn.closed == 0:
+                conn.close()
+            last_used.pop(id(conn), None)
+        source_conns.clear()
+
+
+def read_source(label, fn, *args):
+    # Run a read-only fn(conn, *args) on a collection's connection, retrying on a fresh one if it drops
+    for attempt in range(config['retries'] + 1):
+        conn = source_conn(label)
+        try:
+            result = fn(conn, *args)
+            conn.rollback()
+            last_used[id(conn)] = time.monotonic()
+            return result
+        except psycopg2.Error as e:
+            if not is_disconnect(conn):
+                conn.rollback()
+                raise
+            if not isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)) or attempt == config['retries']:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
@@ -18,37 +18,122 @@
 ###########################################################################################################
 
 
+import argparse
+import cards
+import concurrent.futures
+import contextlib
+import csv
 import datetime
+import importlib
+import decimal
+import db
+import io
 import os
+import output
 import psycopg2
+import psycopg2.extras
+import profiling
+import queries
+import query_builder
 import re
-import texttable as tt
+import shlex
+import sys
+import time
 
 
 #---OPEN_START--------------------------------------------------------------------------------------------------
 
 
 def clear_screen():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    # ANSI escapes clear the screen without spawning a shell; the Windows console still needs 'cls'
+    if os.name == 'nt':
+        os.system('cls')
+    else:
+        print('\033[2J\033[H', end='')
 
 
-# Try to establish database connection first, print a message and quit if unable
-try:
-    conn = psycopg2.connect("dbname='cards' user='py_carddb' host='localhost' port='5432' password='password'")
-    clear_screen()
-    print('\n     <<< Database connection established! >>>\n')
-    print('             Welcome to CardDB v1.4')
-    print('_' * 50)
-except:
+def connect_db():
+    # Check out the session connection and cursor every operation uses, return False if unable
+    # The backend, DSN and pool settings come from carddb.ini or CARDDB_* environment variables, see db.py
+    global conn
+    global cur
+
+    try:
+        conn = store.connect()
+    except store.Error:
+        return False
+
+    cur = conn.cursor()
+    return True
+
+
+def disconnect_db():
+    # Hand the session connection back to the pool and close the pool
+    # conn is None when the last reconnect failed, the dropped connection was already discarded then
+    global conn
+    global cur
+
+    if conn is not None:
+        cur.close()
+        store.release(conn, close=store.is_disconnect(conn))
+        conn = None
+        cur = None
+    store.close_all()
+
+
+def reconnect():
+    # Swap a dropped session connection for a fresh one from the pool, return False if unable
+    # The old connection is forgotten as soon as it is discarded, so a failed attempt leaves conn None
+    # rather than pointing at a connection the pool no longer owns
+    global conn
+    global cur
+
+    if conn is not None:
+        store.release(conn, close=True)
+        conn = None
+        cur = None
+    return connect_db()
+
+
+def run_read(fn, *args):
+    # Run a read on the session connection, reconnecting and retrying it if the connection dropped
+    for attempt in range(db.config['retries'] + 1):
+        try:
+            return fn(*args)
+        except store.disconnect_errors:
+            if not store.is_disconnect(conn) or attempt == db.config['retries'] or reconnect() == False:
+                raise
+
+
+def handle_db_error():
+    # Recover from a failed statement: roll back, or reconnect if the connection itself was lost
+    global message
+
     clear_screen()
-    print('\n<<< Unable to establish database connection. >>>\n')
-    quit()
+    if store.is_disconnect(conn):
+        if reconnect() == True:
+            message = '\n     <<< Database connection lost and re-established. The last operation was not saved. >>>'
+        else:
+            message = '\n     <<< Database connection lost. Check the server and try again. >>>'
+    else:
+        conn.rollback()
+        message = '\n     <<< Query failed, nothing was saved. See the database logs for info. >>>'
+
 
+# Storage backend holding the cards, chosen by 'backend' in carddb.ini, see backend_postgres.py
+backends = {'postgres': 'backend_postgres', 'sqlite': 'backend_sqlite'}
+if db.config['backend'] not in backends:
+    sys.exit('Unknown backend {!r} in carddb.ini, use one of {}'.format(db.config['backend'], ', '.join(backends)))
+store = importlib.import_module(backends[db.config['backend']])
+
+# Menu keys and commands built on PostgreSQL-only SQL, refused on other backends
+postgres_keys = ['f', 'c', 'b', 'k', 'i', 'x', 'r']
+postgres_commands = ['find', 'search-all', 'vend-batch', 'delete-many', 'import', 'export', 'changes', 'report']
 
 # Global variables
-cur = conn.cursor()
+conn = None
+cur = None
 message = ''
-add_data = {}
 
 columns_actual = {'i': 'ID', 's': 'sport', 'l': 'lastName', 'f': 'firstName', 'y': 'year', 't': 'team', 
             'c': 'company', 'v': 'valueEst', 'd': 'saleDate', 'p': 'salePrice'}
@@ -56,40 +141,50 @@ columns_actual = {'i': 'ID', 's': 'sport', 'l': 'lastName', 'f': 'firstName', 'y
 columns_disp = {'i': 'ID', 's': 'sport', 'l': 'last name', 'f': 'first name', 'y': 'year', 't': 'team', 
             'c': 'company', 'v': 'estimated value', 'd': 'sale date', 'p': 'sale price'}
 
+# Columns that allow NULL, and the number of rows shown per page of search results
+nullable_keys = 'vdp'
+page_size = 10
+
+# Command line flags for each column, e.g. 'main.py search --last smith --year gt1985'
+columns_flags = {'i': 'id', 's': 'sport', 'l': 'last', 'f': 'first', 'y': 'year', 't': 'team', 
+            'c': 'company', 'v': 'value', 'd': 'date', 'p': 'price'}
+
 
 def main_menu():
     # Displays the main menu with top-level options for database interaction
+    # Each operation returns here, so the loop runs any number of operations at a constant stack depth
     global message
-    global add_data
-    
-    add_data = {}
-    
-    if len(message) > 0:
-        print(message)
-        message = ''
 
-    print('\n MAIN MENU: select desired operation.\n')
+    while True:
+        if len(message) > 0:
+            print(message)
+            message = ''
+
+        print('\n MAIN MENU: select desired operation.\n')
+            
+        menu_choice = input(' [A]dd, Add [M]any, [S]earch, [F]ind, Search all [C]ollections, [E]dit, [V]end, [B]atch vend, [D]elete, Bul[k] delete, [I]mport, E[x]port, [R]eports, or [Q]uit >> ').strip().lower()
         
-    menu_choice = input(' [A]dd, [S]earch, [E]dit, [V]end, [D]elete, or [Q]uit >> ').strip().lower()
-    
-    # Validate main menu inputs
-    if menu_choice == 'a':
-        add_card()
-    elif menu_choice == 's':
-        search()
-    elif menu_choice == 'e':
-        edit_card()
-    elif menu_choice == 'v':
-        vend_card()
-    elif menu_choice == 'd':
-        delete_card()
-    elif menu_choice == 'q':
-        quit_carddb()
-    else:
-        clear_screen()
-        print('\n     <<< Invalid selection >>>')
-        print('_' * 50)
-        main_menu()
+        # Validate main menu inputs
+        if menu_choice == 'q':
+            if quit_carddb() == True:
+                return
+        elif menu_choice in postgres_keys and store.name != 'postgres':
+            clear_screen()
+            print('\n     <<< That needs the PostgreSQL backend, CardDB is using {}. >>>'.format(store.name))
+            print('_' * 50)
+        elif menu_choice in menu_actions:
+            # A session left idle at the menu may have been dropped by the server, or lost by an earlier
+            # failed reconnect; replace it first
+            if (conn is None or store.is_alive(conn) == False) and reconnect() == False:
+                clear_screen()
+                print('\n     <<< Database connection lost. Check the server and try again. >>>')
+                print('_' * 50)
+                continue
+            menu_actions[menu_choice]()
+        else:
+            clear_screen()
+            print('\n     <<< Invalid selection >>>')
+            print('_' * 50)
 
 
 #---UTILITIES--------------------------------------------------------------------------------------------------
@@ -145,14 +240,12 @@ def validate_price(inp):
     # Form validation for price columns
     if inp == 'Q' or inp == 'q':
         return 'Q'
+    # Decimal keeps the typed amount exact, where float would turn 0.1 into 0.1000000000000000055...
     try:
-        xx = float(inp)
-        if xx >= 0.00 and xx <= 99999.99:
-            return True
-        else:
-            return False
-    except:
+        xx = decimal.Decimal(inp)
+    except decimal.InvalidOperation:
         return False
+    return xx.is_finite() and 0 <= xx <= query_builder.max_price
 
 
 def validate_colChoice(inp):
@@ -166,10 +259,10 @@ def validate_colChoice(inp):
 
 
 def validate_id_int(inp):
-    # Validate input for ID field
+    # Validate input for ID field, IDs are bigints
     try:
         xx = int(inp)
-        if xx in range(0, 1001):
+        if 0 <= xx <= query_builder.max_id:
             return True
         else:
             return False
@@ -177,55 +270,14 @@ def validate_id_int(inp):
         return False 
 
 
-def validate_colParams(col, inp):
-    # Validate search terms, here called column params
-    varchars = 'slftcd'
-    prices = 'vp'
-    years = 'y'
-    id = 'i'
-    
-    if col in varchars:
-        if validate_varchar(inp) == True:
-            return True
-        else:
-            return False
-
-    elif col in years:
-        if validate_year(inp) == True:
-            return True
-        else:
-            return False
-
-    elif col in prices:
-        if validate_price(inp) == True:
-            return True
-        else:
-            return False
-
-    elif col in id:
-        if validate_id_int(inp) == True:
-            return True
-        else:
-            return False
-
-    else:
-        return False
-
-
-def validate_operator(inp):
-    # Validate the chosen operator for [y, v, d, p] columns in search()
-    try:
-        if inp == 'lt' or inp == 'eq' or inp == 'gt':
-            return True
-        else:
-            return False
-    except:
-        return False
+def card_by_id(id_choice):
+    # Fetch one card by ID, or None if there is no such card
+    store.run(cur, 'card_by_id', (id_choice,))
+    return cur.fetchone()
 
 
 def confirm_commit():
     # Confirm add, update, or delete prior to committing changes
-    global add_data
     global message
     
     if len(message) > 0:
@@ -239,7 +291,6 @@ def confirm_commit():
         try:
             conn.commit()
             clear_screen()
-            add_data = {}
             message = ''
             print('\n     <<< Changes committed. >>>')
             print('_' * 50)
@@ -248,18 +299,17 @@ def confirm_commit():
             print('\n     <<< Something went wrong. Admin: See database error log. >>>')
             print('_' * 50)
     elif commit_response == 'n':
+        conn.rollback()
         clear_screen()
-        add_data = {}
         message = ''
         print('\n     <<< The changes were not saved. >>>')
         print('_' * 50)
     else:
+        conn.rollback()
         clear_screen()
-        add_data = {}
         message = ''
         print('\n     <<< Invalid input. No changes saved. >>>')
         print('_' * 50)
-    main_menu()
 
 
 #---QUERY_CONSTRUCTORS-----------------------------------------------------------------------------------------
@@ -267,79 +317,70 @@ def confirm_commit():
 
 # Required, NOT NULL columns
 
-def input_sport():
-    global add_data
-    sp = remove_special(input(' Sport: ').strip().capitalize())
+# A 'default', such as the previous card's value in an add session, is kept by pressing Enter
+
+def input_sport(default=None):
+    prompt = ' Sport: ' if default is None else ' Sport [{}]: '.format(default)
+    sp = remove_special(input(prompt).strip().capitalize()) or default or ''
     while validate_varchar(sp) == False:
         print(' <<< Invalid sport >>>')
-        sp = remove_special(input(' Sport: ').strip().capitalize())
-    add_data.update({'sport': sp})
+        sp = remove_special(input(prompt).strip().capitalize()) or default or ''
     return sp
 
 
 def input_lastName():
-    global add_data
     ln = remove_special(input(' Last Name: ').strip().capitalize())
     while validate_varchar(ln) == False:
         print(' <<< Invalid last name >>>')
         ln = remove_special(input(' Last Name: ').strip().capitalize())
-    add_data.update({'lastName': ln})
     return ln
 
 
 def input_firstName():
-    global add_data
     fn = remove_special(input(' First Name: ').strip().capitalize())
     while validate_varchar(fn) == False:
         print(' <<< Invalid first name >>>')
         fn = remove_special(input(' First Name: ').strip().capitalize())
-    add_data.update({'firstName': fn})
     return fn
 
 
 def input_team():
-    global add_data
     tm = remove_special(input(' Team on card: ').strip().capitalize())
     while validate_varchar(tm) == False:
         print(' <<< Invalid team >>>')
         tm = remove_special(input(' Team on card: ').strip().capitalize())
-    add_data.update({'team': tm})
     return tm
 
 
-def input_year():
-    global add_data
-    cy = remove_special(input(' Card year as yyyy: ').strip())
+def input_year(default=None):
+    prompt = ' Card year as yyyy: ' if default is None else ' Card year as yyyy [{}]: '.format(default)
+    cy = remove_special(input(prompt).strip()) or default or ''
     if cy == 'Q' or cy == 'q':
         return 'Q'
     while validate_year(cy) == False:
         print(' <<< Invalid year >>>')
-        cy = remove_special(input(' Card year as yyyy: ').strip())
+        cy = remove_special(input(prompt).strip()) or default or ''
         if cy == 'Q' or cy == 'q':
             return 'Q'
-    add_data.update({'year': cy})
     return cy
 
 
-def input_co():
-    global add_data
-    co = remove_special(input(' Company: ').strip().capitalize())
+def input_co(default=None):
+    prompt = ' Company: ' if default is None else ' Company [{}]: '.format(default)
+    co = remove_special(input(prompt).strip().capitalize()) or default or ''
     while validate_varchar(co) == False:
         print(' <<< Invalid company >>>')
-        co = remove_special(input(' Company: ').strip().capitalize())
-    add_data.update({'company': co})
+        co = remove_special(input(prompt).strip().capitalize()) or default or ''
     return co
 
 
 # Optional NULL columns
 
 def input_valueEst():
-    global add_data
     ve = remove_special(input(' Estimated value (Null): ').strip())
     if ve == 'Q' or ve == 'q':
         return 'Q'
     elif ve == '':
-        add_data.update({'valueEst': None})
         return
     
     while ve != '' and validate_price(ve) == False:
@@ -348,20 +389,16 @@ def input_valueEst():
         if ve == 'Q' or ve == 'q':
             return 'Q'
     if ve == '':
-        add_data.update({'valueEst': None})
         return
     else:
-        add_data.update({'valueEst': ve})
         return ve
 
 
 def input_saleDate():
-    global add_data
     sd = remove_special(input(' Sale date as yyyy-mm-dd (Null): ').strip())
     if sd == 'Q' or sd == 'q':
         return 'Q'
     elif sd == '':
-        add_data.update({'saleDate': None})
         return False
     
     while sd != '' and validate_date(sd) == False:
@@ -370,20 +407,16 @@ def input_saleDate():
         if sd == 'Q' or sd == 'q':
             return 'Q'
     if sd == '':
-        add_data.update({'saleDate': None})
         return False
     else:
-        add_data.update({'saleDate': sd})
         return sd
     
 
 def input_salePrice():
-    global add_data
     pr = remove_special(input(' Sale price (Null): ').strip())
     if pr == 'Q' or pr == 'q':
         return 'Q'
     elif pr == '':
-        add_data.update({'salePrice': None})
         return False
     
     while pr != '' and validate_price(pr) == False:
@@ -392,117 +425,152 @@ def input_salePrice():
         if pr == 'Q' or pr == 'q':
             return 'Q'
     if pr == '':
-        add_data.update({'salePrice': None})
         return False
     else:
-        add_data.update({'salePrice': pr})
         return pr
 
 
 #---MAIN_BLOCK-------------------------------------------------------------------------------------------------
 
 
-def add_card():
-    # Add a card to the database, if inputs are valid
-    global message
-    global add_data
-    clear_screen()
-    print('\n Enter card values as prompted. Required unless (Null), press Enter to skip.\n')
-
-    sp = input_sport()
+def input_card(previous=None):
+    # Prompt for one card's values, return them as a Card, or 'Q' if entry was canceled
+    # Sport, year and company default to those of the 'previous' Card, if given
+    sp = input_sport(None if previous is None else previous.sport)
     if sp == 'Q':
-        clear_screen()
-        message = '\n     <<< Card entry canceled >>>'
-        main_menu()
+        return 'Q'
 
     ln = input_lastName()
     if ln == 'Q':
-        clear_screen()
-        message = '\n     <<< Card entry canceled >>>'
-        main_menu()
+        return 'Q'
 
     fn = input_firstName()
     if fn == 'Q':
-        clear_screen()
-        message = '\n     <<< Card entry canceled >>>'
-        main_menu()
+        return 'Q'
 
-    cy = input_year()
+    cy = input_year(None if previous is None else str(previous.year))
     if cy == 'Q':
-        clear_screen()
-        message = '\n     <<< Card entry canceled >>>'
-        main_menu()
-    
+        return 'Q'
+
     tm = input_team()
     if tm == 'Q':
-        clear_screen()
-        message = '\n     <<< Card entry canceled >>>'
-        main_menu()
+        return 'Q'
 
-    co = input_co()
+    co = input_co(None if previous is None else previous.company)
     if co == 'Q':
-        clear_screen()
-        message = '\n     <<< Card entry canceled >>>'
-        main_menu()
-    
+        return 'Q'
+
     ve = input_valueEst()
     if ve == 'Q':
-        clear_screen()
-        message = '\n     <<< Card entry canceled >>>'
-        main_menu()
-    
+        return 'Q'
+
     sd = input_saleDate()
     if sd == 'Q':
-        clear_screen()
-        message = '\n     <<< Card entry canceled >>>'
-        main_menu()
-    
+        return 'Q'
+
     pr = input_salePrice()
     if pr == 'Q':
+        return 'Q'
+
+    return cards.new_card(sp, ln, fn, cy, tm, co, ve, sd or None, pr or None)
+
+
+def add_card():
+    # Add a card to the database, if inputs are valid
+    global message
+    clear_screen()
+    print('\n Enter card values as prompted. Required unless (Null), press Enter to skip.\n')
+
+    card = input_card()
+    if card == 'Q':
         clear_screen()
         message = '\n     <<< Card entry canceled >>>'
-        main_menu()
+        return
 
-    message = '\n [ {} {}, {} - {} ({}) ] will be added to the database.\n'.format(fn, ln, tm, cy, co)
-    
-    # Build INSERT query by iterating over the 'global add_data' dict
+    message = '\n [ {} {}, {} - {} ({}) ] will be added to the database.\n'\
+              .format(card.firstName, card.lastName, card.team, card.year, card.company)
+
+    # Run the prepared INSERT with the card built from the answers
     try:
-        cur.execute(
-                    """INSERT INTO public.cardinfo 
-                        (sport, "lastName", "firstName", year, team, company, "valueEst", "saleDate", "salePrice")
-                        VALUES
-                        (%(sport)s, %(lastName)s, %(firstName)s, %(year)s, %(team)s, 
-                        %(company)s, %(valueEst)s, %(saleDate)s, %(salePrice)s);""", 
-                        add_data)
-    except:
-        clear_screen()
-        print('\n     <<< Fatal error. See database logs for info. >>>\n')
-        cur.close()
-        conn.close()
-        quit()
+        store.run(cur, 'insert_card', cards.insert_values(card))
+    except store.Error:
+        handle_db_error()
+        return
 
     # Confirm changes before committing to the database
     confirm_commit()
 
 
-def search():
-    # Search by up to two columns at a time
+def add_session():
+    # Enter any number of cards in a row, then add them all with one INSERT and a single commit
+    # Sport, year and company carry over from the previous card, so a box from one set is quick to type
+    global message
+
+    clear_screen()
+    print('\n     <<< ADD SESSION >>>')
+    print('\n Enter cards one after another. Sport, year and company default to the previous card\'s,')
+    print(' press Enter to keep them. Q at any prompt discards the card being entered.')
+    print(' Nothing is saved until you finish the session.')
+    staged = []
+
+    while True:
+        print('\n Card {}:\n'.format(len(staged) + 1))
+        card = input_card(staged[-1] if len(staged) > 0 else None)
+        if card == 'Q':
+            print('\n     <<< Card discarded >>>')
+        else:
+            staged.append(card)
+
+        # An undo asks again, so several cards can be undone, or the session finished, without entering another
+        choice = None
+        while choice not in ('', 'f', 'q'):
+            choice = input('\n {} cards staged. [Enter] for the next card, [U]ndo the last card, [F]inish and save, '
+                           'or [Q]uit without saving >> '.format(len(staged))).strip().lower()
+            if choice == 'u' and len(staged) > 0:
+                card = staged.pop()
+                print('\n     <<< Removed {} {} ({}) >>>'.format(card.firstName, card.lastName, card.year))
+            elif choice == 'u':
+                print('\n     <<< No cards to undo >>>')
+        if choice == 'f':
+            break
+        elif choice == 'q':
+            clear_screen()
+            message = '\n     <<< Add session canceled, no cards were saved >>>'
+            return
+
+    clear_screen()
+    if len(staged) == 0:
+        message = '\n     <<< No cards were entered >>>'
+        return
+
+    print('\n The following cards will be added:\n')
+    output.write_table(output.card_layout(), staged)
+
+    # Every staged card goes in with one multi-row INSERT, committed once below
+    try:
+        store.insert_many(cur, staged)
+    except store.Error:
+        handle_db_error()
+        return
+
+    message = '\n {} cards will be added to the database.\n'.format(len(staged))
+    confirm_commit()
+
+
+def search_prompt():
+    # Prompt for any number of search columns and terms, return a parameterized WHERE clause
     clear_screen()
     
     global message
     global columns_actual 
     global columns_disp
     
-    # Set some variables
-    build_operators = []
-    query_list = []
-
     # Begin search function with menu and input prompt
     print('\n     <<< SEARCH OPTIONS >>>')
     
     print('\n [I]D, [S]port, [L]ast name, [F]irst name, [Y]ear, [T]eam, [C]ompany,')
     print(' [V]alue est., [D]ate of sale, [P]rice, [Q]uit to Main Menu')
-    print('\n Enter up to two (2) desired search fields (Example: sv ) \n')
+    print('\n Enter one or more desired search fields (Example: yvt ) \n')
 
     # Prompt for columns to search in
     col_choice = input(' >> ').replace(' ','').lower().strip()
@@ -511,24 +579,19 @@ def search():
     if 'q' in col_choice:
         clear_screen()
         message = '\n     <<< Search action canceled >>>\n'
-        main_menu()
+        return None
     
     # Check for empty column input
     if col_choice == '':
         clear_screen()
         message = '\n     <<< Empty column input >>>\n'
-        main_menu()
+        return None
     
-    # Make sure only 1 or 2 columns are elected
-    if len(col_choice) > 2:
+    # Each column may only be chosen once
+    if len(set(col_choice)) != len(col_choice):
         clear_screen()
         message = '\n     <<< Invalid column input >>>\n'
-        main_menu()
-    elif len(col_choice) == 2:
-        if col_choice[0] == col_choice[1]:
-            clear_screen()
-            message = '\n     <<< Invalid column input >>>\n'
-            main_menu()
+        return None
 
     clear_screen()
     
@@ -537,222 +600,466 @@ def search():
         if validate_colChoice(col) == False:
             clear_screen()
             message = '\n     <<< Invalid column input >>>\n'
-            main_menu()
+            return None
+
+    print('\n Search terms: text matches anywhere in the field, and a,b matches either term.')
+    print(' Numbers and dates may be preceded by [lt, le, gt, ge, eq], written as a range like 1985..1990,')
+    print(' or listed like 1984,1987. Dates follow a yyyy-mm-dd format.')
+    print(' Enter null or notnull to find empty or filled-in fields, e.g. sale date null for unsold cards.')
 
-    # If column is among dynamically searchable fields, give 'lt, gt, eq' options
+    terms = []
     for col in col_choice:
-        if col in 'iyvdp':
-            print('\n Optional: Precede search term by [lt, gt, eq] for less than, greater than, equals. Default is eq.')
-            print('\n Recall that dates follow a yyyy-mm-dd format.')
-            s_term = remove_special(input('\n Enter search term for ' + columns_disp[col] + ': ').lower().strip())
-            
-            # Check for empty input
-            if s_term == '' or len(s_term) == 0:
-                clear_screen()
-                message = '\n     <<< Empty search terms >>>'
-                main_menu()
-            
-            # Extract the first two chars to see if they are 'lt, gt, eq' operators
-            check_ops = s_term[0] + s_term[1] if len(s_term) > 1 else s_term[0]
-            s_term2 = s_term[2:] if len(s_term) >= 2 and str(s_term[0:2]) in 'ltgteq' else s_term
-
-            # Add 'lt, gt, eq' operators to build_operators if given as input
-            if validate_operator(check_ops) == True:
-                if check_ops == 'lt':
-                    build_operators.append('<')
-                elif check_ops == 'eq':
-                    build_operators.append('=')
-                elif check_ops == 'gt':
-                    build_operators.append('>')
-            # Otherwise, add the default '=' to build_operators
-            else:
-                build_operators.append('=')
-            
-            # Validate search terms for 'iyvdp' column
-            if validate_colParams(col, s_term2) == True:
-                query_list.append((columns_actual[col], s_term2))
+        s_term = input('\n Enter search term for ' + columns_disp[col] + ': ').strip()
+
+        if s_term.lower() == 'q':
+            clear_screen()
+            message = '\n     <<< Search action canceled >>>'
+            return None
+        elif s_term == '':
+            clear_screen()
+            message = '\n     <<< Empty search terms >>>'
+            return None
+        terms.append((col, s_term))
+
+    # Columns and search terms are valid, build the WHERE clause shared by the count and page queries
+    try:
+        return query_builder.build_where(terms)
+    except ValueError as e:
+        clear_screen()
+        message = '\n     <<< Invalid search terms: ' + str(e) + ' >>>'
+        return None
+
+
+def sort_prompt():
+    # Prompt for the column search results are ordered by, defaulting to ID
+    print('\n Sort results by [I]D, [S]port, [L]ast name, [F]irst name, [Y]ear, [T]eam, [C]ompany,')
+    print(' [V]alue est., [D]ate of sale, or [P]rice. Press Enter for ID.\n')
+    sort_choice = input(' >> ').replace(' ','').lower().strip()
+
+    if sort_choice == '':
+        return 'i'
+    elif len(sort_choice) == 1 and validate_colChoice(sort_choice) == True:
+        return sort_choice
+    else:
+        return False
+
+
+def search_count(s_where, s_params):
+    # Count the cards matching a WHERE clause on the server
+    store.execute(cur, queries.count_query(s_where), s_params, kind='count')
+    return cur.fetchone()[0]
+
+
+def page_sql(s_where, s_params, sort_key, row=None, direction='next', limit=page_size, table=queries.card_table):
+    # Build the query for one page of results in (sort column, "ID") order, return (sql, params)
+    # Pages seek past 'row', the last (or first) row of the current page, instead of using OFFSET
+    sort_col = columns_actual[sort_key]
+    params = list(s_params)
+    seek = ''
+
+    if row is not None:
+        row_id = row.ID
+        row_val = getattr(row, sort_col)
+        if sort_key == 'i':
+            seek = ' AND "ID" {} %s'.format('>' if direction == 'next' else '<')
+            params.append(row_id)
+        # Nullable columns sort NULLs last, so a NULL key needs its own branch
+        elif row_val is None:
+            if direction == 'next':
+                seek = ' AND ("{}" IS NULL AND "ID" > %s)'.format(sort_col)
             else:
-                clear_screen()
-                message = '\n     <<< Invalid search terms >>>'
-                main_menu()
-                
-        # Or, if columns selected are varchar fields, accept input, strip spaces and specials, validate
+                seek = ' AND ("{}" IS NOT NULL OR "ID" < %s)'.format(sort_col)
+            params.append(row_id)
+        elif direction == 'next':
+            seek = ' AND (("{0}", "ID") > (%s, %s){1})'\
+            .format(sort_col, ' OR "{}" IS NULL'.format(sort_col) if sort_key in nullable_keys else '')
+            params.extend([row_val, row_id])
         else:
-            s_term = remove_special(input('\nEnter search term for ' + columns_disp[col] + ': ').lower().strip())
-            if s_term == 'q':
-                clear_screen()
-                message = '\n     <<< Search action canceled >>>'
-                main_menu()
-            elif s_term == '' or len(s_term) == 0:
-                clear_screen()
-                message = '\n     <<< Empty search terms >>>'
-                main_menu()
-            elif validate_colParams(col, s_term) == True:
-                query_list.append((columns_actual[col], '%' + s_term + '%'))
-                build_operators.append('ILIKE')
-            else:
-                clear_screen()
-                message = '\n     <<< Invalid search terms >>>'
-                main_menu()
+            seek = ' AND ("{}", "ID") < (%s, %s)'.format(sort_col)
+            params.extend([row_val, row_id])
+
+    if sort_key == 'i':
+        order = '"ID"' if direction == 'next' else '"ID" DESC'
+    else:
+        # NULLs sort last going forward, as PostgreSQL does by default; spelled out for other backends
+        nulls = (' NULLS LAST', ' NULLS FIRST') if sort_key in nullable_keys else ('', '')
+        order = '"{0}"{1}, "ID"'.format(sort_col, nulls[0]) if direction == 'next' \
+                else '"{0}" DESC{1}, "ID" DESC'.format(sort_col, nulls[1])
 
+    params.append(int(limit))
+    return queries.page_query(s_where + seek, order, table), params
 
-    # Columns and search terms are valid, build search query
-    if len(col_choice) == 1:
-        s_query = """SELECT * FROM public.cardinfo WHERE "{}" {} '{}';"""\
-        .format(query_list[0][0], build_operators[0], query_list[0][1])
-        build_operators = []
-        query_list = []
-    elif len(col_choice) == 2:
-        s_query = """SELECT * FROM public.cardinfo WHERE "{}" {} '{}' AND "{}" {} '{}';"""\
-        .format(query_list[0][0], build_operators[0], query_list[0][1], query_list[1][0], build_operators[1], query_list[1][1])
-        build_operators = []
-        query_list = []
 
-    # Execute search query, store some variables about number of rows that match
-    try:
-        cur.execute(s_query)
-    except:
+def search_page(s_where, s_params, sort_key, row=None, direction='next', limit=page_size):
+    # Fetch one page of results on the session connection, see page_sql()
+    store.execute(cur, *page_sql(s_where, s_params, sort_key, row, direction, limit), kind='page')
+    results = cur.fetchall()
+
+    # Pages fetched backwards come out in reverse order
+    if direction == 'prev':
+        results.reverse()
+    return results
+
+
+def stream_search(s_where, s_params, sort_key, limit, out):
+    # Write the first 'limit' matches as a table while they arrive, see the backends' stream()
+    # Only a batch of rows is held in memory at a time, however large the limit
+    with profiling.measure('search_stream') as timing, \
+         contextlib.closing(store.stream(conn, *page_sql(s_where, s_params, sort_key, limit=limit))) as rows:
+        timing['rows'] = output.write_table(output.card_layout(), rows, out)
+
+
+def search():
+    # Search by any number of columns at a time, paging through the results
+    global message
+
+    s_filter = search_prompt()
+    if s_filter is None:
+        return
+    s_where, s_params = s_filter
+
+    sort_key = sort_prompt()
+    if sort_key == False:
         clear_screen()
-        print('\n     <<< Fatal error. See the database logs for info. >>>\n')
-        cur.close()
-        conn.close()
-        quit()
+        message = '\n     <<< Invalid sort column >>>\n'
+        return
+
+    # Count matches on the server, then fetch only the rows that will be displayed
+    try:
+        total_rows = run_read(search_count, s_where, s_params)
+        results = run_read(search_page, s_where, s_params, sort_key)
+    except store.Error:
+        handle_db_error()
+        return
 
-    results = cur.fetchmany(10)
-    total = cur.fetchall()
-    
-    current_rows = len(results)
-    total_rows = len(total) + 10
-    
     # Clear screen and prepare to display search results
     clear_screen()
     
     print('\n     <<< Search complete! >>>')
     
-    if current_rows > 1 and current_rows <= 10 and total_rows == 10:
-        print('\n     ' + str(current_rows) + ' rows returned (max 10)')
-    elif total_rows > 10:
-        print('\n     ' + str(current_rows) + ' rows returned (max 10) of ' + str(total_rows) + ' that match search criteria.')
-    elif current_rows == 0:
+    if len(results) == 0:
         print('\n     <<< No results match the query. >>>\n')
-        main_menu()
-    
-    # Build table of search results
-    res = tt.Texttable()
-    header = ['ID', 'Sport', 'Last name', 'First name', 'Year', 'Team', 'Co.', 'Est. Value', 'Sale date', 'Sale price']
-    res.header(header)
-    res.set_cols_width([4, 10, 10, 10, 6, 10, 10, 8, 10, 8])
-    res.set_cols_align(['c']*10)
-    res.set_cols_valign(['m']*10)
-    res.set_chars(['-','|','+','='])
-
-    # Print the table to the screen
-    if len(results) != 0:
+        return
+
+    page_num = 1
+    total_pages = (total_rows + page_size - 1) // page_size
+
+    while True:
+        print('\n     Page ' + str(page_num) + ' of ' + str(total_pages) + ', ' + str(total_rows) 
+              + ' rows match search criteria. Sorted by ' + columns_disp[sort_key] + '.')
+
+        # Print the table of search results to the screen
         print('\n')
-        for row in results:
-            res.add_row([row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9]])
-        results_table = res.draw()
-        print(results_table)
+        output.write_table(output.card_layout(), results)
+
+        # Only offer the directions that lead somewhere
+        page_ops = []
+        if page_num < total_pages:
+            page_ops.append('[N]ext')
+        if page_num > 1:
+            page_ops.append('[P]revious')
+        page_ops.append('[E]xport all results')
+        page_ops.append('[Q]uit to Main Menu')
+        page_choice = input('\n ' + ', '.join(page_ops) + ' >> ').strip().lower()
+
+        if page_choice == 'q' or page_choice == '':
+            break
+        elif page_choice == 'e':
+            export_prompt(s_where, s_params)
+            return
+        elif page_choice == 'n' and page_num < total_pages:
+            direction = 'next'
+            seek_row = results[-1]
+        elif page_choice == 'p' and page_num > 1:
+            direction = 'prev'
+            seek_row = results[0]
+        else:
+            clear_screen()
+            print('\n     <<< Invalid selection >>>')
+            continue
 
-    main_menu()
+        try:
+            page = run_read(search_page, s_where, s_params, sort_key, seek_row, direction)
+        except store.Error:
+            handle_db_error()
+            return
 
+        clear_screen()
 
-def edit_card():
-    # Prompt for new value, validate
-    global message
-    global columns_actual
-    global columns_disp
+        # Rows may have been deleted since the count was taken; stay on the current page if so
+        if len(page) == 0:
+            print('\n     <<< No more results in that direction. >>>')
+            continue
+
+        results = page
+        page_num = page_num + 1 if direction == 'next' else page_num - 1
 
-    # Display the edit menu
     clear_screen()
-    print('\n     <<< EDIT OPTIONS >>>')
-    id_choice = remove_special(input('\n Enter \'ID\' of card you wish to edit: ').replace(' ','').lower().strip())
-    if validate_id_int(id_choice) == True:
-        id_query = """SELECT * FROM public.cardinfo WHERE "ID" = {};""".format(id_choice)
-    else:
-        clear_screen()
-        print('\n     <<< Invalid ID >>>')
-        main_menu()
 
-    # Execute search by ID query, return the one result
-    cur.execute(id_query)
-    results = cur.fetchone()
-    
-    # Check to see if given ID matches a card in the database
-    try:
-        # Will fail if no record returned
-        aa = len(results)
-    except:
-        clear_screen()
-        print('\n     <<< No card with that ID exists. >>>\n')
-        main_menu()
 
-    # Build table of search results
-    res = tt.Texttable()
-    header = ['ID', 'Sport', 'Last name', 'First name', 'Year', 'Team', 'Co.', 'Est. Value', 'Sale date', 'Sale price']
-    res.header(header)
-    res.set_cols_width([4, 10, 10, 10, 6, 10, 10, 8, 10, 8])
-    res.set_cols_align(['c']*10)
-    res.set_cols_valign(['m']*10)
-    res.set_chars(['-','|','+','='])
+def search_source(conn, label, s_where, s_params, sort_key, limit):
+    # Count and fetch the first 'limit' matches in one collection, on that collection's own connection
+    table = queries.collection_table(db.collections[label][0])
+    start = time.perf_counter()
 
-    # Print results table
-    print('\n')
-    res.add_row([results[0], results[1], results[2], results[3], results[4], results[5], results[6], results[7], results[8], results[9]])
-    results_table = res.draw()
-    print(results_table)
+    with conn.cursor() as s_cur:
+        queries.execute(s_cur, queries.count_query(s_where, table), s_params, kind='collection_count')
+        total_rows = s_cur.fetchone()[0]
+        queries.execute(s_cur, *page_sql(s_where, s_params, sort_key, limit=limit, table=table), kind='collection_page')
+        rows = s_cur.fetchall()
 
-    # Prompt for column to edit
-    print('\n [I]D, [S]port, [L]ast name, [F]irst name, [Y]ear, [T]eam, [C]ompany,')
-    print(' [V]alue est., [D]ate of sale, [P]rice, [Q]uit to Main Menu')
-    ecol_choice = remove_special(input('\n Select the field you wish to edit: ').replace(' ','').lower().strip())
+    return total_rows, rows, time.perf_counter() - start
 
-    # Validate column choice
-    if ecol_choice == 'q':
-        clear_screen()
-        message = '\n     <<< Edit action canceled >>>\n'
-        main_menu()
-    elif ecol_choice == 'i':
-        clear_screen()
-        message = '\n     <<< Cannot edit ID field >>>\n'
-        main_menu()
-    elif validate_colChoice(ecol_choice) == False:
-        clear_screen()
-        message = '\n     <<< Invalid column input >>>\n'
-        main_menu()
-    elif validate_colChoice(ecol_choice) == True:
 
-        # Check if desired edit column is in a date or int field
-        if ecol_choice in 'yvdp':
-            edit = remove_special(input('\n Enter new value for \'' + columns_disp[ecol_choice] + '\': ').strip().lower())
-            if edit == len(edit) == 0:
-                clear_screen()
-                message = '\n     <<< Empty input >>>\n'
-                main_menu()
-            elif edit == 'q':
+def merge_key(item, sort_key):
+    # Order merged (label, row) pairs like the database does: sort column with NULLs last, then ID
+    # Text is compared case-insensitively, which is close to, but not exactly, the server's collation
+    label, card = item
+    val = getattr(card, columns_actual[sort_key])
+    if isinstance(val, str):
+        val = val.lower()
+    return (val is None, 0 if val is None else val, card.ID, label)
+
+
+def search_all(s_where, s_params, sort_key, limit=page_size):
+    # Run one search on every collection in db.collections at once, one thread and connection each,
+    # so the search takes about as long as the slowest collection rather than all of them in turn
+    # Returns {label: (total rows, seconds) or an error string} and the first 'limit' rows as (label, row)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(db.collections)) as workers:
+        futures = {label: workers.submit(db.read_source, label, search_source, label, s_where, s_params, sort_key, limit)
+                   for label in db.collections}
+
+    summary = {}
+    merged = []
+    for label, future in futures.items():
+        try:
+            total_rows, rows, seconds = future.result()
+        except store.Error as e:
+            # One unavailable collection does not stop the others from being shown
+            summary[label] = str(e).strip().split('\n')[0]
+            continue
+        summary[label] = (total_rows, seconds)
+        merged.extend((label, row) for row in rows)
+
+    # Each collection sent its own first 'limit' rows, so the first 'limit' merged rows are the overall first
+    merged.sort(key=lambda item: merge_key(item, sort_key))
+    return summary, merged[:limit]
+
+
+def print_search_all(summary, merged, sort_key, out=None):
+    # Print the per-collection counts and timings, then the merged rows labeled by collection
+    out = out or sys.stdout
+    for label, result in summary.items():
+        if isinstance(result, str):
+            out.write(' {}: unavailable ({})\n'.format(label, result))
+        else:
+            out.write(' {}: {} matching rows in {:.0f} ms\n'.format(label, result[0], result[1] * 1000))
+
+    if len(merged) > 0:
+        out.write('\n First {} rows across all collections, sorted by {}.\n\n'.format(len(merged), columns_disp[sort_key]))
+        output.write_table(output.card_layout(sources=True), merged, out)
+
+
+def find_count(ts_query):
+    # Count the cards matching a free-text search
+    queries.execute(cur, queries.find_count_query(), (ts_query,), kind='find_count')
+    return cur.fetchone()[0]
+
+
+def find_page(ts_query, offset=0, limit=page_size):
+    # One page of free-text matches, best match first, as Cards without their rank
+    queries.execute(cur, queries.find_query(), (ts_query, int(limit), int(offset)), kind='find_page')
+    return [cards.Card._make(row[:-1]) for row in cur.fetchall()]
+
+
+def find_cards():
+    # Free-text search across the sport, name, team, company and year of every card, ranked by relevance
+    global message
+
+    clear_screen()
+    print('\n     <<< FIND >>>')
+    print('\n Type any words from a card, e.g. ripken orioles topps 1982. Words may be cut short (rip).')
+    text = input('\n Find, or [Q]uit to Main Menu >> ').strip()
+
+    if text.lower() == 'q' or text == '':
+        clear_screen()
+        message = '\n     <<< Search action canceled >>>'
+        return
+
+    ts_query = query_builder.prefix_tsquery(text)
+    if ts_query is None:
+        clear_screen()
+        message = '\n     <<< Type at least one letter or number >>>'
+        return
+
+    try:
+        total_rows = run_read(find_count, ts_query)
+        results = run_read(find_page, ts_query)
+    except store.Error:
+        handle_db_error()
+        return
+
+    clear_screen()
+    if len(results) == 0:
+        print('\n     <<< No cards match ' + text + ' >>>\n')
+        return
+
+    page_num = 1
+    total_pages = (total_rows + page_size - 1) // page_size
+
+    while True:
+        print('\n     Page {} of {}, {} cards match {}. Best matches first.\n'.format(page_num, total_pages, total_rows, text))
+        output.write_table(output.card_layout(), results)
+
+        page_ops = []
+        if page_num < total_pages:
+            page_ops.append('[N]ext')
+        if page_num > 1:
+            page_ops.append('[P]revious')
+        page_ops.append('[Q]uit to Main Menu')
+        page_choice = input('\n ' + ', '.join(page_ops) + ' >> ').strip().lower()
+
+        if page_choice == 'q' or page_choice == '':
+            break
+        elif page_choice == 'n' and page_num < total_pages:
+            page_num += 1
+        elif page_choice == 'p' and page_num > 1:
+            page_num -= 1
+        else:
+            clear_screen()
+            print('\n     <<< Invalid selection >>>')
+            continue
+
+        try:
+            page = run_read(find_page, ts_query, (page_num - 1) * page_size)
+        except store.Error:
+            handle_db_error()
+            return
+
+        clear_screen()
+        if len(page) == 0:
+            print('\n     <<< No more results in that direction. >>>')
+            page_num -= 1
+            continue
+        results = page
+
+    clear_screen()
+
+
+def search_collections():
+    # Search every configured collection with one filter, see search_all()
+    global message
+
+    s_filter = search_prompt()
+    if s_filter is None:
+        return
+    s_where, s_params = s_filter
+
+    sort_key = sort_prompt()
+    if sort_key == False:
+        clear_screen()
+        message = '\n     <<< Invalid sort column >>>\n'
+        return
+
+    summary, merged = search_all(s_where, s_params, sort_key)
+
+    clear_screen()
+    print('\n     <<< Searched {} collections >>>\n'.format(len(summary)))
+    print_search_all(summary, merged, sort_key)
+    input('\n Press Enter to return to the Main Menu. ')
+    clear_screen()
+
+
+def edit_card():
+    # Prompt for new value, validate
+    global message
+    global columns_actual
+    global columns_disp
+
+    # Display the edit menu
+    clear_screen()
+    print('\n     <<< EDIT OPTIONS >>>')
+    id_choice = remove_special(input('\n Enter \'ID\' of card you wish to edit: ').replace(' ','').lower().strip())
+    if validate_id_int(id_choice) == True:
+        id_params = (id_choice,)
+    else:
+        clear_screen()
+        print('\n     <<< Invalid ID >>>')
+        return
+
+    # Execute search by ID query, return the one result
+    try:
+        results = run_read(card_by_id, *id_params)
+    except store.Error:
+        handle_db_error()
+        return
+    
+    # Check to see if given ID matches a card in the database
+    try:
+        # Will fail if no record returned
+        aa = len(results)
+    except:
+        clear_screen()
+        print('\n     <<< No card with that ID exists. >>>\n')
+        return
+
+    # Print results table
+    print('\n')
+    output.write_table(output.card_layout(), [results])
+
+    # Prompt for column to edit
+    print('\n [I]D, [S]port, [L]ast name, [F]irst name, [Y]ear, [T]eam, [C]ompany,')
+    print(' [V]alue est., [D]ate of sale, [P]rice, [Q]uit to Main Menu')
+    ecol_choice = remove_special(input('\n Select the field you wish to edit: ').replace(' ','').lower().strip())
+
+    # Validate column choice
+    if ecol_choice == 'q':
+        clear_screen()
+        message = '\n     <<< Edit action canceled >>>\n'
+        return
+    elif ecol_choice == 'i':
+        clear_screen()
+        message = '\n     <<< Cannot edit ID field >>>\n'
+        return
+    elif validate_colChoice(ecol_choice) == False:
+        clear_screen()
+        message = '\n     <<< Invalid column input >>>\n'
+        return
+    elif validate_colChoice(ecol_choice) == True:
+
+        # Check if desired edit column is in a date or int field
+        if ecol_choice in 'yvdp':
+            edit = remove_special(input('\n Enter new value for \'' + columns_disp[ecol_choice] + '\': ').strip().lower())
+            if edit == len(edit) == 0:
+                clear_screen()
+                message = '\n     <<< Empty input >>>\n'
+                return
+            elif edit == 'q':
                 clear_screen()
                 message = '\n     <<< Edit action canceled >>>\n'
-                main_menu()
+                return
             elif ecol_choice == 'd':
                 if validate_date(edit) == False:
                     clear_screen()
                     message = '\n     <<< Invalid date >>>\n'
-                    main_menu()
+                    return
             elif ecol_choice == 'y':
                 if validate_year(edit) == False:
                     clear_screen()
                     message = '\n     <<< Invalid year >>>\n'
-                    main_menu()
+                    return
             elif ecol_choice in 'v':
                 if validate_price(edit) == False:
                     clear_screen()
                     message = '\n     <<< Invalid value >>>\n'
-                    main_menu()
+                    return
+                edit = cards.price(edit)
             elif ecol_choice in 'p':
                 if validate_price(edit) == False:
                     clear_screen()
                     message = '\n     <<< Invalid price >>>\n'
-                    main_menu()
+                    return
+                edit = cards.price(edit)
 
         # Otherwise accept and validate varchar
         else:
@@ -760,25 +1067,22 @@ def edit_card():
             if edit == 'Q':
                 clear_screen()
                 message = '\n     <<< Edit action canceled >>>\n'
-                main_menu()
+                return
             elif validate_varchar(edit) == False:
                 clear_screen()
                 message = '\n     <<< Invalid input >>>\n'
-                main_menu()
+                return
 
-    # Build query and execute
-    e_query = """UPDATE public.cardinfo SET "{}" = '{}' WHERE "ID" = {};""".format(columns_actual[ecol_choice], edit, id_choice)
+    # The prepared single-column UPDATE takes the new value and the ID as parameters
+    e_params = (edit, id_choice)
 
     message = '\n At card ID: {}, \'{}\' will be updated to \'{}.\''.format(id_choice, columns_disp[ecol_choice], edit)
 
     try:
-        cur.execute(e_query)
-    except:
-        clear_screen()
-        print('\n     <<< Fatal error. See database logs for info. >>>\n')
-        cur.close()
-        conn.close()
-        quit()
+        store.run(cur, 'update_' + columns_actual[ecol_choice], e_params)
+    except store.Error:
+        handle_db_error()
+        return
         #conn.rollback()
         #clear_screen()
         #message = '\n     <<< Query not successful. >>>\n'
@@ -796,19 +1100,22 @@ def vend_card():
     print('\n     <<< VEND OPTIONS >>>')
     id_choice = remove_special(input('\n Enter \'ID\' of card you wish to vend: ').replace(' ','').lower().strip())
     if validate_id_int(id_choice) == True:
-        id_query = """SELECT * FROM public.cardinfo WHERE "ID" = {};""".format(id_choice)
+        id_params = (id_choice,)
     elif id_choice == 'q':
         clear_screen()
         print('\n     <<< Vend action canceled >>>')
-        main_menu()
+        return
     else:
         clear_screen()
         print('\n     <<< Invalid ID >>>')
-        main_menu()
+        return
 
     # Execute search by ID query, return the one result
-    cur.execute(id_query)
-    results = cur.fetchone()
+    try:
+        results = run_read(card_by_id, *id_params)
+    except store.Error:
+        handle_db_error()
+        return
     
     # Check to see if given ID matches a card in the database
     try:
@@ -816,22 +1123,11 @@ def vend_card():
     except:
         clear_screen()
         print('\n     <<< No card with that ID exists. >>>\n')
-        main_menu()
-
-    # Build table of search results
-    res = tt.Texttable()
-    header = ['ID', 'Sport', 'Last name', 'First name', 'Year', 'Team', 'Co.', 'Est. Value', 'Sale date', 'Sale price']
-    res.header(header)
-    res.set_cols_width([4, 10, 10, 10, 6, 10, 10, 8, 10, 8])
-    res.set_cols_align(['c']*10)
-    res.set_cols_valign(['m']*10)
-    res.set_chars(['-','|','+','='])
+        return
 
     # Print results table
     print('\n')
-    res.add_row([results[0], results[1], results[2], results[3], results[4], results[5], results[6], results[7], results[8], results[9]])
-    results_table = res.draw()
-    print(results_table)
+    output.write_table(output.card_layout(), [results])
     
     # Prompt for saleDate and salePrice values
     print('\n')
@@ -840,11 +1136,11 @@ def vend_card():
     if v_date == 'q' or v_date == 'Q':
         clear_screen()
         message = '\n     <<< Card sale canceled >>>'
-        main_menu()
+        return
     elif v_date == False:
         clear_screen()
         message = '\n     <<< Invalid sale date input >>>'
-        main_menu()
+        return
 
     print('\n')
     
@@ -852,28 +1148,25 @@ def vend_card():
     if s_price == 'q' or s_price == 'Q':
         clear_screen()
         message = '\n     <<< Card sale canceled >>>'
-        main_menu()
+        return
     elif s_price == False:
         clear_screen()
         message = '\n     <<< Invalid sale price >>>'
-        main_menu()
+        return
     
     print('\n')
     
     # Summary of card to be sold
     message = 'The card at ID {} was sold on {} for a price of ${}.'.format(id_choice, v_date, s_price)
     
-    # UPDATE query
-    v_query = """UPDATE public.cardinfo SET "saleDate" = '{}', "salePrice" = {} WHERE "ID" = {};""".format(v_date, s_price, id_choice)
+    # UPDATE query parameters
+    v_params = (v_date, cards.price(s_price), id_choice)
 
     try:
-        cur.execute(v_query)
-    except:
-        clear_screen()
-        print('\n     <<< Fatal error. See the database logs for info. >>>\n')
-        cur.close()
-        conn.close()
-        quit()
+        store.run(cur, 'vend_card', v_params)
+    except store.Error:
+        handle_db_error()
+        return
     
     confirm_commit()
 
@@ -887,19 +1180,22 @@ def delete_card():
     print('\n     <<< DELETE OPTIONS >>>')
     id_choice = remove_special(input('\n Enter \'ID\' of card you wish to delete: ').replace(' ','').lower().strip())
     if validate_id_int(id_choice) == True:
-        id_query = """SELECT * FROM public.cardinfo WHERE "ID" = {};""".format(id_choice)
+        id_params = (id_choice,)
     elif id_choice == 'q':
         clear_screen()
         print('\n     <<< Delete action canceled >>>')
-        main_menu()
+        return
     else:
         clear_screen()
         print('\n     <<< Invalid ID >>>')
-        main_menu()
+        return
 
     # Execute search by ID query, return the one result
-    cur.execute(id_query)
-    results = cur.fetchone()
+    try:
+        results = run_read(card_by_id, *id_params)
+    except store.Error:
+        handle_db_error()
+        return
     
     # Check to see if given ID matches a card in the database
     try:
@@ -907,60 +1203,1081 @@ def delete_card():
     except:
         clear_screen()
         print('\n     <<< No card with that ID exists. >>>\n')
-        main_menu()
-
-    # Build table of search results
-    res = tt.Texttable()
-    header = ['ID', 'Sport', 'Last name', 'First name', 'Year', 'Team', 'Co.', 'Est. Value', 'Sale date', 'Sale price']
-    res.header(header)
-    res.set_cols_width([4, 10, 10, 10, 6, 10, 10, 8, 10, 8])
-    res.set_cols_align(['c']*10)
-    res.set_cols_valign(['m']*10)
-    res.set_chars(['-','|','+','='])
+        return
 
     # Print results table
     print('\n')
-    res.add_row([results[0], results[1], results[2], results[3], results[4], results[5], results[6], results[7], results[8], results[9]])
-    results_table = res.draw()
-    print(results_table)
+    output.write_table(output.card_layout(), [results])
     
     # Summary of card to be deleted
     message = '\n The card at ID {} will be PERMANENTLY DELETED from the database.'.format(id_choice)
     
-    # DELETE query
-    d_query = """DELETE from public.cardinfo WHERE "ID" = {};""".format(id_choice)
+    # DELETE query parameters
+    d_params = (id_choice,)
 
     try:
-        cur.execute(d_query)
-    except:
-        clear_screen()
-        print('\n     <<< Fatal error. See the database logs for info. >>>\n')
-        cur.close()
-        conn.close()
-        quit()
+        store.run(cur, 'delete_card', d_params)
+    except store.Error:
+        handle_db_error()
+        return
     
     confirm_commit()
     
 
+def parse_id_list(inp):
+    # Split a list of IDs separated by commas or spaces, return the IDs as ints or False if any is invalid
+    ids = [xx for xx in re.split(r'[,\s]+', inp.strip()) if xx != '']
+    if len(ids) == 0:
+        return False
+    for xx in ids:
+        if validate_id_int(xx) != True:
+            return False
+    return [int(xx) for xx in ids]
+
+
+def parse_id_range(first, last):
+    # Validate an inclusive ID range, return (first, last) as ints or False
+    if validate_id_int(first) != True or validate_id_int(last) != True or int(first) > int(last):
+        return False
+    return int(first), int(last)
+
+
+def bulk_delete(s_where, s_params):
+    # Delete every card matching a WHERE clause in one statement, return the number of rows deleted
+    queries.execute(cur, queries.delete_query(s_where), s_params, kind='bulk_delete')
+    return cur.rowcount
+
+
+def bulk_delete_cards():
+    # Delete many cards at once by ID list, ID range, or search filter, after previewing the matches
+    global message
+
+    clear_screen()
+    print('\n     <<< BULK DELETE OPTIONS >>>')
+    scope = input('\n Delete by [L]ist of IDs, ID [R]ange, [S]earch filter, or [Q]uit to Main Menu >> ').strip().lower()
+
+    if scope == 'l':
+        ids = parse_id_list(input('\n Enter the IDs, separated by commas or spaces: '))
+        if ids == False:
+            clear_screen()
+            message = '\n     <<< Invalid ID list >>>'
+            return
+        s_where, s_params = '"ID" = ANY(%s)', [ids]
+    elif scope == 'r':
+        id_range = parse_id_range(input('\n First ID: ').strip(), input(' Last ID: ').strip())
+        if id_range == False:
+            clear_screen()
+            message = '\n     <<< Invalid ID range >>>'
+            return
+        s_where, s_params = '"ID" BETWEEN %s AND %s', list(id_range)
+    elif scope == 's':
+        s_filter = search_prompt()
+        if s_filter is None:
+            return
+        s_where, s_params = s_filter
+    elif scope == 'q':
+        clear_screen()
+        message = '\n     <<< Delete action canceled >>>'
+        return
+    else:
+        clear_screen()
+        message = '\n     <<< Invalid selection >>>'
+        return
+
+    # Preview with a count and the first page of matches, both served by indexes
+    try:
+        total_rows = run_read(search_count, s_where, s_params)
+        preview = run_read(search_page, s_where, s_params, 'i')
+    except store.Error:
+        handle_db_error()
+        return
+
+    clear_screen()
+    if total_rows == 0:
+        message = '\n     <<< No cards match. Nothing to delete. >>>'
+        return
+
+    print('\n     ' + str(total_rows) + ' cards match. The first ' + str(len(preview)) + ' by ID:')
+    print('\n')
+    output.write_table(output.card_layout(), preview)
+
+    try:
+        deleted = bulk_delete(s_where, s_params)
+    except store.Error:
+        handle_db_error()
+        return
+
+    message = '\n {} cards will be PERMANENTLY DELETED from the database.'.format(deleted)
+    confirm_commit()
+
+
+def parse_sale(fields):
+    # Validate one [ID, sale date, sale price] entry, return (entry, None) or (None, reason)
+    if len(fields) != 3:
+        return None, 'expected ID, sale date and sale price'
+
+    id_choice, sd, pr = [field.strip() for field in fields]
+    if validate_id_int(id_choice) != True:
+        return None, 'invalid ID'
+    if validate_date(sd) != True:
+        return None, 'invalid sale date'
+    if validate_price(pr) != True:
+        return None, 'invalid sale price'
+    return (int(id_choice), sd, pr), None
+
+
+def read_sales_file(sales_path):
+    # Read sale entries from a CSV file of ID,saleDate,salePrice lines, return (entries, errors)
+    # A first line that does not start with an ID is taken as a header and skipped
+    entries = []
+    errors = []
+
+    with open(sales_path, newline='', encoding='utf-8-sig') as sales_file:
+        for line_num, fields in enumerate(csv.reader(sales_file), 1):
+            if len(fields) == 0:
+                continue
+            if line_num == 1 and not fields[0].strip().isdigit():
+                continue
+            entry, reason = parse_sale(fields)
+            if entry is None:
+                errors.append('line {}: {}'.format(line_num, reason))
+            else:
+                entries.append(entry)
+
+    return entries, errors
+
+
+def vend_batch(entries):
+    # Record many sales with a single UPDATE ... FROM (VALUES ...), return the IDs that matched no card
+    # A later entry for the same ID replaces an earlier one
+    sales = {}
+    for entry in entries:
+        sales[entry[0]] = entry
+
+    if len(sales) == 0:
+        return []
+
+    with profiling.measure('vend_batch') as timing:
+        found = psycopg2.extras.execute_values(cur, queries.vend_batch_query(), list(sales.values()), 
+                                               template=queries.vend_batch_template, page_size=len(sales), fetch=True)
+        timing['rows'] = len(found)
+    found_ids = set(row[0] for row in found)
+    return sorted(card_id for card_id in sales if card_id not in found_ids)
+
+
+def vend_batch_cards():
+    # Prompt for many sales, typed in or read from a file, and apply them in one transaction
+    global message
+
+    clear_screen()
+    print('\n     <<< BATCH VEND OPTIONS >>>')
+    print('\n Enter one sale per line as: ID, yyyy-mm-dd, price   (Example: 42, 2015-07-17, 12.50)')
+    print(' Enter [F] to read sales from a CSV file, press Enter on an empty line when done, or [Q]uit.\n')
+
+    entries = []
+    while True:
+        line = input(' Sale {}: '.format(len(entries) + 1)).strip()
+
+        if line == 'q' or line == 'Q':
+            clear_screen()
+            message = '\n     <<< Batch vend canceled >>>'
+            return
+        elif line == '':
+            break
+        elif line == 'f' or line == 'F':
+            sales_path = input(' Path of the CSV file (ID,saleDate,salePrice): ').strip()
+            try:
+                file_entries, errors = read_sales_file(sales_path)
+            except OSError:
+                print(' <<< Unable to read that file >>>')
+                continue
+            for error in errors[:10]:
+                print(' <<< Skipped ' + error + ' >>>')
+            if len(errors) > 10:
+                print(' <<< ... and {} more invalid lines >>>'.format(len(errors) - 10))
+            entries.extend(file_entries)
+            print(' {} sales read from {}'.format(len(file_entries), sales_path))
+        else:
+            entry, reason = parse_sale(re.split(r'[,\s]+', line))
+            if entry is None:
+                print(' <<< Invalid sale: ' + reason + ' >>>')
+            else:
+                entries.append(entry)
+
+    if len(entries) == 0:
+        clear_screen()
+        message = '\n     <<< No sales entered >>>'
+        return
+
+    try:
+        missing = vend_batch(entries)
+    except store.Error:
+        handle_db_error()
+        return
+
+    vended = len(set(entry[0] for entry in entries)) - len(missing)
+    message = '\n {} cards will be marked as sold.'.format(vended)
+    if len(missing) > 0:
+        message += '\n No card exists with ID: ' + ', '.join(str(card_id) for card_id in missing)
+
+    confirm_commit()
+
+
+#---BULK_IO----------------------------------------------------------------------------------------------------
+
+
+# Columns a card CSV may provide, in the order they are sent to COPY
+import_columns = queries.insert_columns
+
+
+def validate_card_row(row):
+    # Apply the add_card() input rules to one CSV row, return (Card, None) or (None, reason)
+    values = []
+
+    for col in ['sport', 'lastName', 'firstName']:
+        xx = remove_special((row.get(col) or '').strip().capitalize())
+        if validate_varchar(xx) != True:
+            return None, 'invalid ' + col
+        values.append(xx)
+
+    cy = remove_special((row.get('year') or '').strip())
+    if validate_year(cy) != True:
+        return None, 'invalid year'
+    values.append(cy)
+
+    for col in ['team', 'company']:
+        xx = remove_special((row.get(col) or '').strip().capitalize())
+        if validate_varchar(xx) != True:
+            return None, 'invalid ' + col
+        values.append(xx)
+
+    # Optional columns stay NULL when blank
+    ve = (row.get('valueEst') or '').strip()
+    if ve != '' and validate_price(ve) != True:
+        return None, 'invalid valueEst'
+    values.append(ve or None)
+
+    sd = (row.get('saleDate') or '').strip()
+    if sd != '' and validate_date(sd) != True:
+        return None, 'invalid saleDate'
+    values.append(sd or None)
+
+    pr = (row.get('salePrice') or '').strip()
+    if pr != '' and validate_price(pr) != True:
+        return None, 'invalid salePrice'
+    values.append(pr or None)
+
+    return cards.new_card(*values), None
+
+
+def copy_chunk(copy_query, buf, rows):
+    # Send one buffered chunk of CSV rows to the server with COPY
+    with profiling.measure('copy_in') as timing:
+        timing['bytes'] = buf.tell()
+        timing['rows'] = rows
+        buf.seek(0)
+        cur.copy_expert(copy_query, buf)
+
+
+def import_csv(csv_path, reject_path, chunk_size=5000):
+    # Stream a card CSV into the card table with COPY, one chunk at a time, writing rejects to a file
+    # Returns (imported, rejected) counts, or False if the file has no usable header
+    copy_query = queries.copy_in_query()
+
+    with open(csv_path, newline='', encoding='utf-8-sig') as in_file, \
+         open(reject_path, 'w', newline='', encoding='utf-8') as rej_file:
+        reader = csv.reader(in_file)
+        header = next(reader, None)
+        if header is None:
+            return False
+
+        # Match header names case-insensitively against the real column names
+        known = {col.lower(): col for col in import_columns}
+        fields = [known.get(h.strip().lower()) for h in header]
+        if not set(import_columns[:6]).issubset(fields):
+            return False
+
+        rej_writer = csv.writer(rej_file)
+        rej_writer.writerow(header + ['reject_reason'])
+
+        buf = io.StringIO()
+        buf_writer = csv.writer(buf)
+        buffered = 0
+        imported = 0
+        rejected = 0
+
+        for raw in reader:
+            if len(raw) == 0:
+                continue
+            if len(raw) != len(header):
+                rej_writer.writerow(raw + ['line {}: expected {} fields'.format(reader.line_num, len(header))])
+                rejected += 1
+                continue
+
+            card, reason = validate_card_row({f: v for f, v in zip(fields, raw) if f is not None})
+            if card is None:
+                rej_writer.writerow(raw + ['line {}: {}'.format(reader.line_num, reason)])
+                rejected += 1
+                continue
+
+            buf_writer.writerow(cards.insert_values(card))
+            buffered += 1
+
+            # Flush a full chunk to the server and reuse the buffer
+            if buffered == chunk_size:
+                copy_chunk(copy_query, buf, buffered)
+                buf.seek(0)
+                buf.truncate(0)
+                imported += buffered
+                buffered = 0
+
+        if buffered > 0:
+            copy_chunk(copy_query, buf, buffered)
+            imported += buffered
+
+    return imported, rejected
+
+
+def import_cards():
+    # Prompt for a CSV file to import, then confirm the commit like any other change
+    global message
+
+    clear_screen()
+    print('\n     <<< IMPORT OPTIONS >>>')
+    print('\n The first line of the file must name the columns, e.g.')
+    print(' sport,lastName,firstName,year,team,company,valueEst,saleDate,salePrice')
+    print(' valueEst, saleDate and salePrice are optional. Invalid rows are written to a rejects file.')
+
+    csv_path = input('\n Path of the CSV file to import, or [Q]uit: ').strip()
+    if csv_path == 'q' or csv_path == 'Q' or csv_path == '':
+        clear_screen()
+        message = '\n     <<< Import canceled >>>'
+        return
+
+    reject_path = os.path.splitext(csv_path)[0] + '_rejects.csv'
+
+    try:
+        counts = import_csv(csv_path, reject_path)
+    except OSError:
+        clear_screen()
+        message = '\n     <<< Unable to read that file. >>>'
+        return
+    except store.Error:
+        handle_db_error()
+        return
+
+    if counts == False:
+        clear_screen()
+        message = '\n     <<< The file is missing a header with the required columns. >>>'
+        return
+
+    imported, rejected = counts
+    message = '\n {} cards will be imported. {} rows were rejected, see {}\n'.format(imported, rejected, reject_path)
+
+    confirm_commit()
+
+
+def export_csv(s_where, s_params, out_path):
+    # Stream matching rows to a CSV file with COPY, the server writes straight into the file object
+    # COPY does not accept bind parameters, so the values are quoted into the query by mogrify()
+    e_query = cur.mogrify(queries.export_csv_query(s_where), s_params).decode()
+
+    with open(out_path, 'w', newline='', encoding='utf-8') as out_file, profiling.measure('copy_out') as timing:
+        cur.copy_expert("""COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER);""".format(e_query), out_file)
+        timing['bytes'] = out_file.tell()
+
+
+def export_jsonl(s_where, s_params, out_path):
+    # Stream matching rows to a JSON Lines file through a named (server-side) cursor
+    # Only 'itersize' rows are held in memory at a time, however many rows match
+    e_cur = conn.cursor(name='carddb_export')
+    e_cur.itersize = 2000
+    written = 0
+
+    try:
+        with open(out_path, 'w', encoding='utf-8') as out_file, profiling.measure('export_jsonl') as timing:
+            e_cur.execute(queries.export_jsonl_query(s_where), s_params)
+            for row in e_cur:
+                out_file.write(row[0] + '\n')
+                written += 1
+            timing['rows'] = written
+            timing['bytes'] = out_file.tell()
+    finally:
+        e_cur.close()
+
+    return written
+
+
+def export_changes(since, out_path):
+    # Write the changes logged since 'since' to a JSON Lines file, oldest first, return (changes written, next position)
+    # 'since' is a position from an earlier export (0 for the whole log) or a datetime; the next position is the
+    # transaction horizon the export stopped at, so consecutive exports neither skip nor repeat a change
+    horizon = store.execute(cur, queries.changes_horizon_query).fetchone()[0]
+    c_sql = queries.changes_query(isinstance(since, datetime.datetime))
+    written = 0
+
+    with open(out_path, 'w', encoding='utf-8') as out_file, profiling.measure('export_changes') as timing, \
+         contextlib.closing(store.stream(conn, c_sql, (since, horizon))) as rows:
+        for row in rows:
+            out_file.write(row[0] + '\n')
+            written += 1
+        timing['rows'] = written
+        timing['bytes'] = out_file.tell()
+
+    return written, horizon
+
+
+def export_prompt(s_where, s_params):
+    # Prompt for an export format and file, then write the rows matching the WHERE clause
+    global message
+
+    print('\n Export format: [C]SV or [J]SON Lines')
+    fmt = input(' >> ').strip().lower()
+    if fmt != 'c' and fmt != 'j':
+        clear_screen()
+        message = '\n     <<< Invalid export format. Export canceled >>>'
+        return
+
+    default_path = 'cards_export.csv' if fmt == 'c' else 'cards_export.jsonl'
+    out_path = input('\n Path of the file to write (Enter for ' + default_path + '): ').strip() or default_path
+
+    # Exports only read, so a dropped connection is retried and the file rewritten from the start
+    try:
+        if fmt == 'c':
+            run_read(export_csv, s_where, s_params, out_path)
+        else:
+            run_read(export_jsonl, s_where, s_params, out_path)
+        # End the export's transaction so the connection is not left idle in one
+        conn.rollback()
+    except OSError:
+        conn.rollback()
+        clear_screen()
+        message = '\n     <<< Unable to write that file. >>>'
+        return
+    except store.Error:
+        handle_db_error()
+        return
+
+    clear_screen()
+    message = '\n     <<< Export written to ' + out_path + ' >>>'
+
+
+def export_cards():
+    # Export the whole table, or the results of a search filter, to a file
+    global message
+
+    clear_screen()
+    print('\n     <<< EXPORT OPTIONS >>>')
+    scope = input('\n Export [A]ll cards, [S]earch results, or [Q]uit to Main Menu >> ').strip().lower()
+
+    if scope == 'a':
+        s_where, s_params = 'TRUE', []
+    elif scope == 's':
+        s_filter = search_prompt()
+        if s_filter is None:
+            return
+        s_where, s_params = s_filter
+    elif scope == 'q':
+        clear_screen()
+        message = '\n     <<< Export canceled >>>'
+        return
+    else:
+        clear_screen()
+        message = '\n     <<< Invalid selection >>>'
+        return
+
+    export_prompt(s_where, s_params)
+
+
+#---REPORTS----------------------------------------------------------------------------------------------------
+
+
+# Report menu selections, in the order they are listed
+report_keys = {'s': 'sport', 't': 'team', 'y': 'year', 'u': 'status', 'c': 'company', 'm': 'monthly'}
+
+
+def run_report(name, s_where, s_params):
+    # Run one of queries.reports over the cards matching the WHERE clause, return its rows
+    queries.execute(cur, queries.report_query(name, s_where), s_params, kind='report_' + name)
+    return cur.fetchall()
+
+
+def reports_menu():
+    # Pick a report, optionally limit it to a search filter, and print it
+    global message
+
+    clear_screen()
+    print('\n     <<< REPORTS >>>\n')
+    for key, name in report_keys.items():
+        print('   [{}] {}'.format(key.upper(), queries.reports[name][0]))
+    choice = input('\n Select a report, or [Q]uit to Main Menu >> ').strip().lower()
+
+    if choice == 'q':
+        clear_screen()
+        return
+    elif choice not in report_keys:
+        clear_screen()
+        message = '\n     <<< Invalid selection >>>'
+        return
+    name = report_keys[choice]
+
+    scope = input('\n Report on [A]ll cards or [S]earch results? >> ').strip().lower()
+    if scope == 'a':
+        s_where, s_params = 'TRUE', []
+    elif scope == 's':
+        s_filter = search_prompt()
+        if s_filter is None:
+            return
+        s_where, s_params = s_filter
+    else:
+        clear_screen()
+        message = '\n     <<< Invalid selection >>>'
+        return
+
+    try:
+        rows = run_read(run_report, name, s_where, s_params)
+        conn.rollback()
+    except store.Error:
+        handle_db_error()
+        return
+
+    clear_screen()
+    print('\n     <<< ' + queries.reports[name][0].upper() + ' >>>\n')
+    if len(rows) == 0:
+        print(' No cards to report on.')
+    else:
+        output.write_table(output.report_layout(name), rows)
+    input('\n Press Enter to return to the Main Menu. ')
+    clear_screen()
+
+
 #---END_CLOSE--------------------------------------------------------------------------------------------------
 
 
 def quit_carddb():
+    # Confirm quitting, return True once the database connection is closed
     clear_screen()
     confirm_quit = input('\n Exit the program and close database connection? [Y]es or [N]o. ').lower()
     if confirm_quit == 'y':
-        cur.close()
-        conn.close()
-        quit()
+        disconnect_db()
+        return True
     elif confirm_quit == 'n':
         clear_screen()
-        main_menu()
     else:
         clear_screen()
         print('\n     <<< Invalid response >>>\n')
         print('_' * 50)
-        main_menu()
+    return False
+
+
+# Main menu selections and the operation each one runs
+menu_actions = {'a': add_card, 'm': add_session, 's': search, 'f': find_cards, 'c': search_collections, 'e': edit_card, 'v': vend_card, 'b': vend_batch_cards, 'd': delete_card, 'k': bulk_delete_cards, 
+                'i': import_cards, 'x': export_cards, 'r': reports_menu}
+
+
+#---COMMAND_LINE-----------------------------------------------------------------------------------------------
+
 
+def cli_error(msg):
+    # Report a command line error on stderr, return the failing exit status
+    print('carddb: ' + msg, file=sys.stderr)
+    return 1
 
-# Initialize functional program
-main_menu()
+
+def validate_edit(col, inp):
+    # Apply the edit_card() rules to a new column value, return the cleaned value or False
+    if col == 'i' or validate_colChoice(col) != True:
+        return False
+
+    if col in 'yvdp':
+        edit = inp.strip().lower()
+        if col == 'd':
+            valid = validate_date(edit) == True
+        elif col == 'y':
+            valid = validate_year(edit) == True
+        else:
+            valid = validate_price(edit) == True
+        return edit if valid else False
+
+    edit = remove_special(inp.strip().capitalize())
+    return edit if validate_varchar(edit) == True else False
+
+
+def filter_from_args(args):
+    # Build a WHERE clause from the column flags given on the command line, or False if a term is invalid
+    terms = [(col, getattr(args, flag)) for col, flag in columns_flags.items() if getattr(args, flag, None) is not None]
+    try:
+        return query_builder.build_where(terms)
+    except ValueError as e:
+        cli_error('invalid search term, ' + str(e))
+        return False
+
+
+def cmd_search(args):
+    # Print the count and first rows of a search, sorted like the interactive pages
+    s_filter = filter_from_args(args)
+    if s_filter == False:
+        return 1
+    s_where, s_params = s_filter
+
+    sort_key = {flag: col for col, flag in columns_flags.items()}[args.sort]
+
+    total_rows = search_count(s_where, s_params)
+
+    with output.pager() as out:
+        out.write('{} of {} matching rows, sorted by {}.\n'.format(min(total_rows, args.limit), total_rows,
+                                                                  columns_disp[sort_key]))
+        if total_rows > 0:
+            stream_search(s_where, s_params, sort_key, args.limit, out)
+    return 0
+
+
+def cmd_find(args):
+    # Print the best free-text matches for the given words
+    ts_query = query_builder.prefix_tsquery(' '.join(args.words))
+    if ts_query is None:
+        return cli_error('type at least one letter or number to find')
+
+    total_rows = find_count(ts_query)
+    results = find_page(ts_query, 0, args.limit)
+    with output.pager() as out:
+        out.write('{} of {} matching cards, best matches first.\n'.format(len(results), total_rows))
+        if len(results) > 0:
+            output.write_table(output.card_layout(), results, out)
+    return 0
+
+
+def cmd_search_all(args):
+    # Search every configured collection at once and print the merged, labeled rows
+    s_filter = filter_from_args(args)
+    if s_filter == False:
+        return 1
+
+    sort_key = {flag: col for col, flag in columns_flags.items()}[args.sort]
+    summary, merged = search_all(s_filter[0], s_filter[1], sort_key, args.limit)
+    with output.pager() as out:
+        print_search_all(summary, merged, sort_key, out)
+
+    # Any unavailable collection makes the command fail, after printing the others
+    return 1 if any(isinstance(result, str) for result in summary.values()) else 0
+
+
+def cmd_add(args):
+    # Add one card from command line flags
+    row = {'sport': args.sport, 'lastName': args.last, 'firstName': args.first, 'year': args.year, 
+           'team': args.team, 'company': args.company, 'valueEst': args.value, 'saleDate': args.date, 
+           'salePrice': args.price}
+    card, reason = validate_card_row(row)
+    if card is None:
+        return cli_error(reason)
+
+    store.run(cur, 'insert_card', cards.insert_values(card))
+    return 0
+
+
+def cmd_edit(args):
+    # Update one or more columns of a card by ID
+    if validate_id_int(args.id) != True:
+        return cli_error('invalid ID ' + args.id)
+
+    edits = []
+    for col, flag in columns_flags.items():
+        value = getattr(args, flag, None)
+        if col == 'i' or value is None:
+            continue
+        edit = validate_edit(col, value)
+        if edit == False:
+            return cli_error('invalid ' + columns_disp[col])
+        if col in 'vp':
+            edit = cards.price(edit)
+        edits.append((columns_actual[col], edit))
+
+    if len(edits) == 0:
+        return cli_error('nothing to edit')
+
+    for col_name, edit in edits:
+        store.run(cur, 'update_' + col_name, (edit, args.id))
+        if cur.rowcount == 0:
+            return cli_error('no card with ID ' + args.id)
+    return 0
+
+
+def cmd_vend(args):
+    # Record the sale date and price of a card by ID
+    if validate_id_int(args.id) != True:
+        return cli_error('invalid ID ' + args.id)
+    if validate_date(args.date) != True:
+        return cli_error('invalid sale date')
+    if validate_price(args.price) != True:
+        return cli_error('invalid sale price')
+
+    store.run(cur, 'vend_card', (args.date, cards.price(args.price), args.id))
+    if cur.rowcount == 0:
+        return cli_error('no card with ID ' + args.id)
+    return 0
+
+
+def cmd_vend_batch(args):
+    # Apply a CSV file of sales in one statement; nothing is saved if any line is invalid or any ID is missing
+    entries, errors = read_sales_file(args.file)
+    for error in errors:
+        cli_error(error)
+    if len(errors) > 0:
+        return cli_error('no sales recorded')
+
+    missing = vend_batch(entries)
+    if len(missing) > 0:
+        cli_error('no card exists with ID: ' + ', '.join(str(card_id) for card_id in missing))
+        return cli_error('no sales recorded')
+
+    print('{} cards marked as sold.'.format(len(set(entry[0] for entry in entries))))
+    return 0
+
+
+def cmd_delete_many(args):
+    # Delete the cards in an ID list, an ID range, or matching the column flags, in one statement
+    if args.ids is not None:
+        ids = parse_id_list(args.ids)
+        if ids == False:
+            return cli_error('invalid ID list')
+        s_where, s_params = '"ID" = ANY(%s)', [ids]
+    elif args.range is not None:
+        id_range = parse_id_range(*(args.range.split('-', 1) + [''])[:2])
+        if id_range == False:
+            return cli_error('invalid ID range, expected FIRST-LAST')
+        s_where, s_params = '"ID" BETWEEN %s AND %s', list(id_range)
+    else:
+        s_filter = filter_from_args(args)
+        if s_filter == False:
+            return 1
+        if s_filter[0] == 'TRUE':
+            return cli_error('give --ids, --range or at least one column filter')
+        s_where, s_params = s_filter
+
+    if args.dry_run:
+        print('{} cards would be deleted.'.format(search_count(s_where, s_params)))
+        return 0
+
+    print('{} cards deleted.'.format(bulk_delete(s_where, s_params)))
+    return 0
+
+
+def cmd_delete(args):
+    # Delete a card by ID
+    if validate_id_int(args.id) != True:
+        return cli_error('invalid ID ' + args.id)
+
+    store.run(cur, 'delete_card', (args.id,))
+    if cur.rowcount == 0:
+        return cli_error('no card with ID ' + args.id)
+    return 0
+
+
+def cmd_import(args):
+    # Import a card CSV, see import_csv()
+    reject_path = args.rejects or os.path.splitext(args.file)[0] + '_rejects.csv'
+    counts = import_csv(args.file, reject_path, args.chunk_size)
+    if counts == False:
+        return cli_error('the file is missing a header with the required columns')
+
+    print('{} cards imported, {} rows rejected (see {}).'.format(counts[0], counts[1], reject_path))
+    return 0
+
+
+def cmd_export(args):
+    # Export the cards matching the column flags, or all cards, to a file
+    s_filter = filter_from_args(args)
+    if s_filter == False:
+        return 1
+
+    if args.format == 'csv':
+        export_csv(s_filter[0], s_filter[1], args.out)
+    else:
+        export_jsonl(s_filter[0], s_filter[1], args.out)
+    return 0
+
+
+def parse_since(text):
+    # A changes export's starting point: a position printed by an earlier export, or a time like 2026-10-01T12:00
+    # Returns None if it is neither
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+
+
+def cmd_changes(args):
+    # Export the changes logged since a position or time, then report the position to continue from
+    # With --position-file, the position is read from the file when --since is not given and saved back afterwards
+    since = args.since
+    if since is None and args.position_file and os.path.exists(args.position_file):
+        with open(args.position_file, encoding='utf-8') as pos_file:
+            since = pos_file.read()
+    since = parse_since(since or '0')
+    if since is None:
+        return cli_error('--since must be a position from an earlier changes export, or a time like 2026-10-01T12:00')
+
+    written, position = export_changes(since, args.out)
+    if args.position_file:
+        # Written beside the file and renamed over it, so a failed write never leaves a half-written position
+        tmp_path = args.position_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as pos_file:
+            pos_file.write(str(position) + '\n')
+        os.replace(tmp_path, args.position_file)
+
+    print('{} changes written to {}. Next position: {}'.format(written, args.out, position))
+    return 0
+
+
+def cmd_report(args):
+    # Print one report over all cards, or those matching the column flags
+    s_filter = filter_from_args(args)
+    if s_filter == False:
+        return 1
+
+    rows = run_report(args.name, s_filter[0], s_filter[1])
+    with output.pager() as out:
+        out.write(queries.reports[args.name][0] + '.\n')
+        if len(rows) > 0:
+            output.write_table(output.report_layout(args.name), rows, out)
+    return 0
+
+
+cli_commands = {'search': cmd_search, 'find': cmd_find, 'search-all': cmd_search_all, 'add': cmd_add, 'edit': cmd_edit, 'vend': cmd_vend, 'vend-batch': cmd_vend_batch, 'delete-many': cmd_delete_many, 
+                'delete': cmd_delete, 'import': cmd_import, 'export': cmd_export, 'changes': cmd_changes,
+                'report': cmd_report}
+
+# Commands a script file may contain
+script_commands = ['add', 'edit', 'vend', 'delete']
+
+
+def profile_parser():
+    # Profiling options, accepted before a command or on their own for the interactive menu
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--profile', action='store_true', help='print per-query timings when the session ends')
+    parser.add_argument('--profile-out', metavar='FILE', help='write the per-query timings to FILE as JSON')
+    parser.add_argument('--profile-slow', metavar='MS', type=float, default=100.0, 
+                        help='capture EXPLAIN (ANALYZE, BUFFERS) for SELECTs slower than MS milliseconds (default 100)')
+    return parser
+
+
+def start_profile(opts):
+    # Turn on query profiling if either profiling option was given
+    if opts.profile or opts.profile_out:
+        profiling.start(opts.profile_slow)
+
+
+def end_profile(opts):
+    # Print or write the session's query profile
+    if not profiling.enabled:
+        return
+    if opts.profile_out:
+        try:
+            profiling.write(opts.profile_out)
+            print('Query profile written to ' + opts.profile_out, file=sys.stderr)
+        except OSError as e:
+            cli_error('unable to write the query profile: ' + str(e))
+    if opts.profile:
+        print(profiling.report_text(profiling.summary()), file=sys.stderr)
+
+
+def build_parser():
+    # Command line interface, one subcommand per operation
+    parser = argparse.ArgumentParser(prog='main.py', parents=[profile_parser()],
+                                     description='CardDB command line mode. Run without arguments for the interactive menu.')
+    subs = parser.add_subparsers(dest='command', metavar='command')
+    subs.required = True
+
+    def add_column_flags(sub, keys, help_text):
+        for col in keys:
+            sub.add_argument('--' + columns_flags[col], help=help_text.format(columns_disp[col]))
+
+    p = subs.add_parser('search', help='search cards, e.g. search --last smith --year gt1985')
+    add_column_flags(p, 'islfytcvdp', 'search term for {}, e.g. smith, gt1985, 1985..1990, 1984,1987 or null')
+    p.add_argument('--sort', choices=list(columns_flags.values()), default='id', help='column to sort by')
+    p.add_argument('--limit', type=int, default=page_size, help='maximum rows to print')
+
+    p = subs.add_parser('find', help='free-text search across all text columns and the year, best matches first')
+    p.add_argument('words', nargs='+', help='words from the card, e.g. ripken orioles 1982')
+    p.add_argument('--limit', type=int, default=page_size, help='maximum rows to print')
+
+    p = subs.add_parser('search-all', help='run one search on every collection in carddb.ini at once')
+    add_column_flags(p, 'islfytcvdp', 'search term for {}, e.g. smith, gt1985, 1985..1990, 1984,1987 or null')
+    p.add_argument('--sort', choices=list(columns_flags.values()), default='id', help='column to sort by')
+    p.add_argument('--limit', type=int, default=page_size, help='maximum rows to print')
+
+    p = subs.add_parser('add', help='add a card')
+    for col in 'slfytc':
+        p.add_argument('--' + columns_flags[col], required=True, help=columns_disp[col])
+    add_column_flags(p, 'vdp', '{} (optional)')
+
+    p = subs.add_parser('edit', help='edit the given columns of a card')
+    p.add_argument('id')
+    add_column_flags(p, 'slfytcvdp', 'new {}')
+
+    p = subs.add_parser('vend', help='record the sale of a card')
+    p.add_argument('id')
+    p.add_argument('--date', required=True, help='sale date as yyyy-mm-dd')
+    p.add_argument('--price', required=True, help='sale price')
+
+    p = subs.add_parser('vend-batch', help='record many sales from a CSV file of ID,saleDate,salePrice lines')
+    p.add_argument('file')
+
+    p = subs.add_parser('delete', help='delete a card')
+    p.add_argument('id')
+
+    p = subs.add_parser('delete-many', help='delete cards by ID list, ID range, or column filters')
+    p.add_argument('--ids', help='IDs separated by commas, e.g. 4,8,15')
+    p.add_argument('--range', help='inclusive ID range, e.g. 100-250')
+    add_column_flags(p, 'slfytcvdp', 'search term for {}')
+    p.add_argument('--dry-run', action='store_true', help='only print how many cards would be deleted')
+
+    p = subs.add_parser('import', help='import cards from a CSV file')
+    p.add_argument('file')
+    p.add_argument('--rejects', help='file for rejected rows, default <file>_rejects.csv')
+    p.add_argument('--chunk-size', type=int, default=5000, help='rows sent per COPY')
+
+    p = subs.add_parser('export', help='export all cards, or those matching the column flags')
+    add_column_flags(p, 'islfytcvdp', 'search term for {}')
+    p.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    p.add_argument('--out', required=True, help='file to write')
+
+    p = subs.add_parser('changes', help='export the cards added, changed or deleted since an earlier export, as JSON Lines')
+    p.add_argument('--since', help='position printed by the last changes export, or a time like 2026-10-01T12:00; '
+                                   'default the whole change log')
+    p.add_argument('--position-file', metavar='FILE', help='file holding the position: read when --since is not given, '
+                                                           'written after the export')
+    p.add_argument('--out', required=True, help='file to write')
+
+    p = subs.add_parser('report', help='print a value or sales report, aggregated by the database')
+    p.add_argument('name', choices=list(queries.reports), help='report to run')
+    add_column_flags(p, 'islfytcvdp', 'only report on cards matching this search term for {}')
+
+    p = subs.add_parser('script', help='run add/edit/vend/delete commands from a file, one per line')
+    p.add_argument('file')
+    p.add_argument('--batch-size', type=int, default=500, help='commands per commit')
+
+    return parser
+
+
+def run_script_command(args, batch):
+    # Run one script command; if the connection drops, reconnect, replay the uncommitted batch and retry once
+    try:
+        return cli_commands[args.command](args)
+    except store.disconnect_errors:
+        if not store.is_disconnect(conn) or reconnect() == False:
+            raise
+
+    for prior in batch:
+        cli_commands[prior.command](prior)
+    return cli_commands[args.command](args)
+
+
+def run_script(script_path, batch_size):
+    # Run the commands in a script file over one connection, committing every 'batch_size' commands
+    # Invalid lines are skipped; a database error rolls back the uncommitted batch and stops the script
+    parser = build_parser()
+    batch = []
+    committed = 0
+    skipped = 0
+
+    with open(script_path, encoding='utf-8') as script:
+        for line_num, line in enumerate(script, 1):
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+
+            try:
+                args = parser.parse_args(shlex.split(line))
+            except (SystemExit, ValueError):
+                cli_error('line {}: could not parse command, skipped'.format(line_num))
+                skipped += 1
+                continue
+
+            if args.command not in script_commands:
+                cli_error('line {}: {} is not allowed in a script, skipped'.format(line_num, args.command))
+                skipped += 1
+                continue
+
+            try:
+                status = run_script_command(args, batch)
+            except store.Error as e:
+                if not store.is_disconnect(conn):
+                    conn.rollback()
+                return cli_error('line {}: database error, {} uncommitted commands rolled back, {} committed: {}'\
+                                 .format(line_num, len(batch), committed, str(e).strip()))
+
+            if status != 0:
+                cli_error('line {}: skipped'.format(line_num))
+                skipped += 1
+                continue
+
+            batch.append(args)
+            if len(batch) == batch_size:
+                conn.commit()
+                committed += len(batch)
+                batch = []
+
+    conn.commit()
+    committed += len(batch)
+    print('{} commands committed, {} skipped.'.format(committed, skipped))
+    return 1 if skipped > 0 else 0
+
+
+def cli_main(argv):
+    # Run one command line operation, or a script file, without any prompts
+    args = build_parser().parse_args(argv)
+    if args.command == 'script' and args.batch_size < 1:
+        return cli_error('--batch-size must be at least 1')
+    if args.command in postgres_commands and store.name != 'postgres':
+        return cli_error('{} needs the PostgreSQL backend, CardDB is using {}'.format(args.command, store.name))
+
+    if connect_db() == False:
+        return cli_error('unable to establish database connection')
+
+    try:
+        if args.command == 'script':
+            status = run_script(args.file, args.batch_size)
+        else:
+            status = cli_commands[args.command](args)
+            if status == 0:
+                conn.commit()
+            else:
+                conn.rollback()
+    except store.Error as e:
+        if not store.is_disconnect(conn):
+            conn.rollback()
+        status = cli_error('database error: ' + str(e).strip())
+    except OSError as e:
+        status = cli_error(str(e))
+    finally:
+        disconnect_db()
+
+    return status
+
+
+if __name__ == '__main__':
+    # Profiling options alone still start the interactive menu, any other arguments select the command line mode
+    opts, rest = profile_parser().parse_known_args(sys.argv[1:])
+    start_profile(opts)
+    if len(rest) > 0:
+        status = cli_main(sys.argv[1:])
+        end_profile(opts)
+        sys.exit(status)
+
+    # Try to establish database connection first, print a message and quit if unable
+    clear_screen()
+    if connect_db() == False:
+        print('\n<<< Unable to establish database connection. >>>\n')
+        quit()
+
+    print('\n     <<< Database connection established! >>>\n')
+    print('             Welcome to CardDB v1.4')
+    print('_' * 50)
+
+    # Initialize functional program
+    main_menu()
+    end_profile(opts)
@@ -0,0 +1,17 @@
+/* Adds the pg_trgm GIN indexes used by substring searches to an existing 'cards' database */
+/* Run as a superuser (or the database owner with pg_trgm trusted), e.g.: */
+/*     psql -d cards -f migrations/001_trigram_indexes.sql */
+
+/* CONCURRENTLY builds each index without blocking reads or writes on public.cardinfo */
+/* It cannot run inside a transaction block, so do not wrap this file in BEGIN/COMMIT */
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cardinfo_sport_trgm_idx ON public.cardinfo USING gin (sport gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cardinfo_lastname_trgm_idx ON public.cardinfo USING gin ("lastName" gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cardinfo_firstname_trgm_idx ON public.cardinfo USING gin ("firstName" gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cardinfo_team_trgm_idx ON public.cardinfo USING gin (team gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cardinfo_company_trgm_idx ON public.cardinfo USING gin (company gin_trgm_ops);
+
+/* Refresh planner statistics so the new indexes are considered right away */
+ANALYZE public.cardinfo;
@@ -0,0 +1,83 @@
+/* Step 1 of 3: moves an existing public.cardinfo to the year-partitioned, bigint-ID layout */
+/* Needs PostgreSQL 11 or later. Run as the table owner or a superuser, e.g.: */
+/*     psql -d cards -f migrations/002_partitioned_table.sql */
+/*     psql -d cards -f migrations/003_partition_backfill.sql */
+/*     psql -d cards -f migrations/004_partition_swap.sql */
+
+/* The app keeps running throughout. This step creates the new table next to the old one and */
+/* adds a trigger that mirrors every insert, update and delete on the old table into it. */
+/* Step 2 copies the existing rows over in small batches, and step 3 swaps the tables */
+/* in one short transaction. */
+
+BEGIN;
+
+/* Same columns as public.cardinfo, but "ID" is bigint. The default is set at the swap: until */
+/* then every ID comes from the old table */
+CREATE TABLE public.cardinfo_new
+(
+  "ID" bigint NOT NULL,
+  sport character varying(50) NOT NULL,
+  "lastName" character varying NOT NULL,
+  "firstName" character varying(50) NOT NULL,
+  year smallint NOT NULL,
+  team character varying(50) NOT NULL,
+  company character varying(50) NOT NULL,
+  "valueEst" money,
+  "saleDate" date,
+  "salePrice" money,
+  PRIMARY KEY ("ID", year)
+)
+PARTITION BY RANGE (year);
+
+CREATE TABLE public.cardinfo_pre1950 PARTITION OF public.cardinfo_new FOR VALUES FROM (MINVALUE) TO (1950);
+CREATE TABLE public.cardinfo_1950s PARTITION OF public.cardinfo_new FOR VALUES FROM (1950) TO (1960);
+CREATE TABLE public.cardinfo_1960s PARTITION OF public.cardinfo_new FOR VALUES FROM (1960) TO (1970);
+CREATE TABLE public.cardinfo_1970s PARTITION OF public.cardinfo_new FOR VALUES FROM (1970) TO (1980);
+CREATE TABLE public.cardinfo_1980s PARTITION OF public.cardinfo_new FOR VALUES FROM (1980) TO (1990);
+CREATE TABLE public.cardinfo_1990s PARTITION OF public.cardinfo_new FOR VALUES FROM (1990) TO (2000);
+CREATE TABLE public.cardinfo_2000s PARTITION OF public.cardinfo_new FOR VALUES FROM (2000) TO (2010);
+CREATE TABLE public.cardinfo_2010s PARTITION OF public.cardinfo_new FOR VALUES FROM (2010) TO (2020);
+CREATE TABLE public.cardinfo_2020s PARTITION OF public.cardinfo_new FOR VALUES FROM (2020) TO (2030);
+CREATE TABLE public.cardinfo_default PARTITION OF public.cardinfo_new DEFAULT;
+
+/* The same keyset and trigram indexes as create_table_and_role.sql. The names get a 'part' */
+/* prefix because the old table's indexes still use the plain ones */
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX cardinfo_part_sport_id_idx ON public.cardinfo_new (sport, "ID");
+CREATE INDEX cardinfo_part_lastname_id_idx ON public.cardinfo_new ("lastName", "ID");
+CREATE INDEX cardinfo_part_firstname_id_idx ON public.cardinfo_new ("firstName", "ID");
+CREATE INDEX cardinfo_part_year_id_idx ON public.cardinfo_new (year, "ID");
+CREATE INDEX cardinfo_part_team_id_idx ON public.cardinfo_new (team, "ID");
+CREATE INDEX cardinfo_part_company_id_idx ON public.cardinfo_new (company, "ID");
+CREATE INDEX cardinfo_part_valueest_id_idx ON public.cardinfo_new ("valueEst", "ID");
+CREATE INDEX cardinfo_part_saledate_id_idx ON public.cardinfo_new ("saleDate", "ID");
+CREATE INDEX cardinfo_part_saleprice_id_idx ON public.cardinfo_new ("salePrice", "ID");
+CREATE INDEX cardinfo_part_sport_trgm_idx ON public.cardinfo_new USING gin (sport gin_trgm_ops);
+CREATE INDEX cardinfo_part_lastname_trgm_idx ON public.cardinfo_new USING gin ("lastName" gin_trgm_ops);
+CREATE INDEX cardinfo_part_firstname_trgm_idx ON public.cardinfo_new USING gin ("firstName" gin_trgm_ops);
+CREATE INDEX cardinfo_part_team_trgm_idx ON public.cardinfo_new USING gin (team gin_trgm_ops);
+CREATE INDEX cardinfo_part_company_trgm_idx ON public.cardinfo_new USING gin (company gin_trgm_ops);
+
+/* Keeps the new table in step with every change made to the old one while the copy runs */
+/* An update is mirrored as delete + insert, because a new year can move the row to another partition */
+CREATE FUNCTION public.cardinfo_mirror() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    DELETE FROM public.cardinfo_new WHERE "ID" = OLD."ID";
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO public.cardinfo_new VALUES (NEW.*) ON CONFLICT DO NOTHING;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER cardinfo_mirror AFTER INSERT OR UPDATE OR DELETE ON public.cardinfo
+  FOR EACH ROW EXECUTE PROCEDURE public.cardinfo_mirror();
+
+/* Where the backfill in step 2 has got to, so it can be stopped and resumed */
+CREATE TABLE public.cardinfo_backfill (last_id bigint NOT NULL);
+INSERT INTO public.cardinfo_backfill VALUES (0);
+
+COMMIT;
@@ -0,0 +1,44 @@
+/* Step 2 of 3: copies the existing rows of public.cardinfo into public.cardinfo_new, see 002 */
+/*     psql -d cards -f migrations/003_partition_backfill.sql */
+
+/* Each batch of IDs is copied and committed on its own, so no lock is held for long and the */
+/* app keeps working. The rows are locked FOR UPDATE while they are copied, which makes the */
+/* copy read the latest committed version of each row and makes concurrent edits of those */
+/* rows wait for the batch. Rows the mirror trigger already copied are skipped by ON CONFLICT. */
+/* If the script is stopped, running it again resumes after the last committed batch. */
+
+/* Do not wrap this file in BEGIN/COMMIT: the COMMIT between batches needs PostgreSQL 11 or */
+/* later, and only works outside a transaction block */
+
+/* Rows per batch: smaller batches hold their row locks for less time */
+SET carddb.batch_size = 10000;
+
+DO $$
+DECLARE
+  batch_size bigint := current_setting('carddb.batch_size')::bigint;
+  from_id bigint;
+  max_id bigint;
+  copied bigint;
+BEGIN
+  SELECT last_id INTO from_id FROM public.cardinfo_backfill;
+  SELECT coalesce(max("ID"), 0) INTO max_id FROM public.cardinfo;
+
+  WHILE from_id < max_id LOOP
+    WITH batch AS (
+      SELECT * FROM public.cardinfo
+      WHERE "ID" > from_id AND "ID" <= from_id + batch_size
+      FOR UPDATE
+    )
+    INSERT INTO public.cardinfo_new SELECT * FROM batch ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS copied = ROW_COUNT;
+
+    from_id := from_id + batch_size;
+    UPDATE public.cardinfo_backfill SET last_id = least(from_id, max_id);
+    COMMIT;
+
+    RAISE NOTICE 'copied % rows, up to ID % of %', copied, least(from_id, max_id), max_id;
+  END LOOP;
+END;
+$$;
+
+ANALYZE public.cardinfo_new;
@@ -0,0 +1,45 @@
+/* Step 3 of 3: swaps the partitioned copy in for public.cardinfo, see 002 */
+/*     psql -d cards -f migrations/004_partition_swap.sql */
+
+/* Runs in one transaction. The old table is locked for the row-count check and the renames, */
+/* usually well under a second, and everything is rolled back if the counts do not match. */
+/* Queries waiting on the lock then run against the new table. The old table is kept as */
+/* public.cardinfo_old: drop it once the app has been checked. */
+
+BEGIN;
+
+LOCK TABLE public.cardinfo IN ACCESS EXCLUSIVE MODE;
+
+DO $$
+DECLARE
+  old_rows bigint;
+  new_rows bigint;
+BEGIN
+  SELECT count(*) INTO old_rows FROM public.cardinfo;
+  SELECT count(*) INTO new_rows FROM public.cardinfo_new;
+  IF old_rows <> new_rows THEN
+    RAISE EXCEPTION 'cardinfo has % rows but cardinfo_new has %, run 003_partition_backfill.sql again', old_rows, new_rows;
+  END IF;
+END;
+$$;
+
+DROP TRIGGER cardinfo_mirror ON public.cardinfo;
+DROP FUNCTION public.cardinfo_mirror();
+DROP TABLE public.cardinfo_backfill;
+
+ALTER TABLE public.cardinfo RENAME TO cardinfo_old;
+ALTER TABLE public.cardinfo_new RENAME TO cardinfo;
+
+/* Keep using the old ID sequence, widened to bigint, so new IDs carry on where they left off */
+/* and the existing grant on it still applies */
+ALTER SEQUENCE public."cardinfo_ID_seq" AS bigint;
+ALTER SEQUENCE public."cardinfo_ID_seq" OWNED BY public.cardinfo."ID";
+ALTER TABLE public.cardinfo ALTER COLUMN "ID" SET DEFAULT nextval('public."cardinfo_ID_seq"');
+ALTER TABLE public.cardinfo_old ALTER COLUMN "ID" DROP DEFAULT;
+
+ALTER TABLE public.cardinfo OWNER TO postgres;
+GRANT SELECT, UPDATE, INSERT, DELETE ON TABLE public.cardinfo TO py_carddb;
+
+COMMIT;
+
+ANALYZE public.cardinfo;
@@ -0,0 +1,21 @@
+/* Adds the generated search_doc column and its GIN index used by the free-text search */
+/* Needs PostgreSQL 12 or later. Run as the table owner or a superuser, e.g.: */
+/*     psql -d cards -f migrations/005_full_text_search.sql */
+
+/* Adding a stored generated column rewrites the whole table under an exclusive lock, and an */
+/* index on a partitioned table cannot be built CONCURRENTLY, so run this when CardDB is not */
+/* in use. It takes about as long as copying the table once */
+
+BEGIN;
+
+ALTER TABLE public.cardinfo ADD COLUMN IF NOT EXISTS search_doc tsvector GENERATED ALWAYS AS (
+  setweight(to_tsvector('simple', "lastName" || ' ' || "firstName"), 'A') ||
+  setweight(to_tsvector('simple', team), 'B') ||
+  setweight(to_tsvector('simple', sport || ' ' || company || ' ' || year::text), 'C')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS cardinfo_search_doc_idx ON public.cardinfo USING gin (search_doc);
+
+COMMIT;
+
+ANALYZE public.cardinfo;
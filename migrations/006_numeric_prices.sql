@@ -0,0 +1,25 @@
+/* Changes "valueEst" and "salePrice" from money to numeric(10,2) */
+/* Run as the table owner or a superuser, e.g.: */
+/*     psql -d cards -f migrations/006_numeric_prices.sql */
+
+/* money is formatted by the server's lc_monetary setting and has no division, so totals and */
+/* averages had to be cast back and forth, and price searches compared against locale text. */
+/* numeric(10,2) is exact, locale-free, and arrives in Python as a Decimal. */
+
+/* Changing a column type rewrites the table and rebuilds its indexes, including the */
+/* ("valueEst", "ID") and ("salePrice", "ID") b-trees that serve price range searches, under an */
+/* exclusive lock. Run this when CardDB is not in use. */
+
+BEGIN;
+
+ALTER TABLE public.cardinfo
+  ALTER COLUMN "valueEst" TYPE numeric(10,2) USING "valueEst"::numeric,
+  ALTER COLUMN "salePrice" TYPE numeric(10,2) USING "salePrice"::numeric;
+
+/* Indexes missing from databases created before the keyset paging indexes were added */
+CREATE INDEX IF NOT EXISTS cardinfo_valueest_id_idx ON public.cardinfo ("valueEst", "ID");
+CREATE INDEX IF NOT EXISTS cardinfo_saleprice_id_idx ON public.cardinfo ("salePrice", "ID");
+
+COMMIT;
+
+ANALYZE public.cardinfo;
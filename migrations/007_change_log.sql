@@ -0,0 +1,64 @@
+/* Adds public.cardinfo_changes, a log of every insert, update and delete on public.cardinfo */
+/* Needs PostgreSQL 12 or later. Run as the table owner or a superuser, e.g.: */
+/*     psql -d cards -f migrations/007_change_log.sql */
+
+/* Backups and copies of the collection can then be brought up to date from the log with */
+/* 'python main.py changes --since POSITION --out FILE', which reads only the changes made since */
+/* the last run, instead of copying the whole table again. */
+
+/* The triggers are statement-level with transition tables, so an import or bulk delete logs all */
+/* of its rows with one INSERT ... SELECT rather than one trigger call per row. */
+
+BEGIN;
+
+/* One row per changed card, in the order the changes were made. 'card' is the card as it is */
+/* after the change, or NULL when it was deleted. 'xid' is the writing transaction: the export */
+/* reads whole ranges of finished transactions, so a transaction that commits late is never */
+/* skipped, see changes_horizon_query in queries.py */
+CREATE TABLE IF NOT EXISTS public.cardinfo_changes
+(
+  version bigserial PRIMARY KEY,
+  xid bigint NOT NULL DEFAULT txid_current(),
+  changed_at timestamp with time zone NOT NULL DEFAULT now(),
+  op character(1) NOT NULL,
+  "ID" bigint NOT NULL,
+  card jsonb
+);
+
+CREATE INDEX IF NOT EXISTS cardinfo_changes_xid_idx ON public.cardinfo_changes (xid);
+CREATE INDEX IF NOT EXISTS cardinfo_changes_changed_at_idx ON public.cardinfo_changes (changed_at);
+
+/* SECURITY DEFINER lets the app's role write the log through the triggers while it can only */
+/* read the log itself. search_doc is left out, a copy can generate it again from the columns */
+CREATE OR REPLACE FUNCTION public.cardinfo_log_changes() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    INSERT INTO public.cardinfo_changes (op, "ID", card)
+      SELECT 'D', o."ID", NULL FROM old_cards AS o ORDER BY o."ID";
+  ELSE
+    INSERT INTO public.cardinfo_changes (op, "ID", card)
+      SELECT left(TG_OP, 1), n."ID", to_jsonb(n) - 'search_doc' FROM new_cards AS n ORDER BY n."ID";
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+/* A trigger with transition tables handles a single event, so each gets its own */
+DROP TRIGGER IF EXISTS cardinfo_log_inserts ON public.cardinfo;
+DROP TRIGGER IF EXISTS cardinfo_log_updates ON public.cardinfo;
+DROP TRIGGER IF EXISTS cardinfo_log_deletes ON public.cardinfo;
+
+CREATE TRIGGER cardinfo_log_inserts AFTER INSERT ON public.cardinfo
+  REFERENCING NEW TABLE AS new_cards FOR EACH STATEMENT EXECUTE PROCEDURE public.cardinfo_log_changes();
+CREATE TRIGGER cardinfo_log_updates AFTER UPDATE ON public.cardinfo
+  REFERENCING NEW TABLE AS new_cards FOR EACH STATEMENT EXECUTE PROCEDURE public.cardinfo_log_changes();
+CREATE TRIGGER cardinfo_log_deletes AFTER DELETE ON public.cardinfo
+  REFERENCING OLD TABLE AS old_cards FOR EACH STATEMENT EXECUTE PROCEDURE public.cardinfo_log_changes();
+
+GRANT SELECT ON TABLE public.cardinfo_changes TO py_carddb;
+
+COMMIT;
+
+/* The log only grows. Once every copy has synced past a position, older rows can be removed: */
+/*     DELETE FROM public.cardinfo_changes WHERE xid < POSITION; */
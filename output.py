@@ -0,0 +1,162 @@
+#! usr/bin/env Python3
+
+# Text tables for CardDB's results, written a row at a time.
+#
+# A layout fixes each column's heading, width and alignment before the first row is seen, so a
+# table can be written while its rows are still arriving from a cursor: memory holds one row, and
+# the first lines appear as soon as the first row is fetched. Cells longer than their column wrap
+# onto extra lines. card_layout() is the table every card listing uses, report_layout() fits one of
+# queries.reports.
+#
+# pager() sends long output through a pager (CARDDB_PAGER, or PAGER, or 'less -FRX') when the
+# output is a terminal; set CARDDB_PAGER to an empty value to turn it off.
+
+import contextlib
+import decimal
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import textwrap
+
+import queries
+
+
+card_header = ['ID', 'Sport', 'Last name', 'First name', 'Year', 'Team', 'Co.', 'Est. Value', 'Sale date', 'Sale price']
+card_widths = [8, 10, 10, 10, 6, 10, 10, 10, 10, 10]
+
+# Rows written between flushes, so a slow cursor still shows progress
+flush_every = 50
+
+
+#---LAYOUT-----------------------------------------------------------------------------------------------------
+
+
+def money_text(val):
+    # A Decimal price as the tables show it, e.g. $1,234.50
+    return '' if val is None else '${:,.2f}'.format(val)
+
+
+def card_cells(card):
+    # One Card as the text of its table cells
+    return [card.ID, card.sport, card.lastName, card.firstName, card.year, card.team, card.company,
+            money_text(card.valueEst), card.saleDate, money_text(card.salePrice)]
+
+
+def value_text(val):
+    # Any other cell value: blank for NULL, thousands separators for Decimal amounts
+    if val is None:
+        return ''
+    if isinstance(val, decimal.Decimal):
+        return '{:,}'.format(val)
+    return str(val)
+
+
+def layout(header, widths, align, cells=None, valign='t'):
+    # A fixed table layout; 'cells' turns one row into its list of cell values
+    return {'header': header, 'widths': widths, 'align': align, 'valign': valign, 'cells': cells or list}
+
+
+def card_layout(sources=False):
+    # The card table shared by searches, edits, vends and deletes
+    # With 'sources', rows are (collection label, Card) pairs and the label gets its own column
+    if sources:
+        return layout(['Source'] + card_header, [10] + card_widths, 'c' * (len(card_header) + 1),
+                      lambda item: [item[0]] + card_cells(item[1]), valign='m')
+    return layout(card_header, card_widths, 'c' * len(card_header), card_cells, valign='m')
+
+
+def report_layout(name):
+    # One of queries.reports: the first column left-aligned, the figures right-aligned
+    header = queries.reports[name][1]
+    widths = [max(len(heading), 12) for heading in header]
+    return layout(header, widths, 'l' + 'r' * (len(header) - 1))
+
+
+#---WRITING----------------------------------------------------------------------------------------------------
+
+
+def rule(lay, char='-'):
+    # A horizontal line across the table
+    return '+' + '+'.join(char * (width + 2) for width in lay['widths']) + '+'
+
+
+def row_lines(lay, values):
+    # The lines one row takes, each cell wrapped to its column width and aligned
+    wrapped = [textwrap.wrap(value_text(val), width) or [''] for val, width in zip(values, lay['widths'])]
+    height = max(len(lines) for lines in wrapped)
+
+    columns = []
+    for lines, width, align in zip(wrapped, lay['widths'], lay['align']):
+        top = (height - len(lines)) // 2 if lay['valign'] == 'm' else 0
+        lines = [''] * top + lines + [''] * (height - top - len(lines))
+        if align == 'l':
+            columns.append([line.ljust(width) for line in lines])
+        elif align == 'r':
+            columns.append([line.rjust(width) for line in lines])
+        else:
+            columns.append([line.center(width) for line in lines])
+
+    return ['| ' + ' | '.join(parts) + ' |' for parts in zip(*columns)]
+
+
+def write_table(lay, rows, out=None):
+    # Write a table to 'out' (standard output by default) as 'rows' are iterated, return the row count
+    # 'rows' may be a list or a cursor, which is read one row at a time
+    out = out or sys.stdout
+    line = rule(lay)
+    out.write(line + '\n')
+    out.write('\n'.join(row_lines(lay, lay['header'])) + '\n')
+    out.write(rule(lay, '=') + '\n')
+
+    count = 0
+    for row in rows:
+        out.write('\n'.join(row_lines(lay, lay['cells'](row))) + '\n' + line + '\n')
+        count += 1
+        if count % flush_every == 0:
+            out.flush()
+    out.flush()
+    return count
+
+
+#---PAGER------------------------------------------------------------------------------------------------------
+
+
+def pager_command():
+    # The pager to run, or None to write straight to the terminal
+    command = os.environ.get('CARDDB_PAGER', os.environ.get('PAGER'))
+    if command is None and shutil.which('less'):
+        # -F exits at once when the output fits on one screen, -X leaves it on the screen afterwards
+        command = 'less -FRX'
+    if not command or not sys.stdout.isatty():
+        return None
+    return command
+
+
+@contextlib.contextmanager
+def pager():
+    # A text stream for long output: a pager's input when one is available, standard output otherwise
+    command = pager_command()
+    if command is None:
+        yield sys.stdout
+        return
+
+    try:
+        proc = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, universal_newlines=True,
+                                encoding='utf-8')
+    except OSError:
+        yield sys.stdout
+        return
+
+    try:
+        yield proc.stdin
+    except BrokenPipeError:
+        # The pager was closed before all the output was written
+        pass
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        proc.wait()
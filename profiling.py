@@ -0,0 +1,147 @@
+#! usr/bin/env Python3
+
+# Per-statement timing for CardDB, switched on with --profile or --profile-out.
+#
+# While profiling is on, every statement run through queries.execute() and every COPY or batch
+# statement wrapped in measure() records its wall time, rows returned (or affected) and the bytes
+# of result data fetched, grouped by query type ('count', 'page', 'card_by_id' ...). SELECTs slower
+# than --profile-slow milliseconds are run once more under EXPLAIN (ANALYZE, BUFFERS) and the plan
+# is kept. summary() collects it all per session, with a latency histogram per query type, and
+# write() saves it as JSON so two sessions can be compared.
+
+import contextlib
+import json
+import threading
+import time
+
+
+enabled = False
+slow_ms = 100.0
+
+# Upper bounds of the latency histogram buckets in milliseconds, the last bucket is everything slower
+buckets = [1, 5, 10, 50, 100, 500, 1000]
+
+# Plans kept for slow statements, the slowest first once summarized
+max_plans = 20
+
+stats = {}
+slow_plans = []
+session_start = None
+lock = threading.Lock()
+
+
+def start(slow=100.0):
+    # Turn profiling on for the rest of the session
+    global enabled
+    global slow_ms
+    global session_start
+
+    enabled = True
+    slow_ms = slow
+    session_start = time.time()
+
+
+def record(kind, seconds, rows=0, nbytes=0, error=False):
+    # Add one statement's timing to its query type
+    ms = seconds * 1000
+    with lock:
+        entry = stats.setdefault(kind, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                        'rows': 0, 'bytes': 0, 'histogram': [0] * (len(buckets) + 1)})
+        entry['count'] += 1
+        entry['errors'] += 1 if error else 0
+        entry['total_ms'] += ms
+        entry['max_ms'] = max(entry['max_ms'], ms)
+        entry['rows'] += rows
+        entry['bytes'] += nbytes
+        entry['histogram'][len([bound for bound in buckets if ms > bound])] += 1
+
+
+def result_size(cur):
+    # Rows and approximate bytes of the result just fetched by a client-side cursor
+    # The rows are read and the cursor scrolled back, so the caller still fetches all of them
+    if cur.description is None:
+        return max(cur.rowcount, 0), 0
+
+    rows = cur.fetchall()
+    if len(rows) > 0:
+        cur.scroll(0, mode='absolute')
+    nbytes = sum(len(str(val).encode('utf-8')) for row in rows for val in row if val is not None)
+    return len(rows), nbytes
+
+
+def capture_plan(conn, kind, sql, explain_sql, params, seconds):
+    # Run a slow SELECT again under EXPLAIN (ANALYZE, BUFFERS) and keep the plan
+    # A savepoint keeps a failed EXPLAIN from aborting the caller's transaction
+    with conn.cursor() as ex_cur:
+        ex_cur.execute('SAVEPOINT carddb_profile')
+        try:
+            ex_cur.execute(explain_sql, params)
+            plan = '\n'.join(line[0] for line in ex_cur.fetchall())
+            ex_cur.execute('RELEASE SAVEPOINT carddb_profile')
+        except Exception as e:
+            ex_cur.execute('ROLLBACK TO SAVEPOINT carddb_profile')
+            plan = 'EXPLAIN failed: ' + str(e).strip()
+
+    with lock:
+        slow_plans.append({'kind': kind, 'ms': round(seconds * 1000, 3), 'sql': sql, 'plan': plan})
+        slow_plans.sort(key=lambda item: item['ms'], reverse=True)
+        del slow_plans[max_plans:]
+
+
+@contextlib.contextmanager
+def measure(kind):
+    # Time the statements in a 'with' block as one query type, e.g. a COPY or execute_values() batch
+    # The block may set 'rows' and 'bytes' in the yielded dict
+    if not enabled:
+        yield {}
+        return
+
+    entry = {'rows': 0, 'bytes': 0}
+    begin = time.perf_counter()
+    try:
+        yield entry
+    except:
+        record(kind, time.perf_counter() - begin, error=True)
+        raise
+    record(kind, time.perf_counter() - begin, entry['rows'], entry['bytes'])
+
+
+def summary():
+    # Everything recorded this session, as a JSON-ready dict
+    with lock:
+        kinds = {}
+        for kind, entry in sorted(stats.items()):
+            kinds[kind] = dict(entry, total_ms=round(entry['total_ms'], 3), max_ms=round(entry['max_ms'], 3),
+                               mean_ms=round(entry['total_ms'] / entry['count'], 3))
+        return {'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(session_start)),
+                'seconds': round(time.time() - session_start, 3),
+                'slow_ms': slow_ms,
+                'buckets_ms': buckets,
+                'queries': kinds,
+                'slow_plans': list(slow_plans)}
+
+
+def report_text(summ):
+    # Readable version of summary() for printing at the end of a session
+    labels = ['<={}ms'.format(bound) for bound in buckets] + ['>{}ms'.format(buckets[-1])]
+    lines = ['Query profile, {} s session started {}'.format(summ['seconds'], summ['started']), '']
+    lines.append('{:<24}{:>7}{:>7}{:>11}{:>11}{:>10}{:>12}'.format('query', 'count', 'errors', 'mean ms', 'max ms',
+                                                                 'rows', 'bytes'))
+    for kind, entry in summ['queries'].items():
+        lines.append('{:<24}{:>7}{:>7}{:>11.2f}{:>11.2f}{:>10}{:>12}'.format(kind, entry['count'], entry['errors'],
+                     entry['mean_ms'], entry['max_ms'], entry['rows'], entry['bytes']))
+        hist = ['{} {}'.format(label, num) for label, num in zip(labels, entry['histogram']) if num > 0]
+        lines.append('    ' + ', '.join(hist))
+
+    for item in summ['slow_plans']:
+        lines.append('')
+        lines.append('Slow {} ({} ms): {}'.format(item['kind'], item['ms'], item['sql']))
+        lines.append(item['plan'])
+    return '\n'.join(lines)
+
+
+def write(out_path):
+    # Save the session summary as JSON
+    with open(out_path, 'w', encoding='utf-8') as out_file:
+        json.dump(summary(), out_file, indent=2)
+        out_file.write('\n')
@@ -0,0 +1,273 @@
+#! usr/bin/env Python3
+
+# Every SQL statement CardDB runs, with its values passed as bind parameters.
+#
+# Statements run through execute() are PREPAREd the first time they are used on a connection and
+# then run with EXECUTE, so Postgres parses and plans each one once per session instead of on
+# every call. Column and table names are never taken from user input: they come from the fixed
+# lists below and are quoted here. Values, including LIMITs and OFFSETs, are always parameters, so a
+# statement's text does not change from call to call; each connection keeps at most max_prepared
+# statements and DEALLOCATEs the least recently used one to make room for another.
+
+import collections
+import hashlib
+import re
+import time
+import weakref
+
+import cards
+import db
+import profiling
+
+
+def collection_table(schema, table='cardinfo'):
+    # The card table (or another CardDB table) in a given schema; schemas come from carddb.ini, never from user input
+    return '"{}".{}'.format(schema.replace('"', '""'), table)
+
+
+# The table every statement reads and writes, 'public' unless carddb.ini or CARDDB_SCHEMA says otherwise
+card_table = collection_table(db.config['schema'])
+
+# Columns in table order, and the ones supplied when a card is added
+card_columns = list(cards.Card._fields)
+insert_columns = card_columns[1:]
+
+card_select = ', '.join('"{}"'.format(col) for col in card_columns)
+insert_names = ', '.join('"{}"'.format(col) for col in insert_columns)
+
+
+#---STATEMENTS-------------------------------------------------------------------------------------------------
+
+
+# The hot statements, looked up by name with run()
+statements = {
+    'card_by_id': 'SELECT {} FROM {} WHERE "ID" = %s'.format(card_select, card_table),
+    'insert_card': 'INSERT INTO {} ({}) VALUES ({})'.format(card_table, insert_names, ', '.join(['%s'] * len(insert_columns))),
+    'vend_card': 'UPDATE {} SET "saleDate" = %s, "salePrice" = %s WHERE "ID" = %s'.format(card_table),
+    'delete_card': 'DELETE FROM {} WHERE "ID" = %s'.format(card_table),
+}
+
+# One single-column UPDATE per editable column, e.g. statements['update_lastName']
+for col in insert_columns:
+    statements['update_' + col] = 'UPDATE {} SET "{}" = %s WHERE "ID" = %s'.format(card_table, col)
+
+
+def count_query(s_where, table=card_table):
+    # Number of cards matching a WHERE clause built by query_builder.build_where()
+    return 'SELECT count(*) FROM {} WHERE {}'.format(table, s_where)
+
+
+def page_query(s_where, order, table=card_table):
+    # One page of cards matching a WHERE clause (including any keyset seek predicate)
+    # The page size is the last parameter, after the WHERE clause's
+    return 'SELECT {} FROM {} WHERE {} ORDER BY {} LIMIT %s'.format(card_select, table, s_where, order)
+
+
+def delete_query(s_where):
+    # Delete every card matching a WHERE clause, e.g. '"ID" = ANY(%s)' for a list of IDs
+    return 'DELETE FROM {} WHERE {}'.format(card_table, s_where)
+
+
+def vend_batch_query():
+    # Record many sales in one statement, for psycopg2.extras.execute_values()
+    # Returns the IDs that matched, so the caller can report the ones that did not
+    return ('UPDATE {} AS c SET "saleDate" = v.sale_date, "salePrice" = v.sale_price '
+            'FROM (VALUES %s) AS v(card_id, sale_date, sale_price) '
+            'WHERE c."ID" = v.card_id RETURNING c."ID"').format(card_table)
+
+
+def insert_many_query():
+    # Add many cards in one statement, for psycopg2.extras.execute_values(); rows are in insert_columns order
+    return 'INSERT INTO {} ({}) VALUES %s'.format(card_table, insert_names)
+
+
+# Row template for vend_batch_query(), the casts give the VALUES list its column types
+vend_batch_template = '(%s::bigint, %s::date, %s::numeric)'
+
+
+def copy_in_query():
+    # COPY statement used by the CSV import, rows arrive in insert_columns order
+    return 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(card_table, insert_names)
+
+
+def export_csv_query(s_where):
+    # SELECT wrapped by COPY ... TO STDOUT for CSV exports
+    return 'SELECT {} FROM {} WHERE {} ORDER BY "ID"'.format(card_select, card_table, s_where)
+
+
+def export_jsonl_query(s_where):
+    # One JSON object per card, read through a named cursor for JSON Lines exports
+    return 'SELECT row_to_json(c)::text FROM (SELECT {} FROM {} WHERE {} ORDER BY "ID") AS c'\
+           .format(card_select, card_table, s_where)
+
+
+#---CHANGE_LOG-------------------------------------------------------------------------------------------------
+
+
+# Every insert, update and delete logged by the triggers from migrations/007_change_log.sql
+changes_table = collection_table(db.config['schema'], 'cardinfo_changes')
+
+# Every transaction with an ID below this one has finished, so all of its logged changes are visible
+# Change versions are drawn before their transactions commit, so a later version can become visible
+# first; a range of finished transactions, by contrast, never gains rows afterwards
+changes_horizon_query = 'SELECT txid_snapshot_xmin(txid_current_snapshot())'
+
+
+def changes_query(by_time):
+    # One JSON object per logged change, oldest first, read through a named cursor for the changes export
+    # The parameters are where to start (a position returned by an earlier export, or a timestamp if
+    # 'by_time') and the horizon to stop at, which becomes the position for the next export
+    start = 'changed_at >= %s' if by_time else 'xid >= %s'
+    return ('SELECT row_to_json(c)::text FROM (SELECT version, changed_at, op, "ID", card FROM {} '
+            'WHERE {} AND xid < %s ORDER BY version) AS c').format(changes_table, start)
+
+
+#---FULL_TEXT--------------------------------------------------------------------------------------------------
+
+
+# The generated search_doc column holds every text column and the year as a tsvector, weighted so
+# names rank above team, and team above sport, company and year; see create_table_and_role.sql
+find_match = 'search_doc @@ to_tsquery(\'simple\', %s)'
+
+
+def find_count_query():
+    # Number of cards matching a query_builder.prefix_tsquery() string
+    return 'SELECT count(*) FROM {} WHERE {}'.format(card_table, find_match)
+
+
+def find_query():
+    # One page of matching cards, best match first; the rank is returned after the card columns
+    # Every match has to be ranked before any can be returned, so pages use OFFSET rather than a seek
+    # Parameters are the tsquery string, the page size and the offset
+    return ('SELECT {0}, ts_rank_cd(search_doc, q) AS rank FROM {1}, to_tsquery(\'simple\', %s) AS q '
+            'WHERE search_doc @@ q ORDER BY rank DESC, "ID" LIMIT %s OFFSET %s').format(card_select, card_table)
+
+
+#---REPORTS----------------------------------------------------------------------------------------------------
+
+
+# Columns shared by the value reports: card counts, estimated value, and each group's share of the total value
+value_totals = ('count(*) AS cards, '
+                'count(*) FILTER (WHERE "saleDate" IS NULL) AS unsold, '
+                'count(*) FILTER (WHERE "saleDate" IS NOT NULL) AS sold, '
+                'coalesce(sum("valueEst"), 0) AS total_value, '
+                'round(100 * coalesce(sum("valueEst"), 0) / nullif(sum(sum("valueEst")) OVER (), 0), 1) AS pct_of_value')
+
+# Each report: title, column headings, SELECT list, GROUP BY and ORDER BY
+# Every report aggregates on the server, only the grouped rows are sent back
+reports = {
+    'sport': ('Estimated value by sport',
+              ['Sport', 'Cards', 'Unsold', 'Sold', 'Est. value', '% of value'],
+              'sport, ' + value_totals, 'sport', 'total_value DESC, sport'),
+    'team': ('Estimated value by sport and team',
+             ['Sport', 'Team', 'Cards', 'Unsold', 'Sold', 'Est. value', '% of value'],
+             'sport, team, ' + value_totals, 'sport, team', 'sport, total_value DESC, team'),
+    'year': ('Estimated value by year',
+             ['Year', 'Cards', 'Unsold', 'Sold', 'Est. value', '% of value'],
+             'year, ' + value_totals, 'year', 'year'),
+    'status': ('Sold and unsold cards',
+               ['Status', 'Cards', 'Est. value', 'Sale total', 'Avg. sale'],
+               'CASE WHEN "saleDate" IS NULL THEN \'unsold\' ELSE \'sold\' END AS status, count(*) AS cards, '
+               'coalesce(sum("valueEst"), 0) AS total_value, sum("salePrice") AS total_sales, '
+               'round(avg("salePrice"), 2) AS avg_sale',
+               '1', '1'),
+    'company': ('Sales by company and year',
+                ['Company', 'Year', 'Sold', 'Sale total', 'Avg. sale', 'Min. sale', 'Max. sale'],
+                'company, year, count(*) AS sold, sum("salePrice") AS total_sales, '
+                'round(avg("salePrice"), 2) AS avg_sale, min("salePrice") AS min_sale, max("salePrice") AS max_sale',
+                'company, year', 'company, year'),
+    'monthly': ('Sales per month, with running totals',
+                ['Month', 'Sold', 'Sale total', 'Running sold', 'Running total'],
+                'to_char(date_trunc(\'month\', "saleDate"), \'YYYY-MM\') AS month, count(*) AS sold, '
+                'sum("salePrice") AS total_sales, sum(count(*)) OVER (ORDER BY date_trunc(\'month\', "saleDate")) AS running_sold, '
+                'sum(sum("salePrice")) OVER (ORDER BY date_trunc(\'month\', "saleDate")) AS running_sales',
+                'date_trunc(\'month\', "saleDate")', 'date_trunc(\'month\', "saleDate")'),
+}
+
+# Sales reports only look at sold cards
+sales_reports = ['company', 'monthly']
+
+
+def report_query(name, s_where):
+    # One report over the cards matching a WHERE clause built by query_builder.build_where()
+    title, header, select, group_by, order = reports[name]
+    if name in sales_reports:
+        s_where = '({}) AND "saleDate" IS NOT NULL'.format(s_where)
+    return 'SELECT {} FROM {} WHERE {} GROUP BY {} ORDER BY {}'.format(select, card_table, s_where, group_by, order)
+
+
+#---PREPARED_EXECUTION-----------------------------------------------------------------------------------------
+
+
+# Names of the statements already prepared on each open connection, least recently used first
+# Prepared statements live as long as the server session, so a new connection starts empty
+prepared = weakref.WeakKeyDictionary()
+
+# Most statements kept prepared on one connection; searches on different column combinations each
+# have their own text, so pooled connections that live for days would otherwise keep every one
+max_prepared = 100
+
+
+def statement_name(sql):
+    # Stable name for a statement, so identical SQL text maps to one prepared statement
+    return 'carddb_' + hashlib.md5(sql.encode('utf-8')).hexdigest()[:16]
+
+
+def positional(sql):
+    # Convert psycopg2 '%s' placeholders to the $1, $2 ... form PREPARE expects
+    count = [0]
+
+    def number(match):
+        if match.group(0) == '%%':
+            return '%'
+        count[0] += 1
+        return '$' + str(count[0])
+
+    return re.sub('%%|%s', number, sql), count[0]
+
+
+def execute(cur, sql, params=(), kind=None):
+    # Run 'sql' on 'cur', preparing it on first use per connection and executing the prepared copy
+    # 'kind' names the query type in --profile summaries, defaulting to the statement's first word
+    name = statement_name(sql)
+    done = prepared.setdefault(cur.connection, collections.OrderedDict())
+
+    if name in done:
+        done.move_to_end(name)
+    else:
+        prep_sql, count = positional(sql)
+        if count != len(params):
+            raise ValueError('statement takes {} parameters, {} given'.format(count, len(params)))
+        while len(done) >= max_prepared:
+            cur.execute('DEALLOCATE {}'.format(done.popitem(last=False)[0]))
+        cur.execute('PREPARE {} AS {}'.format(name, prep_sql))
+        done[name] = True
+
+    if len(params) == 0:
+        exec_sql = 'EXECUTE {}'.format(name)
+    else:
+        exec_sql = 'EXECUTE {} ({})'.format(name, ', '.join(['%s'] * len(params)))
+
+    if not profiling.enabled:
+        cur.execute(exec_sql, params)
+        return cur
+
+    kind = kind or sql.split(None, 1)[0].lower()
+    begin = time.perf_counter()
+    try:
+        cur.execute(exec_sql, params)
+    except:
+        profiling.record(kind, time.perf_counter() - begin, error=True)
+        raise
+    seconds = time.perf_counter() - begin
+
+    rows, nbytes = profiling.result_size(cur)
+    profiling.record(kind, seconds, rows, nbytes)
+    if seconds * 1000 >= profiling.slow_ms and sql.lstrip().upper().startswith('SELECT'):
+        profiling.capture_plan(cur.connection, kind, sql, 'EXPLAIN (ANALYZE, BUFFERS) ' + exec_sql, params, seconds)
+    return cur
+
+
+def run(cur, key, params=()):
+    # Run one of the named hot statements
+    return execute(cur, statements[key], params, kind=key)
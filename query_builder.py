@@ -0,0 +1,135 @@
+#! usr/bin/env Python3
+
+# Builds the WHERE clause for searches from any number of column search terms.
+#
+# Each term is written the way it is typed at the search prompt or given to a command line flag:
+#
+#     smith           text columns: contains, case-insensitive ("lastName" ILIKE '%smith%')
+#     twins,cubs      text columns: contains any of the terms
+#     1987            other columns: equals
+#     gt50, lt1990    other columns: greater/less than; ge, le and eq also work
+#     1985..1990      other columns: between, inclusive
+#     1984,1987,1991  other columns: any of the values (= ANY, one array parameter)
+#     null, notnull   any column: is empty / is not empty, e.g. --date null for unsold cards
+#
+# The column is always left bare on one side of the comparison so its b-tree or trigram index can be
+# used, and every value is passed as a bind parameter. Terms for different columns are ANDed, so
+# Postgres applies the whole filter in one query.
+
+import datetime
+import decimal
+import re
+
+import queries
+
+
+# Column keys used throughout CardDB, mapped to column names
+columns = dict(zip('islfytcvdp', queries.card_columns))
+
+text_keys = 'slftc'
+
+operators = {'lt': '<', 'le': '<=', 'eq': '=', 'ge': '>=', 'gt': '>'}
+
+max_id = 9223372036854775807
+max_price = decimal.Decimal('99999.99')
+
+
+def parse_value(col, value):
+    # Check one value for a non-text column and convert it to its bind parameter, or raise ValueError
+    value = value.strip()
+
+    if col == 'i':
+        if not value.isdigit() or int(value) > max_id:
+            raise ValueError('IDs must be whole numbers')
+        return int(value)
+
+    if col == 'y':
+        if not value.isdigit() or len(value) != 4:
+            raise ValueError('years must have four digits, e.g. 1987')
+        return int(value)
+
+    if col == 'd':
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError('dates must be written as yyyy-mm-dd')
+
+    # Prices may be typed with a dollar sign; commas separate values, so no thousands separators
+    try:
+        price = decimal.Decimal(value.replace('$', ''))
+    except decimal.InvalidOperation:
+        raise ValueError('prices must be numbers, e.g. 12.50')
+    if not price.is_finite() or price < 0 or price > max_price:
+        raise ValueError('prices must be between 0 and {}'.format(max_price))
+    return price
+
+
+def like_pattern(value):
+    # ILIKE pattern matching 'value' anywhere, with its own % and _ matched literally
+    value = value.strip()
+    if len(value) == 0 or len(value) > 49:
+        raise ValueError('text terms must be 1 to 49 characters')
+    return '%' + value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def parse_term(col, term):
+    # Turn one column's search term into (predicate, [parameters]), or raise ValueError
+    name = '"{}"'.format(columns[col])
+    term = term.strip()
+    lowered = term.lower().replace(' ', '')
+
+    if lowered == 'null':
+        return name + ' IS NULL', []
+    if lowered in ('notnull', '!null'):
+        return name + ' IS NOT NULL', []
+
+    if col in text_keys:
+        patterns = [like_pattern(part) for part in term.split(',')]
+        if len(patterns) == 1:
+            return name + ' ILIKE %s', patterns
+        return '(' + ' OR '.join([name + ' ILIKE %s'] * len(patterns)) + ')', patterns
+
+    if '..' in lowered:
+        low, _, high = lowered.partition('..')
+        params = [parse_value(col, low), parse_value(col, high)]
+        return name + ' BETWEEN %s AND %s', params
+
+    # One list parameter whatever its length, so every list search shares one prepared statement
+    if ',' in lowered:
+        return name + ' = ANY(%s)', [[parse_value(col, part) for part in lowered.split(',')]]
+
+    op = operators.get(lowered[0:2])
+    if op is None:
+        return name + ' = %s', [parse_value(col, lowered)]
+    return '{} {} %s'.format(name, op), [parse_value(col, lowered[2:])]
+
+
+def build_where(terms):
+    # Combine (column key, term) pairs into one WHERE clause, return (where, params)
+    # Raises ValueError naming the first invalid term; no terms matches every card
+    predicates = []
+    params = []
+
+    for col, term in terms:
+        if col not in columns:
+            raise ValueError('unknown search column ' + repr(col))
+        try:
+            predicate, term_params = parse_term(col, term)
+        except ValueError as e:
+            raise ValueError('{}: {}'.format(columns[col], e))
+        predicates.append(predicate)
+        params.extend(term_params)
+
+    if len(predicates) == 0:
+        return 'TRUE', []
+    return ' AND '.join(predicates), params
+
+
+def prefix_tsquery(text):
+    # Free text like 'ripken orioles 82' as a tsquery string matching cards that have every word,
+    # each as a word prefix: 'ripken:* & orioles:* & 82:*'. Returns None if there are no words
+    # Only letters and digits are kept, so nothing typed can change the query's meaning
+    words = re.findall('[^\\W_]+', text.lower())
+    if len(words) == 0:
+        return None
+    return ' & '.join(word + ':*' for word in words)
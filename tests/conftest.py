@@ -0,0 +1,50 @@
+# Shared setup for the tests: CardDB on the SQLite backend, with a small collection in a temporary file.
+#
+#     python -m pytest -q
+#
+# No PostgreSQL server is needed. The settings are made before db.py is imported, so a carddb.ini or
+# CARDDB_ variables on the machine running the tests are ignored.
+
+import datetime
+import os
+import random
+import sys
+
+os.environ['CARDDB_BACKEND'] = 'sqlite'
+os.environ['CARDDB_CONFIG'] = os.devnull
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import backend_sqlite
+import cards
+import db
+
+
+def sample_cards(count=120, seed=3):
+    # Cards with many repeated sort values and empty prices and dates, so paging has ties and NULLs to cross
+    rng = random.Random(seed)
+    collection = []
+    for num in range(count):
+        sold = rng.random() < 0.4
+        collection.append(cards.new_card(rng.choice(['Baseball', 'Football', 'Hockey']), rng.choice(['Smith', 'Jones', 'Ripken', 'Puckett']),
+                                         rng.choice(['Cal', 'Kirby', 'Bob']), rng.choice([1985, 1987, 1987, 1990, 1991]),
+                                         rng.choice(['Twins', 'Orioles', 'Cubs']), rng.choice(['Topps', 'Fleer', 'Donruss']),
+                                         rng.choice([None, '1', '2.50', '12.75']),
+                                         datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randrange(5)) if sold else None,
+                                         rng.choice(['0.5', '3', '3.25']) if sold else None))
+    return collection
+
+
+@pytest.fixture(scope='session')
+def collection(tmp_path_factory):
+    # (connection, cards with their IDs) for a fresh database file holding sample_cards()
+    db.config['sqlite_path'] = str(tmp_path_factory.mktemp('carddb') / 'cards.sqlite')
+    conn = backend_sqlite.connect()
+    loaded = sample_cards()
+    backend_sqlite.insert_many(conn.cursor(), loaded)
+    conn.commit()
+
+    # AUTOINCREMENT numbers a fresh table's rows from 1 in insert order
+    yield conn, [card._replace(ID=num + 1) for num, card in enumerate(loaded)]
+    conn.close()
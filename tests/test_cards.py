@@ -0,0 +1,30 @@
+# cards.price: prices rounded to cents the way numeric(10,2) rounds them, and kept exact on SQLite
+
+import decimal
+
+import pytest
+
+import backend_sqlite
+import cards
+import queries
+
+
+@pytest.mark.parametrize('value, rounded', [('12.5', '12.50'), ('3', '3.00'), (7, '7.00'), ('0.004', '0.00'),
+                                            ('0.005', '0.01'), ('2.675', '2.68'), ('12.345', '12.35'), ('12.355', '12.36'),
+                                            ('99999.994', '99999.99'), (decimal.Decimal('1.125'), '1.13')])
+def test_price_rounds_half_cents_up(value, rounded):
+    assert cards.price(value) == decimal.Decimal(rounded)
+    assert str(cards.price(value)) == rounded
+
+
+def test_price_keeps_none():
+    assert cards.price(None) is None
+
+
+def test_prices_come_back_from_sqlite_unchanged(collection):
+    conn, loaded = collection
+    cur = conn.cursor()
+    backend_sqlite.insert_many(cur, [cards.new_card('Baseball', 'Gwynn', 'Tony', 1983, 'Padres', 'Fleer', '0.125', None, '1234.565')])
+    card = backend_sqlite.execute(cur, 'SELECT {} FROM {} WHERE "lastName" = %s'.format(queries.card_select, queries.card_table), ('Gwynn',)).fetchone()
+    conn.rollback()
+    assert (card.valueEst, card.salePrice) == (decimal.Decimal('0.13'), decimal.Decimal('1234.57'))
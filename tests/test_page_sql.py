@@ -0,0 +1,44 @@
+# main.page_sql: keyset paging forward and back on every sort column, run on SQLite
+
+import pytest
+
+import backend_sqlite
+import main
+import queries
+import query_builder
+
+
+def expected_order(loaded, sort_key):
+    # Cards in (sort column, "ID") order with empty values last, as a search lists them
+    col = main.columns_actual[sort_key]
+    return sorted(loaded, key=lambda card: (getattr(card, col) is None, getattr(card, col) or 0, card.ID))
+
+
+def fetch_page(conn, s_where, s_params, sort_key, row=None, direction='next', limit=7):
+    rows = backend_sqlite.execute(conn.cursor(), *main.page_sql(s_where, s_params, sort_key, row, direction, limit)).fetchall()
+    if direction == 'prev':
+        rows.reverse()
+    return rows
+
+
+@pytest.mark.parametrize('sort_key', list(main.columns_actual))
+@pytest.mark.parametrize('terms', [[], [('t', 'twins,orioles'), ('y', 'ge1987')]], ids=['all', 'filtered'])
+def test_pages_forward_and_back(collection, sort_key, terms):
+    conn, loaded = collection
+    s_where, s_params = query_builder.build_where(terms)
+    cur = backend_sqlite.execute(conn.cursor(), 'SELECT "ID" FROM {} WHERE {}'.format(queries.card_table, s_where), s_params)
+    found = {row[0] for row in cur.fetchall()}
+    matching = [card for card in loaded if card.ID in found]
+
+    # Forward from the start, each page seeking past the last row of the one before
+    pages = [fetch_page(conn, s_where, s_params, sort_key)]
+    while len(pages[-1]) == 7:
+        pages.append(fetch_page(conn, s_where, s_params, sort_key, pages[-1][-1]))
+    if len(pages[-1]) == 0:
+        pages.pop()
+    assert [card for page in pages for card in page] == expected_order(matching, sort_key)
+
+    # Back from the last page, each page ending just before the first row of the one after
+    for num in range(len(pages) - 1, 0, -1):
+        assert fetch_page(conn, s_where, s_params, sort_key, pages[num][0], 'prev') == pages[num - 1]
+    assert fetch_page(conn, s_where, s_params, sort_key, pages[0][0], 'prev') == []
@@ -0,0 +1,79 @@
+# query_builder: search terms to predicates and parameters, and the cards they find on SQLite
+
+import datetime
+import decimal
+
+import pytest
+
+import backend_sqlite
+import queries
+import query_builder
+
+
+def test_text_terms_match_anywhere_and_escape_wildcards():
+    assert query_builder.parse_term('l', ' Smith ') == ('"lastName" ILIKE %s', ['%Smith%'])
+    assert query_builder.parse_term('t', '50%_off') == ('"team" ILIKE %s', ['%50\\%\\_off%'])
+    assert query_builder.parse_term('t', 'twins,cubs') == ('("team" ILIKE %s OR "team" ILIKE %s)', ['%twins%', '%cubs%'])
+
+
+def test_ranges():
+    assert query_builder.parse_term('y', '1985..1990') == ('"year" BETWEEN %s AND %s', [1985, 1990])
+    assert query_builder.parse_term('d', '2020-01-01..2020-01-31') == \
+        ('"saleDate" BETWEEN %s AND %s', [datetime.date(2020, 1, 1), datetime.date(2020, 1, 31)])
+    assert query_builder.parse_term('p', '$1..2.50') == \
+        ('"salePrice" BETWEEN %s AND %s', [decimal.Decimal('1'), decimal.Decimal('2.50')])
+
+
+def test_comparisons():
+    assert query_builder.parse_term('v', 'gt50') == ('"valueEst" > %s', [decimal.Decimal('50')])
+    assert query_builder.parse_term('y', 'le 1990') == ('"year" <= %s', [1990])
+    assert query_builder.parse_term('i', '42') == ('"ID" = %s', [42])
+
+
+def test_lists_are_one_array_parameter():
+    assert query_builder.parse_term('y', '1984, 1987,1991') == ('"year" = ANY(%s)', [[1984, 1987, 1991]])
+    assert query_builder.parse_term('d', '2020-01-01,2020-01-03') == \
+        ('"saleDate" = ANY(%s)', [[datetime.date(2020, 1, 1), datetime.date(2020, 1, 3)]])
+
+
+def test_null_and_notnull():
+    assert query_builder.parse_term('d', 'NULL') == ('"saleDate" IS NULL', [])
+    assert query_builder.parse_term('p', 'notnull') == ('"salePrice" IS NOT NULL', [])
+    assert query_builder.parse_term('l', '!null') == ('"lastName" IS NOT NULL', [])
+
+
+@pytest.mark.parametrize('col, term', [('y', '87'), ('y', '1985..'), ('i', 'x1'), ('i', '9223372036854775808'),
+                                       ('d', '2020-13-01'), ('d', '01/02/2020'), ('p', '-1'), ('p', 'abc'),
+                                       ('p', '100000'), ('v', 'nan'), ('l', ''), ('l', 'x' * 50), ('t', 'cubs,')])
+def test_bad_terms_raise_value_error(col, term):
+    with pytest.raises(ValueError):
+        query_builder.parse_term(col, term)
+
+
+def test_build_where():
+    assert query_builder.build_where([]) == ('TRUE', [])
+    assert query_builder.build_where([('l', 'smith'), ('y', 'ge1987')]) == ('"lastName" ILIKE %s AND "year" >= %s', ['%smith%', 1987])
+    with pytest.raises(ValueError, match='^year: '):
+        query_builder.build_where([('l', 'smith'), ('y', 'soon')])
+    with pytest.raises(ValueError, match='unknown search column'):
+        query_builder.build_where([('z', '1')])
+
+
+@pytest.mark.parametrize('terms, matches', [
+    ([('l', 'SMI')], lambda card: 'smi' in card.lastName.lower()),
+    ([('t', 'twins,cubs')], lambda card: card.team in ('Twins', 'Cubs')),
+    ([('y', '1985..1987')], lambda card: 1985 <= card.year <= 1987),
+    ([('y', '1985,1991'), ('s', 'ball')], lambda card: card.year in (1985, 1991) and 'ball' in card.sport),
+    ([('d', '2020-01-02,2020-01-04')], lambda card: card.saleDate in (datetime.date(2020, 1, 2), datetime.date(2020, 1, 4))),
+    ([('p', '0.5,3.25')], lambda card: card.salePrice in (decimal.Decimal('0.5'), decimal.Decimal('3.25'))),
+    ([('v', 'gt2.5')], lambda card: card.valueEst is not None and card.valueEst > decimal.Decimal('2.5')),
+    ([('v', 'null'), ('d', 'notnull')], lambda card: card.valueEst is None and card.saleDate is not None),
+    ([('i', '1,5,9,100000')], lambda card: card.ID in (1, 5, 9)),
+])
+def test_where_finds_the_same_cards_on_sqlite(collection, terms, matches):
+    conn, loaded = collection
+    s_where, s_params = query_builder.build_where(terms)
+    cur = backend_sqlite.execute(conn.cursor(), 'SELECT "ID" FROM {} WHERE {} ORDER BY "ID"'.format(queries.card_table, s_where), s_params)
+    found = [row[0] for row in cur.fetchall()]
+    assert found == [card.ID for card in loaded if matches(card)]
+    assert len(found) > 0